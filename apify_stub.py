@@ -0,0 +1,163 @@
+# apify_stub.py — stand-in local da API do Apify (para testar o bot offline)
+#
+# Uso:
+#   python apify_stub.py
+#   APIFY_BASE_URL=http://127.0.0.1:8765 APIFY_TOKEN=stub python bot.py
+#
+# Implementa só o que o bot usa: iniciar run, estado do run (com waitForFinish),
+# itens do dataset e webhooks ad hoc no fim do run.
+import os
+import time
+import json
+import base64
+import zlib
+import secrets
+import threading
+import urllib.request
+from typing import Dict, Any, List
+
+from flask import Flask, request, jsonify
+
+STUB_PORT = int(os.getenv("APIFY_STUB_PORT", "8765"))
+# quanto tempo cada run "demora" (para testar runs longos / hand-off)
+STUB_RUN_SECONDS = float(os.getenv("APIFY_STUB_RUN_SECONDS", "3"))
+# views ganhas por hora por vídeo (crescimento simulado entre refreshes)
+STUB_VIEWS_PER_HOUR = int(os.getenv("APIFY_STUB_VIEWS_PER_HOUR", "3600"))
+# formatos de payload que devolvem dataset vazio, ex: "postURLs,startUrls"
+STUB_EMPTY_SHAPES = [x.strip() for x in os.getenv("APIFY_STUB_EMPTY_SHAPES", "").split(",") if x.strip()]
+# força um status HTTP no início do run (ex: 429, 402, 503)
+STUB_FORCE_STATUS = int(os.getenv("APIFY_STUB_FORCE_STATUS", "0") or "0")
+
+app = Flask(__name__)
+STARTED_AT = time.time()
+LOCK = threading.Lock()
+RUNS: Dict[str, Dict[str, Any]] = {}
+DATASETS: Dict[str, List[dict]] = {}
+
+def _urls_from_payload(payload: dict) -> List[str]:
+    urls: List[str] = []
+    for key in ("postURLs", "directUrls", "videoUrls"):
+        for u in payload.get(key) or []:
+            if isinstance(u, str):
+                urls.append(u)
+    for entry in payload.get("startUrls") or []:
+        if isinstance(entry, dict) and entry.get("url"):
+            urls.append(str(entry["url"]))
+        elif isinstance(entry, str):
+            urls.append(entry)
+    return urls
+
+def _payload_shape(payload: dict) -> str:
+    for key in ("postURLs", "directUrls", "startUrls", "videoUrls"):
+        if key in payload:
+            return key
+    return ""
+
+def _fake_views(url: str) -> int:
+    base = zlib.crc32(url.encode("utf-8")) % 50_000
+    growth = int((time.time() - STARTED_AT) / 3600.0 * STUB_VIEWS_PER_HOUR)
+    return base + growth
+
+def _item_for(url: str) -> dict:
+    if "instagram.com" in url.lower():
+        parts = [p for p in url.split("?")[0].split("/") if p]
+        return {"url": url, "inputUrl": url, "shortCode": parts[-1] if parts else "", "videoViewCount": _fake_views(url)}
+    return {"webVideoUrl": url, "submittedVideoUrl": url, "playCount": _fake_views(url)}
+
+def _run_view(run: dict) -> dict:
+    if run["status"] == "RUNNING" and time.time() >= run["_finish_at"]:
+        run["status"] = "SUCCEEDED"
+        run["finishedAt"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    return {k: v for k, v in run.items() if not k.startswith("_")}
+
+def _wait_for_finish(run: dict, wait_secs: float) -> dict:
+    deadline = time.time() + max(0.0, min(60.0, wait_secs))
+    while True:
+        with LOCK:
+            view = _run_view(run)
+        if view["status"] != "RUNNING" or time.time() >= deadline:
+            return view
+        time.sleep(0.2)
+
+def _fire_webhooks(run: dict):
+    hooks = run.get("_webhooks") or []
+    if not hooks:
+        return
+    time.sleep(max(0.0, run["_finish_at"] - time.time()))
+    with LOCK:
+        view = _run_view(run)
+    body = json.dumps({
+        "eventType": "ACTOR.RUN.SUCCEEDED",
+        "eventData": {"actorId": run["actId"], "actorRunId": run["id"]},
+        "resource": view,
+    }).encode("utf-8")
+    for hook in hooks:
+        url = hook.get("requestUrl")
+        if not url:
+            continue
+        try:
+            req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+            urllib.request.urlopen(req, timeout=10).read()
+        except Exception as e:
+            print("⚠️ STUB webhook falhou:", url, e)
+
+@app.post("/v2/acts/<actor_id>/runs")
+def start_run(actor_id: str):
+    if STUB_FORCE_STATUS:
+        return jsonify({"error": {"type": "stub-forced", "message": f"forced {STUB_FORCE_STATUS}"}}), STUB_FORCE_STATUS
+
+    payload = request.get_json(silent=True) or {}
+    urls = _urls_from_payload(payload)
+    shape = _payload_shape(payload)
+
+    run_id = secrets.token_hex(8)
+    dataset_id = secrets.token_hex(8)
+    items = [] if shape in STUB_EMPTY_SHAPES else [_item_for(u) for u in urls]
+
+    webhooks = []
+    raw_hooks = request.args.get("webhooks")
+    if raw_hooks:
+        try:
+            webhooks = json.loads(base64.b64decode(raw_hooks).decode("utf-8"))
+        except Exception as e:
+            print("⚠️ STUB webhooks inválidos:", e)
+
+    run = {
+        "id": run_id,
+        "actId": actor_id,
+        "status": "RUNNING",
+        "defaultDatasetId": dataset_id,
+        "startedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "_finish_at": time.time() + STUB_RUN_SECONDS,
+        "_webhooks": webhooks,
+    }
+    with LOCK:
+        RUNS[run_id] = run
+        DATASETS[dataset_id] = items
+    print(f"[STUB] run {run_id} actor={actor_id} shape={shape} urls={len(urls)}")
+
+    if webhooks:
+        threading.Thread(target=_fire_webhooks, args=(run,), daemon=True).start()
+
+    view = _wait_for_finish(run, float(request.args.get("waitForFinish") or 0))
+    return jsonify({"data": view}), 201
+
+@app.get("/v2/actor-runs/<run_id>")
+def get_run(run_id: str):
+    run = RUNS.get(run_id)
+    if not run:
+        return jsonify({"error": {"type": "record-not-found"}}), 404
+    view = _wait_for_finish(run, float(request.args.get("waitForFinish") or 0))
+    return jsonify({"data": view})
+
+@app.get("/v2/datasets/<dataset_id>/items")
+def dataset_items(dataset_id: str):
+    items = DATASETS.get(dataset_id)
+    if items is None:
+        return jsonify({"error": {"type": "record-not-found"}}), 404
+    limit = int(request.args.get("limit") or len(items) or 1)
+    return jsonify(items[:limit])
+
+if __name__ == "__main__":
+    print(f"[STUB] Apify stand-in em http://127.0.0.1:{STUB_PORT}")
+    app.run(host="127.0.0.1", port=STUB_PORT, threaded=True)
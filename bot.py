@@ -9,12 +9,23 @@ import secrets
 import string
 import signal
 import traceback
+import heapq
+import json
+import base64
+import urllib.parse
+import functools
+import hashlib
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Optional, List, Dict, Any, Tuple, Set
 
 import aiohttp
 import discord
-from discord.ext import commands, tasks
-from flask import Flask
+from discord.ext import commands
+from flask import Flask, request
 
 # =========================
 # TOKEN (Render env: TOKEN)
@@ -50,6 +61,12 @@ ADMIN_USER_ID = 1376499031890460714
 
 # DB
 DB_PATH = os.getenv("DB_PATH", "/var/data/database.sqlite3").strip()
+DB_SYNCHRONOUS = (os.getenv("DB_SYNCHRONOUS", "NORMAL").strip().upper() or "NORMAL")
+DB_CACHE_SIZE_KB = int((os.getenv("DB_CACHE_SIZE_KB", "20000").strip() or "20000"))
+DB_MMAP_SIZE_MB = int((os.getenv("DB_MMAP_SIZE_MB", "256").strip() or "256"))
+DB_BUSY_TIMEOUT_MS = int((os.getenv("DB_BUSY_TIMEOUT_MS", "5000").strip() or "5000"))
+DB_STATEMENT_CACHE = int((os.getenv("DB_STATEMENT_CACHE", "256").strip() or "256"))
+DB_READ_THREADS = max(1, int((os.getenv("DB_READ_THREADS", "2").strip() or "2")))
 
 # =========================
 # APIFY
@@ -57,13 +74,59 @@ DB_PATH = os.getenv("DB_PATH", "/var/data/database.sqlite3").strip()
 APIFY_TOKEN = os.getenv("APIFY_TOKEN", "").strip()
 APIFY_ACTOR_TIKTOK = os.getenv("APIFY_ACTOR_TIKTOK", "clockworks~tiktok-scraper").strip()
 APIFY_ACTOR_INSTAGRAM = os.getenv("APIFY_ACTOR_INSTAGRAM", "apify~instagram-scraper").strip()
-VIEWS_REFRESH_MINUTES = int((os.getenv("VIEWS_REFRESH_MINUTES", "10").strip() or "10"))
+APIFY_BATCH_SIZE = int((os.getenv("APIFY_BATCH_SIZE", "50").strip() or "50"))
+
+# depois de N falhas seguidas com o formato aprendido, volta a testar todos os formatos
+APIFY_SHAPE_REPROBE_FAILURES = max(1, int((os.getenv("APIFY_SHAPE_REPROBE_FAILURES", "3").strip() or "3")))
+
+# cache de views por post (URL normalizado / id do vídeo); TTL=0 desliga
+VIEW_CACHE_TTL_SECONDS = int((os.getenv("VIEW_CACHE_TTL_SECONDS", "900").strip() or "900"))
+VIEW_CACHE_MAX_ENTRIES = max(1, int((os.getenv("VIEW_CACHE_MAX_ENTRIES", "5000").strip() or "5000")))
+
+APIFY_MAX_CONCURRENCY = max(1, int((os.getenv("APIFY_MAX_CONCURRENCY", "4").strip() or "4")))
+APIFY_CONCURRENCY_TIKTOK = max(1, int((os.getenv("APIFY_CONCURRENCY_TIKTOK", str(APIFY_MAX_CONCURRENCY)).strip() or str(APIFY_MAX_CONCURRENCY))))
+APIFY_CONCURRENCY_INSTAGRAM = max(1, int((os.getenv("APIFY_CONCURRENCY_INSTAGRAM", str(APIFY_MAX_CONCURRENCY)).strip() or str(APIFY_MAX_CONCURRENCY))))
+# formato: "clockworks~tiktok-scraper=2,apify~instagram-scraper=3"
+APIFY_ACTOR_CONCURRENCY_RAW = os.getenv("APIFY_ACTOR_CONCURRENCY", "").strip()
+APIFY_ACTOR_CONCURRENCY: Dict[str, int] = {}
+for _part in APIFY_ACTOR_CONCURRENCY_RAW.split(","):
+    if "=" in _part:
+        _k, _v = _part.split("=", 1)
+        if _k.strip() and _v.strip().isdigit():
+            APIFY_ACTOR_CONCURRENCY[_k.strip().replace("/", "~", 1)] = max(1, int(_v.strip()))
+
+# circuit breaker por actor: abre com >= FAILURE_RATE de falhas (402/429/5xx/run falhado) nas últimas WINDOW chamadas
+APIFY_BREAKER_WINDOW = max(1, int((os.getenv("APIFY_BREAKER_WINDOW", "10").strip() or "10")))
+APIFY_BREAKER_MIN_CALLS = max(1, int((os.getenv("APIFY_BREAKER_MIN_CALLS", "4").strip() or "4")))
+APIFY_BREAKER_FAILURE_RATE = float((os.getenv("APIFY_BREAKER_FAILURE_RATE", "0.5").strip() or "0.5"))
+# tempo aberto antes de deixar passar um run de teste; duplica a cada teste falhado até ao máximo
+APIFY_BREAKER_OPEN_SECONDS = max(1, int((os.getenv("APIFY_BREAKER_OPEN_SECONDS", "300").strip() or "300")))
+APIFY_BREAKER_MAX_OPEN_SECONDS = max(APIFY_BREAKER_OPEN_SECONDS, int((os.getenv("APIFY_BREAKER_MAX_OPEN_SECONDS", "3600").strip() or "3600")))
+# token bucket por actor: teto de runs iniciados por minuto; desce a metade em cada 429 e recupera aos poucos
+APIFY_RUNS_PER_MINUTE = max(1.0, float((os.getenv("APIFY_RUNS_PER_MINUTE", "30").strip() or "30")))
+
+APIFY_BASE_URL = (os.getenv("APIFY_BASE_URL", "https://api.apify.com").strip() or "https://api.apify.com").rstrip("/")
+# o Apify limita waitForFinish a 60s por pedido
+APIFY_WAIT_FOR_FINISH_SECS = min(60, max(0, int((os.getenv("APIFY_WAIT_FOR_FINISH_SECS", "60").strip() or "60"))))
+APIFY_RUN_MAX_WAIT_SECS = int((os.getenv("APIFY_RUN_MAX_WAIT_SECS", "900").strip() or "900"))
+# URL público deste serviço (ex: https://viralizza.onrender.com) para o Apify chamar /apify/webhook no fim do run
+APIFY_WEBHOOK_URL = os.getenv("APIFY_WEBHOOK_URL", "").strip().rstrip("/")
+APIFY_WEBHOOK_SECRET = os.getenv("APIFY_WEBHOOK_SECRET", "").strip()
+# sem segredo o endpoint seria público (qualquer POST marcava runs como terminados): webhooks só com os dois
+APIFY_WEBHOOKS_ENABLED = bool(APIFY_WEBHOOK_URL and APIFY_WEBHOOK_SECRET)
 
 APIFY_USE_PROXY = (os.getenv("APIFY_USE_PROXY", "false").strip().lower() in ("1", "true", "yes", "y", "on"))
 APIFY_PROXY_COUNTRY = os.getenv("APIFY_PROXY_COUNTRY", "").strip().upper()
 APIFY_PROXY_GROUPS_RAW = os.getenv("APIFY_PROXY_GROUPS", "").strip()
 APIFY_PROXY_GROUPS = [g.strip().upper() for g in APIFY_PROXY_GROUPS_RAW.split(",") if g.strip()]
 
+# =========================
+# YOUTUBE (YouTube Data API v3, sem Apify)
+# =========================
+YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY", "").strip()
+YOUTUBE_API_BASE_URL = (os.getenv("YOUTUBE_API_BASE_URL", "https://www.googleapis.com/youtube/v3").strip() or "https://www.googleapis.com/youtube/v3").rstrip("/")
+YOUTUBE_CONCURRENCY = max(1, int((os.getenv("YOUTUBE_CONCURRENCY", "2").strip() or "2")))
+
 CAMPAIGN_SUBMISSION_LOCK_PCT = float((os.getenv("CAMPAIGN_SUBMISSION_LOCK_PCT", "0.95").strip() or "0.95"))
 
 MAX_APPROVED_PER_USER = int(os.getenv("MAX_APPROVED_PER_USER", "10").strip() or "10")
@@ -80,12 +143,67 @@ STALE_GROWTH_MIN_VIEWS = int((os.getenv("STALE_GROWTH_MIN_VIEWS", "200").strip()
 STALE_CHECKS_TO_SLOW = int((os.getenv("STALE_CHECKS_TO_SLOW", "3").strip() or "3"))
 STALE_SLOW_CHECK_HOURS = int((os.getenv("STALE_SLOW_CHECK_HOURS", "24").strip() or "24"))
 
+# histórico de views: resolução total nos últimos N dias, depois 1 ponto por bucket, até à retenção
+SNAPSHOT_FULL_RES_DAYS = max(1, int((os.getenv("SNAPSHOT_FULL_RES_DAYS", "7").strip() or "7")))
+SNAPSHOT_DOWNSAMPLE_HOURS = max(1, int((os.getenv("SNAPSHOT_DOWNSAMPLE_HOURS", "24").strip() or "24")))
+SNAPSHOT_RETENTION_DAYS = max(1, int((os.getenv("SNAPSHOT_RETENTION_DAYS", "180").strip() or "180")))
+SNAPSHOT_COMPACT_EVERY_HOURS = max(1, int((os.getenv("SNAPSHOT_COMPACT_EVERY_HOURS", "24").strip() or "24")))
+
+# o scheduler dorme até ao próximo check; de X em X minutos recarrega a fila a partir da DB (rede de segurança)
+# "velocity" (usa a velocidade de crescimento) ou "age" (só idade do vídeo + stale_checks)
+CHECK_POLICY = os.getenv("CHECK_POLICY", "velocity").strip().lower() or "velocity"
+VELOCITY_MIN_CHECK_MINUTES = max(1, int((os.getenv("VELOCITY_MIN_CHECK_MINUTES", "30").strip() or "30")))
+VELOCITY_MAX_CHECK_HOURS = max(1, int((os.getenv("VELOCITY_MAX_CHECK_HOURS", "72").strip() or "72")))
+VELOCITY_WINDOW_HOURS = max(1, int((os.getenv("VELOCITY_WINDOW_HOURS", "24").strip() or "24")))
+VELOCITY_FAST_VIEWS_PER_HOUR = max(1, int((os.getenv("VELOCITY_FAST_VIEWS_PER_HOUR", "5000").strip() or "5000")))
+
+SCHEDULER_RESYNC_MINUTES = max(1, int((os.getenv("SCHEDULER_RESYNC_MINUTES", "60").strip() or "60")))
+# junta no mesmo ciclo os checks que vencem dentro desta janela (para aproveitar o batch do Apify)
+SCHEDULER_BATCH_WINDOW_SECONDS = max(0, int((os.getenv("SCHEDULER_BATCH_WINDOW_SECONDS", "5").strip() or "5")))
+# junta atualizações da leaderboard da mesma campanha dentro desta janela (0 = imediato)
+LEADERBOARD_DEBOUNCE_SECONDS = max(0.0, float((os.getenv("LEADERBOARD_DEBOUNCE_SECONDS", "15").strip() or "15")))
+# fila persistente de DMs (fim de campanha, limites atingidos)
+NOTIFY_CONCURRENCY = max(1, int((os.getenv("NOTIFY_CONCURRENCY", "4").strip() or "4")))
+NOTIFY_BATCH_SIZE = max(1, int((os.getenv("NOTIFY_BATCH_SIZE", "50").strip() or "50")))
+NOTIFY_MAX_ATTEMPTS = max(1, int((os.getenv("NOTIFY_MAX_ATTEMPTS", "5").strip() or "5")))
+NOTIFY_RETRY_BASE_SECONDS = max(1, int((os.getenv("NOTIFY_RETRY_BASE_SECONDS", "30").strip() or "30")))
+# o Discord dá 3s para responder a uma interação; passado este tempo fazemos defer e respondemos por followup
+INTERACTION_DEFER_BUDGET_SECONDS = max(0.0, float((os.getenv("INTERACTION_DEFER_BUDGET_SECONDS", "1.5").strip() or "1.5")))
+# quantos painéis (verificações / submissão) reanexamos em paralelo no arranque
+REATTACH_CONCURRENCY = max(1, int((os.getenv("REATTACH_CONCURRENCY", "8").strip() or "8")))
+# quanto tempo um user que saiu (404) fica marcado como ausente antes de voltar a tentar REST
+MEMBER_ABSENT_TTL_SECONDS = max(0, int((os.getenv("MEMBER_ABSENT_TTL_SECONDS", "3600").strip() or "3600")))
+# HEAD para resolver links curtos (vm.tiktok.com, instagram share…); se passar, fica o link tal como veio
+SHORT_LINK_TIMEOUT_SECONDS = max(0.5, float((os.getenv("SHORT_LINK_TIMEOUT_SECONDS", "2").strip() or "2")))
+
 print("DISCORD VERSION:", getattr(discord, "__version__", "unknown"))
 print("DB_PATH:", DB_PATH)
+print("DB_SYNCHRONOUS:", DB_SYNCHRONOUS)
+print("DB_CACHE_SIZE_KB:", DB_CACHE_SIZE_KB)
+print("DB_MMAP_SIZE_MB:", DB_MMAP_SIZE_MB)
+print("DB_READ_THREADS:", DB_READ_THREADS)
 print("APIFY_TOKEN set:", bool(APIFY_TOKEN))
 print("APIFY_ACTOR_TIKTOK:", APIFY_ACTOR_TIKTOK)
 print("APIFY_ACTOR_INSTAGRAM:", APIFY_ACTOR_INSTAGRAM)
-print("VIEWS_REFRESH_MINUTES:", VIEWS_REFRESH_MINUTES)
+print("APIFY_BATCH_SIZE:", APIFY_BATCH_SIZE)
+print("APIFY_SHAPE_REPROBE_FAILURES:", APIFY_SHAPE_REPROBE_FAILURES)
+print("VIEW_CACHE_TTL_SECONDS:", VIEW_CACHE_TTL_SECONDS)
+print("VIEW_CACHE_MAX_ENTRIES:", VIEW_CACHE_MAX_ENTRIES)
+print("APIFY_MAX_CONCURRENCY:", APIFY_MAX_CONCURRENCY)
+print("APIFY_CONCURRENCY_TIKTOK:", APIFY_CONCURRENCY_TIKTOK)
+print("APIFY_CONCURRENCY_INSTAGRAM:", APIFY_CONCURRENCY_INSTAGRAM)
+print("APIFY_BREAKER_FAILURE_RATE:", APIFY_BREAKER_FAILURE_RATE, "window:", APIFY_BREAKER_WINDOW)
+print("APIFY_BREAKER_OPEN_SECONDS:", APIFY_BREAKER_OPEN_SECONDS)
+print("APIFY_RUNS_PER_MINUTE:", APIFY_RUNS_PER_MINUTE)
+print("YOUTUBE_API_KEY set:", bool(YOUTUBE_API_KEY))
+print("YOUTUBE_CONCURRENCY:", YOUTUBE_CONCURRENCY)
+print("APIFY_ACTOR_CONCURRENCY:", APIFY_ACTOR_CONCURRENCY)
+print("APIFY_BASE_URL:", APIFY_BASE_URL)
+print("APIFY_WAIT_FOR_FINISH_SECS:", APIFY_WAIT_FOR_FINISH_SECS)
+print("APIFY_RUN_MAX_WAIT_SECS:", APIFY_RUN_MAX_WAIT_SECS)
+print("APIFY_WEBHOOK_URL:", APIFY_WEBHOOK_URL)
+if APIFY_WEBHOOK_URL and not APIFY_WEBHOOK_SECRET:
+    print("⚠️ APIFY_WEBHOOK_URL definido sem APIFY_WEBHOOK_SECRET: webhooks desligados, a usar long-poll.")
 print("APIFY_USE_PROXY:", APIFY_USE_PROXY)
 print("APIFY_PROXY_COUNTRY:", APIFY_PROXY_COUNTRY)
 print("APIFY_PROXY_GROUPS:", APIFY_PROXY_GROUPS)
@@ -97,10 +215,28 @@ print("AFTER_30_DAYS_CHECK_HOURS:", AFTER_30_DAYS_CHECK_HOURS)
 print("STALE_GROWTH_MIN_VIEWS:", STALE_GROWTH_MIN_VIEWS)
 print("STALE_CHECKS_TO_SLOW:", STALE_CHECKS_TO_SLOW)
 print("STALE_SLOW_CHECK_HOURS:", STALE_SLOW_CHECK_HOURS)
+print("CHECK_POLICY:", CHECK_POLICY)
+print("VELOCITY_MIN_CHECK_MINUTES:", VELOCITY_MIN_CHECK_MINUTES)
+print("VELOCITY_MAX_CHECK_HOURS:", VELOCITY_MAX_CHECK_HOURS)
+print("VELOCITY_FAST_VIEWS_PER_HOUR:", VELOCITY_FAST_VIEWS_PER_HOUR)
+print("VELOCITY_WINDOW_HOURS:", VELOCITY_WINDOW_HOURS)
+print("SNAPSHOT_FULL_RES_DAYS:", SNAPSHOT_FULL_RES_DAYS)
+print("SNAPSHOT_DOWNSAMPLE_HOURS:", SNAPSHOT_DOWNSAMPLE_HOURS)
+print("SNAPSHOT_RETENTION_DAYS:", SNAPSHOT_RETENTION_DAYS)
+print("SCHEDULER_RESYNC_MINUTES:", SCHEDULER_RESYNC_MINUTES)
+print("SCHEDULER_BATCH_WINDOW_SECONDS:", SCHEDULER_BATCH_WINDOW_SECONDS)
+print("LEADERBOARD_DEBOUNCE_SECONDS:", LEADERBOARD_DEBOUNCE_SECONDS)
+print("MEMBER_ABSENT_TTL_SECONDS:", MEMBER_ABSENT_TTL_SECONDS)
+print("NOTIFY_CONCURRENCY:", NOTIFY_CONCURRENCY)
+print("NOTIFY_MAX_ATTEMPTS:", NOTIFY_MAX_ATTEMPTS)
+print("INTERACTION_DEFER_BUDGET_SECONDS:", INTERACTION_DEFER_BUDGET_SECONDS)
+print("REATTACH_CONCURRENCY:", REATTACH_CONCURRENCY)
+print("SHORT_LINK_TIMEOUT_SECONDS:", SHORT_LINK_TIMEOUT_SECONDS)
 
 # =========================
 # BOT / INTENTS
 # =========================
+BOOT_STARTED_AT = time.monotonic()
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
@@ -170,9 +306,104 @@ def _ensure_db_dir(path: str):
     except Exception as e:
         print("⚠️ Não consegui criar pasta do DB:", e)
 
-def db_conn():
+class PooledConnection:
+    # ligação longa (uma por thread); close() não fecha, só descarta o que ficou por fazer commit.
+    # dentro de db_tx() os commit() dos helpers não fazem nada: tudo fica numa só transação.
+    __slots__ = ("_conn", "_depth")
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self._depth = 0
+
+    def cursor(self) -> sqlite3.Cursor:
+        return self._conn.cursor()
+
+    def execute(self, sql: str, params: Any = ()) -> sqlite3.Cursor:
+        return self._conn.execute(sql, params)
+
+    def commit(self):
+        if self._depth == 0:
+            self._conn.commit()
+
+    def rollback(self):
+        if self._depth == 0:
+            self._conn.rollback()
+
+    def close(self):
+        if self._depth == 0 and self._conn.in_transaction:
+            self._conn.rollback()
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._conn.in_transaction
+
+_DB_LOCAL = threading.local()
+_DB_CONNECTIONS: List[sqlite3.Connection] = []
+_DB_CONNECTIONS_LOCK = threading.Lock()
+
+def _open_db() -> sqlite3.Connection:
     _ensure_db_dir(DB_PATH)
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size={-abs(DB_CACHE_SIZE_KB)}")
+        conn.execute(f"PRAGMA mmap_size={max(0, DB_MMAP_SIZE_MB) * 1024 * 1024}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA busy_timeout={max(0, DB_BUSY_TIMEOUT_MS)}")
+    except Exception as e:
+        print("⚠️ PRAGMAs do SQLite falharam:", e)
+    with _DB_CONNECTIONS_LOCK:
+        _DB_CONNECTIONS.append(conn)
+    return conn
+
+def db_conn() -> PooledConnection:
+    pooled = getattr(_DB_LOCAL, "conn", None)
+    if pooled is None:
+        pooled = PooledConnection(_open_db())
+        _DB_LOCAL.conn = pooled
+    return pooled
+
+@contextmanager
+def db_tx():
+    conn = db_conn()
+    conn._depth += 1
+    try:
+        yield conn
+    except BaseException:
+        conn._depth -= 1
+        if conn._depth == 0 and conn.in_transaction:
+            conn._conn.rollback()
+        raise
+    conn._depth -= 1
+    if conn._depth == 0:
+        conn._conn.commit()
+
+# uma só thread para o SQLite: o event loop nunca espera por disco e há um único writer
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vz-db")
+
+# leituras de interações em threads próprias (WAL deixa ler durante a escrita): não ficam atrás do refresh/compactação
+DB_READ_EXECUTOR = ThreadPoolExecutor(max_workers=DB_READ_THREADS, thread_name_prefix="vz-db-read")
+
+async def db_run(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(DB_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+async def db_read(fn, *args, **kwargs):
+    # só para funções que não escrevem
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(DB_READ_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+def close_db_connections():
+    with _DB_CONNECTIONS_LOCK:
+        conns = list(_DB_CONNECTIONS)
+        _DB_CONNECTIONS.clear()
+    for conn in conns:
+        try:
+            conn.execute("PRAGMA optimize")
+            conn.close()
+        except Exception:
+            pass
 
 def generate_verification_code() -> str:
     alphabet = string.ascii_uppercase + string.digits
@@ -193,12 +424,36 @@ def is_staff_ctx(ctx: commands.Context) -> bool:
         return False
     return is_staff_member(ctx.author)
 
-async def fetch_member_safe(guild: discord.Guild, user_id: int):
+# user_id -> time.monotonic() até quando o consideramos fora do servidor
+MEMBER_ABSENT: Dict[int, float] = {}
+
+def mark_member_absent(user_id: int):
+    now = time.monotonic()
+    if len(MEMBER_ABSENT) > 10_000:
+        for uid in [u for u, exp in MEMBER_ABSENT.items() if exp <= now]:
+            MEMBER_ABSENT.pop(uid, None)
+    MEMBER_ABSENT[int(user_id)] = now + MEMBER_ABSENT_TTL_SECONDS
+
+async def fetch_member_confirmed(guild: discord.Guild, user_id: int):
+    # None só quando é certo que o membro não está no servidor; erros transitórios (HTTP, rate limit) sobem
     m = guild.get_member(user_id)
     if m:
         return m
+    # com a lista de membros completa (chunk + eventos join/remove), não estar na cache = não estar no servidor
+    if guild.chunked:
+        return None
+    exp = MEMBER_ABSENT.get(int(user_id))
+    if exp is not None and exp > time.monotonic():
+        return None
     try:
         return await guild.fetch_member(user_id)
+    except discord.NotFound:
+        mark_member_absent(int(user_id))
+        return None
+
+async def fetch_member_safe(guild: discord.Guild, user_id: int):
+    try:
+        return await fetch_member_confirmed(guild, user_id)
     except:
         return None
 
@@ -222,6 +477,34 @@ async def get_bot_member_safe(guild: discord.Guild) -> Optional[discord.Member]:
         pass
     return None
 
+# a primeira resposta a uma interação (send_message / defer) passa por este lock: o discord.py só marca
+# is_done() depois do pedido HTTP voltar, por isso o handler e o defer do router podiam responder os dois
+_FIRST_RESPONSE_LOCKS: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def first_response_lock(interaction: discord.Interaction) -> asyncio.Lock:
+    lock = _FIRST_RESPONSE_LOCKS.get(interaction.id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _FIRST_RESPONSE_LOCKS[interaction.id] = lock
+    return lock
+
+def is_already_responded(e: Exception) -> bool:
+    # 40060 = "Interaction has already been acknowledged"
+    return isinstance(e, discord.InteractionResponded) or (isinstance(e, discord.HTTPException) and e.code == 40060)
+
+async def safe_defer(interaction: discord.Interaction, label: str = "") -> bool:
+    # True se foi este pedido a fazer o defer
+    async with first_response_lock(interaction):
+        if interaction.response.is_done():
+            return False
+        try:
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            return True
+        except Exception as e:
+            if not is_already_responded(e):
+                print(f"⚠️ defer falhou ({label}):", e)
+            return False
+
 async def safe_reply(
     interaction: discord.Interaction,
     content: str,
@@ -229,10 +512,16 @@ async def safe_reply(
     view: Optional[discord.ui.View] = None
 ):
     try:
-        if interaction.response.is_done():
-            await interaction.followup.send(content, ephemeral=ephemeral, view=view)
-        else:
-            await interaction.response.send_message(content, ephemeral=ephemeral, view=view)
+        async with first_response_lock(interaction):
+            if not interaction.response.is_done():
+                try:
+                    await interaction.response.send_message(content, ephemeral=ephemeral, view=view)
+                    return
+                except Exception as e:
+                    if not is_already_responded(e):
+                        raise
+        # o router fez defer entretanto (ou já houve resposta)
+        await interaction.followup.send(content, ephemeral=ephemeral, view=view)
     except Exception as e:
         print("⚠️ safe_reply falhou:", e)
 
@@ -333,6 +622,71 @@ def normalize_tiktok_url(url: str) -> str:
         u = "https://" + u.lstrip("/")
     return u
 
+# links curtos que só redirecionam para o post (o id só aparece depois do redirect)
+TIKTOK_SHORT_LINK_RE = re.compile(r"^https?://(?:vm\.tiktok\.com|vt\.tiktok\.com|(?:www\.|m\.)?tiktok\.com/t)/[A-Za-z0-9_-]+", re.IGNORECASE)
+
+def is_short_post_link(url: str) -> bool:
+    return bool(TIKTOK_SHORT_LINK_RE.match((url or "").strip()))
+
+def extract_tiktok_video_id(url: str) -> Optional[str]:
+    m = re.search(r"/video/(\d+)", url or "")
+    return m.group(1) if m else None
+
+def extract_instagram_shortcode(url: str) -> Optional[str]:
+    m = re.search(r"instagram\.com/(?:[^/?#]+/)?(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)", url or "", re.IGNORECASE)
+    return m.group(1) if m else None
+
+def extract_youtube_video_id(url: str) -> Optional[str]:
+    m = re.search(r"(?:youtube\.com/(?:watch\?(?:[^#]*&)?v=|shorts/|embed/|live/)|youtu\.be/)([A-Za-z0-9_-]{11})", url or "", re.IGNORECASE)
+    return m.group(1) if m else None
+
+def normalize_instagram_url(url: str) -> str:
+    # /p/, /reel/, /reels/ e /tv/ do mesmo shortcode abrem o mesmo post
+    code = extract_instagram_shortcode(url)
+    if not code:
+        return (url or "").strip()
+    return f"https://www.instagram.com/p/{code}/"
+
+def normalize_youtube_url(url: str) -> str:
+    vid = extract_youtube_video_id(url)
+    if not vid:
+        return (url or "").strip()
+    return f"https://www.youtube.com/watch?v={vid}"
+
+def normalize_post_url(url: str) -> str:
+    platform = detect_platform(url)
+    if platform == "tiktok":
+        return normalize_tiktok_url(url)
+    if platform == "instagram":
+        return normalize_instagram_url(url)
+    if platform == "youtube":
+        return normalize_youtube_url(url)
+    return (url or "").strip()
+
+def canonical_post_id(url: str) -> str:
+    # "tiktok:<id>", "instagram:<shortcode>", "youtube:<id>"; sem id, o URL sem esquema/query
+    platform = detect_platform(url)
+    if platform == "tiktok":
+        vid = extract_tiktok_video_id(url)
+        if vid:
+            return f"tiktok:{vid}"
+    if platform == "instagram":
+        code = extract_instagram_shortcode(url)
+        if code:
+            return f"instagram:{code}"
+    if platform == "youtube":
+        vid = extract_youtube_video_id(url)
+        if vid:
+            return f"youtube:{vid}"
+    # sem id só esquema e host ignoram maiúsculas; o path fica como veio (ids e códigos distinguem-nas)
+    u = (url or "").strip().split("?")[0].split("#")[0].rstrip("/")
+    u = re.sub(r"^https?://", "", u, flags=re.IGNORECASE)
+    host, sep, path = u.partition("/")
+    host = host.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return host + sep + path
+
 def normalize_apify_actor_id(actor: str) -> str:
     a = (actor or "").strip()
     if not a:
@@ -356,8 +710,8 @@ def build_proxy_configuration() -> Optional[dict]:
 def hours_to_seconds(h: int) -> int:
     return int(h) * 3600
 
-def compute_next_check_at(approved_at: int, stale_checks: int = 0) -> int:
-    now_ts = _now()
+def compute_next_check_at(approved_at: int, stale_checks: int = 0, now_ts: Optional[int] = None) -> int:
+    now_ts = _now() if now_ts is None else int(now_ts)
     age = max(0, now_ts - int(approved_at or now_ts))
 
     if stale_checks >= STALE_CHECKS_TO_SLOW:
@@ -371,32 +725,269 @@ def compute_next_check_at(approved_at: int, stale_checks: int = 0) -> int:
 
     return now_ts + hours_to_seconds(NEW_VIDEO_CHECK_HOURS)
 
-def stop_tracking_submission(submission_id: int):
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE submissions
-        SET is_tracking=0, next_check_at=NULL
-        WHERE id=?
-    """, (int(submission_id),))
-    conn.commit()
-    conn.close()
+# =========================
+# POLÍTICA DE CHECKS
+# =========================
+class CheckContext:
+    __slots__ = (
+        "now_ts", "approved_at", "stale_checks", "views", "prev_views", "prev_checked_at",
+        "paid_views", "rate_kz_per_1k", "remaining_user_kz", "remaining_budget_kz", "history",
+    )
+
+    def __init__(
+        self,
+        now_ts: int,
+        approved_at: int,
+        stale_checks: int,
+        views: int,
+        prev_views: int = 0,
+        prev_checked_at: Optional[int] = None,
+        paid_views: int = 0,
+        rate_kz_per_1k: int = 0,
+        remaining_user_kz: Optional[int] = None,
+        remaining_budget_kz: Optional[int] = None,
+        history: Optional[List[Tuple[int, int]]] = None,
+    ):
+        self.now_ts = int(now_ts)
+        self.approved_at = int(approved_at or now_ts)
+        self.stale_checks = int(stale_checks or 0)
+        self.views = int(views)
+        self.prev_views = int(prev_views or 0)
+        self.prev_checked_at = int(prev_checked_at) if prev_checked_at else None
+        self.paid_views = int(paid_views or 0)
+        self.rate_kz_per_1k = int(rate_kz_per_1k or 0)
+        self.remaining_user_kz = remaining_user_kz
+        self.remaining_budget_kz = remaining_budget_kz
+        self.history = history or []
+
+    def views_per_hour(self) -> Optional[float]:
+        # usa o ponto mais antigo do histórico dentro da janela; sem histórico, o último snapshot
+        window_start = self.now_ts - hours_to_seconds(VELOCITY_WINDOW_HOURS)
+        for ts, v in self.history:
+            if window_start <= ts < self.now_ts:
+                return max(0, self.views - int(v)) * 3600.0 / float(self.now_ts - ts)
+        if not self.prev_checked_at or self.now_ts <= self.prev_checked_at:
+            return None
+        return max(0, self.views - self.prev_views) * 3600.0 / float(self.now_ts - self.prev_checked_at)
+
+    def views_to_next_limit(self) -> Optional[int]:
+        # views que faltam para o user atingir o teto ou para a campanha esgotar o budget.
+        # menos de um bloco (rate) por pagar já é teto atingido: o refresh pára o tracking, não há distância
+        unpaid = max(0, self.views - self.paid_views)
+        limits: List[int] = []
+        if self.rate_kz_per_1k > 0:
+            for kz in (self.remaining_user_kz, self.remaining_budget_kz):
+                if kz is not None and int(kz) >= self.rate_kz_per_1k:
+                    limits.append(max(0, int(kz) // self.rate_kz_per_1k * 1000 - unpaid))
+        return min(limits) if limits else None
+
+class CheckPolicy(ABC):
+    name = "base"
+
+    @abstractmethod
+    def next_check_at(self, ctx: CheckContext) -> int:
+        ...
+
+class AgeBucketPolicy(CheckPolicy):
+    name = "age"
+
+    def next_check_at(self, ctx: CheckContext) -> int:
+        return compute_next_check_at(ctx.approved_at, ctx.stale_checks, now_ts=ctx.now_ts)
+
+class VelocityPolicy(AgeBucketPolicy):
+    name = "velocity"
+
+    def next_check_at(self, ctx: CheckContext) -> int:
+        base = super().next_check_at(ctx) - ctx.now_ts
+        vph = ctx.views_per_hour()
+        if vph is None:
+            return ctx.now_ts + base
+
+        if vph * (base / 3600.0) < STALE_GROWTH_MIN_VIEWS:
+            interval = base * (1 + ctx.stale_checks)
+        else:
+            interval = base
+            if vph > VELOCITY_FAST_VIEWS_PER_HOUR:
+                interval = base * VELOCITY_FAST_VIEWS_PER_HOUR / vph
+            dist = ctx.views_to_next_limit()
+            if dist is not None and vph > 0:
+                interval = min(interval, dist / vph * 3600.0)
+
+        interval = max(VELOCITY_MIN_CHECK_MINUTES * 60, min(hours_to_seconds(VELOCITY_MAX_CHECK_HOURS), interval))
+        return ctx.now_ts + int(interval)
+
+CHECK_POLICIES: Dict[str, CheckPolicy] = {
+    AgeBucketPolicy.name: AgeBucketPolicy(),
+    VelocityPolicy.name: VelocityPolicy(),
+}
+
+def get_check_policy() -> CheckPolicy:
+    return CHECK_POLICIES.get(CHECK_POLICY, CHECK_POLICIES["age"])
+
+def simulate_check_policy(
+    policy: CheckPolicy,
+    history: List[Tuple[int, int]],
+    approved_at: int,
+    rate_kz_per_1k: int = 0,
+    max_user_kz: Optional[int] = None,
+    budget_kz: Optional[int] = None,
+) -> List[Tuple[int, int]]:
+    # repete uma série gravada (ts, views) contra a política e devolve os checks que ela teria feito
+    points = sorted((int(ts), int(v)) for ts, v in history)
+    if not points:
+        return []
+
+    def views_at(ts: int) -> int:
+        prev = points[0]
+        for pts, pv in points:
+            if pts >= ts:
+                if pts == prev[0]:
+                    return pv
+                return int(prev[1] + (pv - prev[1]) * (ts - prev[0]) / (pts - prev[0]))
+            prev = (pts, pv)
+        return prev[1]
+
+    checks: List[Tuple[int, int]] = []
+    t = int(approved_at) + hours_to_seconds(NEW_VIDEO_CHECK_HOURS)
+    prev_views, prev_ts, stale, paid_views, paid_kz = 0, None, 0, 0, 0
+    while t <= points[-1][0]:
+        views = views_at(t)
+        stale = stale + 1 if views - prev_views < STALE_GROWTH_MIN_VIEWS else 0
+        if rate_kz_per_1k > 0:
+            blocks = max(0, views // 1000 - paid_views // 1000)
+            for cap in (max_user_kz, budget_kz):
+                if cap is not None:
+                    blocks = min(blocks, max(0, cap - paid_kz) // rate_kz_per_1k)
+            paid_views += blocks * 1000
+            paid_kz += blocks * rate_kz_per_1k
+        ctx = CheckContext(
+            now_ts=t, approved_at=approved_at, stale_checks=stale, views=views,
+            prev_views=prev_views, prev_checked_at=prev_ts, paid_views=paid_views,
+            rate_kz_per_1k=rate_kz_per_1k,
+            remaining_user_kz=None if max_user_kz is None else max(0, max_user_kz - paid_kz),
+            remaining_budget_kz=None if budget_kz is None else max(0, budget_kz - paid_kz),
+        )
+        checks.append((t, views))
+        block_kz = max(1, rate_kz_per_1k)
+        if (ctx.remaining_user_kz is not None and ctx.remaining_user_kz < block_kz) or \
+                (ctx.remaining_budget_kz is not None and ctx.remaining_budget_kz < block_kz):
+            break
+        prev_views, prev_ts = views, t
+        t = policy.next_check_at(ctx)
+    return checks
+
+# =========================
+# SCHEDULER (min-heap de next_check_at)
+# =========================
+class SubmissionScheduler:
+    def __init__(self):
+        self._heap: List[Tuple[int, int]] = []
+        self._due_at: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __len__(self) -> int:
+        return len(self._due_at)
+
+    def _notify(self):
+        loop, wake = self._loop, self._wake
+        if loop is None or wake is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            wake.set()
+        else:
+            loop.call_soon_threadsafe(wake.set)
+
+    def load(self, rows: List[Tuple[int, int]]):
+        with self._lock:
+            self._due_at = {int(sid): int(ts) for sid, ts in rows if ts is not None}
+            self._heap = [(ts, sid) for sid, ts in self._due_at.items()]
+            heapq.heapify(self._heap)
+        self._notify()
+
+    def schedule(self, submission_id: int, next_check_at: int):
+        sid, ts = int(submission_id), int(next_check_at)
+        with self._lock:
+            if self._due_at.get(sid) == ts:
+                return
+            self._due_at[sid] = ts
+            heapq.heappush(self._heap, (ts, sid))
+            is_head = self._heap[0] == (ts, sid)
+        if is_head:
+            self._notify()
+
+    def unschedule(self, submission_id: int):
+        # remoção preguiçosa: a entrada antiga no heap é ignorada quando chegar ao topo
+        with self._lock:
+            self._due_at.pop(int(submission_id), None)
+
+    def _drop_stale_head(self):
+        while self._heap and self._due_at.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_due_at(self) -> Optional[int]:
+        with self._lock:
+            self._drop_stale_head()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, until_ts: int) -> List[int]:
+        due: List[int] = []
+        with self._lock:
+            while True:
+                self._drop_stale_head()
+                if not self._heap or self._heap[0][0] > until_ts:
+                    break
+                _ts, sid = heapq.heappop(self._heap)
+                self._due_at.pop(sid, None)
+                due.append(sid)
+        return due
+
+    async def wait_for_due(self, max_wait: float) -> List[int]:
+        self._loop = asyncio.get_running_loop()
+        if self._wake is None:
+            self._wake = asyncio.Event()
+
+        deadline = time.monotonic() + max(0.0, max_wait)
+        while True:
+            nxt = self.next_due_at()
+            now_ts = _now()
+            if nxt is not None and nxt <= now_ts:
+                if SCHEDULER_BATCH_WINDOW_SECONDS > 0:
+                    await asyncio.sleep(SCHEDULER_BATCH_WINDOW_SECONDS)
+                return self.pop_due(_now() + SCHEDULER_BATCH_WINDOW_SECONDS)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            sleep_for = remaining if nxt is None else min(remaining, float(nxt - now_ts))
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(0.05, sleep_for))
+            except asyncio.TimeoutError:
+                pass
+
+SCHEDULER = SubmissionScheduler()
 
-def schedule_submission_after_approval(submission_id: int, approved_at: int):
-    next_check = int(approved_at) + hours_to_seconds(NEW_VIDEO_CHECK_HOURS)
+def list_tracked_submission_schedule() -> List[Tuple[int, int]]:
     conn = db_conn()
     cur = conn.cursor()
     cur.execute("""
-        UPDATE submissions
-        SET last_checked_at=NULL,
-            next_check_at=?,
-            stale_checks=0,
-            is_tracking=1,
-            last_views_snapshot=0
-        WHERE id=?
-    """, (int(next_check), int(submission_id)))
-    conn.commit()
+        SELECT s.id, s.next_check_at
+        FROM submissions s
+        JOIN campaigns c ON c.id = s.campaign_id
+        WHERE s.status='approved'
+          AND c.status='active'
+          AND COALESCE(s.is_tracking, 1)=1
+          AND s.next_check_at IS NOT NULL
+    """)
+    rows = cur.fetchall()
     conn.close()
+    return [(int(r[0]), int(r[1])) for r in rows]
 
 # =========================
 # DB INIT + MIGRATIONS
@@ -407,8 +998,8 @@ def _column_exists(conn: sqlite3.Connection, table: str, col: str) -> bool:
     cols = [r[1] for r in cur.fetchall()]
     return col in cols
 
-def init_db():
-    conn = db_conn()
+def _migrate_base_schema(conn):
+    # esquema antigo (antes do user_version): tudo idempotente para DBs que já o tinham em parte
     cur = conn.cursor()
 
     cur.execute("""
@@ -545,6 +1136,32 @@ def init_db():
         except Exception as e:
             print("⚠️ MIGRATION campaign_users.maxed_notified:", e)
 
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS apify_actor_shapes (
+        actor_id TEXT PRIMARY KEY,
+        shape TEXT NOT NULL,
+        failures INTEGER NOT NULL DEFAULT 0,
+        updated_at INTEGER NOT NULL
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS view_snapshots (
+        submission_id INTEGER NOT NULL,
+        ts INTEGER NOT NULL,
+        views INTEGER NOT NULL,
+        PRIMARY KEY (submission_id, ts)
+    ) WITHOUT ROWID
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS view_cache (
+        cache_key TEXT PRIMARY KEY,
+        views INTEGER NOT NULL,
+        fetched_at INTEGER NOT NULL
+    )
+    """)
+
     cur.execute("""
     CREATE TABLE IF NOT EXISTS campaign_members (
         campaign_id INTEGER NOT NULL,
@@ -590,7 +1207,188 @@ def init_db():
     except Exception as e:
         print("⚠️ init schedule stop rejected/removed:", e)
 
-    conn.commit()
+def _migrate_secondary_indexes(conn):
+    cur = conn.cursor()
+    # fila do refresh / scheduler: status='approved' AND next_check_at ...
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_submissions_due
+        ON submissions(next_check_at)
+        WHERE status='approved' AND next_check_at IS NOT NULL
+    """)
+    # leaderboard, contagens por user e estatísticas (cobre o SUM de views_current)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_submissions_campaign_user
+        ON submissions(campaign_id, user_id, status, views_current)
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_submissions_user ON submissions(user_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_campaign_members_user ON campaign_members(user_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_campaign_users_user ON campaign_users(user_id)")
+    # vz:camp:join e find_campaign_id_for_channel (um índice por coluna para o OR)
+    for col in (
+        "post_message_id", "submit_channel_id", "leaderboard_channel_id",
+        "details_channel_id", "requirements_channel_id", "category_id",
+    ):
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_campaigns_{col} ON campaigns({col})")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_view_cache_fetched_at ON view_cache(fetched_at)")
+
+def _migrate_campaign_user_stats(conn):
+    # agregados por (campanha, user) mantidos por triggers: qualquer caminho que escreva em
+    # submissions/campaign_users (aprovar, rejeitar, retirar, refresh, resets) fica coberto.
+    # sem INSERT OR IGNORE nos triggers: um upsert no statement de fora anularia o IGNORE
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS campaign_user_stats (
+        campaign_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        approved_count INTEGER NOT NULL DEFAULT 0,
+        pending_count INTEGER NOT NULL DEFAULT 0,
+        views_current INTEGER NOT NULL DEFAULT 0,
+        paid_kz INTEGER NOT NULL DEFAULT 0,
+        views_paid INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (campaign_id, user_id)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_campaign_user_stats_rank
+        ON campaign_user_stats(campaign_id, paid_kz DESC, views_current DESC)
+    """)
+
+    def submission_delta(ref: str, sign: str) -> str:
+        return f"""
+            INSERT INTO campaign_user_stats (campaign_id, user_id)
+            SELECT {ref}.campaign_id, {ref}.user_id
+            WHERE NOT EXISTS (SELECT 1 FROM campaign_user_stats
+                              WHERE campaign_id={ref}.campaign_id AND user_id={ref}.user_id);
+            UPDATE campaign_user_stats
+            SET approved_count = approved_count {sign} ({ref}.status='approved'),
+                pending_count = pending_count {sign} ({ref}.status='pending'),
+                views_current = views_current {sign} (CASE WHEN {ref}.status='approved' THEN {ref}.views_current ELSE 0 END)
+            WHERE campaign_id={ref}.campaign_id AND user_id={ref}.user_id;
+        """
+
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_submissions_stats_insert AFTER INSERT ON submissions
+        BEGIN {submission_delta("NEW", "+")} END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_submissions_stats_delete AFTER DELETE ON submissions
+        BEGIN {submission_delta("OLD", "-")} END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_submissions_stats_update
+        AFTER UPDATE OF status, views_current, campaign_id, user_id ON submissions
+        BEGIN {submission_delta("OLD", "-")} {submission_delta("NEW", "+")} END
+    """)
+
+    def paid_set(ref: str, paid: str, views: str) -> str:
+        return f"""
+            INSERT INTO campaign_user_stats (campaign_id, user_id)
+            SELECT {ref}.campaign_id, {ref}.user_id
+            WHERE NOT EXISTS (SELECT 1 FROM campaign_user_stats
+                              WHERE campaign_id={ref}.campaign_id AND user_id={ref}.user_id);
+            UPDATE campaign_user_stats SET paid_kz={paid}, views_paid={views}
+            WHERE campaign_id={ref}.campaign_id AND user_id={ref}.user_id;
+        """
+
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_campaign_users_stats_insert AFTER INSERT ON campaign_users
+        BEGIN {paid_set("NEW", "NEW.paid_kz", "NEW.total_views_paid")} END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_campaign_users_stats_update
+        AFTER UPDATE OF paid_kz, total_views_paid ON campaign_users
+        BEGIN {paid_set("NEW", "NEW.paid_kz", "NEW.total_views_paid")} END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_campaign_users_stats_delete AFTER DELETE ON campaign_users
+        BEGIN {paid_set("OLD", "0", "0")} END
+    """)
+
+    # backfill a partir do estado atual
+    cur.execute("DELETE FROM campaign_user_stats")
+    cur.execute("""
+        INSERT INTO campaign_user_stats (campaign_id, user_id, approved_count, pending_count, views_current)
+        SELECT campaign_id, user_id,
+               SUM(status='approved'),
+               SUM(status='pending'),
+               COALESCE(SUM(CASE WHEN status='approved' THEN views_current ELSE 0 END), 0)
+        FROM submissions
+        GROUP BY campaign_id, user_id
+    """)
+    cur.execute("""
+        INSERT OR IGNORE INTO campaign_user_stats (campaign_id, user_id)
+        SELECT campaign_id, user_id FROM campaign_users
+    """)
+    cur.execute("""
+        UPDATE campaign_user_stats
+        SET paid_kz = COALESCE((SELECT cu.paid_kz FROM campaign_users cu
+                                WHERE cu.campaign_id = campaign_user_stats.campaign_id
+                                  AND cu.user_id = campaign_user_stats.user_id), 0),
+            views_paid = COALESCE((SELECT cu.total_views_paid FROM campaign_users cu
+                                   WHERE cu.campaign_id = campaign_user_stats.campaign_id
+                                     AND cu.user_id = campaign_user_stats.user_id), 0)
+    """)
+
+def _migrate_outbound_messages(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS outbound_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        fallback_channel_id INTEGER,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at INTEGER NOT NULL,
+        created_at INTEGER NOT NULL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_outbound_messages_due ON outbound_messages(next_attempt_at)")
+
+def _migrate_canonical_post_ids(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS short_links (
+        short_url TEXT PRIMARY KEY,
+        resolved_url TEXT NOT NULL,
+        resolved_at INTEGER NOT NULL
+    )
+    """)
+
+    if not _column_exists(conn, "submissions", "canonical_id"):
+        cur.execute("ALTER TABLE submissions ADD COLUMN canonical_id TEXT")
+
+    # links curtos antigos ficam com o id do próprio link (sem rede numa migração)
+    cur.execute("SELECT id, post_url FROM submissions WHERE canonical_id IS NULL")
+    cur.executemany("UPDATE submissions SET canonical_id=? WHERE id=?",
+                    [(canonical_post_id(str(url or "")), int(sid)) for sid, url in cur.fetchall()])
+    # não é UNIQUE: DBs antigas podem já ter o mesmo vídeo duas vezes na campanha
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_submissions_campaign_canonical ON submissions(campaign_id, canonical_id)")
+
+# (versão, migração) — PRAGMA user_version guarda a última aplicada; só se acrescenta no fim
+SCHEMA_MIGRATIONS = [
+    (1, _migrate_base_schema),
+    (2, _migrate_secondary_indexes),
+    (3, _migrate_campaign_user_stats),
+    (4, _migrate_outbound_messages),
+    (5, _migrate_canonical_post_ids),
+]
+
+def init_db():
+    conn = db_conn()
+    version = int(conn.execute("PRAGMA user_version").fetchone()[0] or 0)
+    for target, migrate in SCHEMA_MIGRATIONS:
+        if target <= version:
+            continue
+        try:
+            conn.execute("BEGIN")
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version={int(target)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = target
+        print(f"[DB] migração {target} aplicada ({migrate.__name__})")
     conn.close()
 
 # ===== IBAN HELPERS =====
@@ -736,29 +1534,341 @@ def list_pending_verifications():
     conn.close()
     return rows
 
+# ===== APIFY ACTOR SHAPES =====
+APIFY_ACTOR_SHAPES: Dict[str, Optional[Tuple[str, int]]] = {}
+
+def get_actor_shape(actor_id: str) -> Optional[Tuple[str, int]]:
+    if actor_id in APIFY_ACTOR_SHAPES:
+        return APIFY_ACTOR_SHAPES[actor_id]
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT shape, failures FROM apify_actor_shapes WHERE actor_id=?", (str(actor_id),))
+    row = cur.fetchone()
+    conn.close()
+    APIFY_ACTOR_SHAPES[actor_id] = (str(row[0]), int(row[1] or 0)) if row else None
+    return APIFY_ACTOR_SHAPES[actor_id]
+
+def set_actor_shape(actor_id: str, shape: str):
+    if APIFY_ACTOR_SHAPES.get(actor_id) == (shape, 0):
+        return
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO apify_actor_shapes (actor_id, shape, failures, updated_at)
+        VALUES (?, ?, 0, ?)
+        ON CONFLICT(actor_id) DO UPDATE SET
+            shape=excluded.shape,
+            failures=0,
+            updated_at=excluded.updated_at
+    """, (str(actor_id), str(shape), _now()))
+    conn.commit()
+    conn.close()
+    APIFY_ACTOR_SHAPES[actor_id] = (str(shape), 0)
+    print(f"[APIFY] formato aprendido actor={actor_id} shape={shape}")
+
+def record_actor_shape_failure(actor_id: str):
+    known = get_actor_shape(actor_id)
+    if not known:
+        return
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("UPDATE apify_actor_shapes SET failures=failures+1, updated_at=? WHERE actor_id=?",
+                (_now(), str(actor_id)))
+    conn.commit()
+    conn.close()
+    APIFY_ACTOR_SHAPES[actor_id] = (known[0], known[1] + 1)
+
+def reset_actor_shape_failures(actor_id: str):
+    known = get_actor_shape(actor_id)
+    if not known or known[1] == 0:
+        return
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("UPDATE apify_actor_shapes SET failures=0, updated_at=? WHERE actor_id=?",
+                (_now(), str(actor_id)))
+    conn.commit()
+    conn.close()
+    APIFY_ACTOR_SHAPES[actor_id] = (known[0], 0)
+
+# ===== VIEW CACHE =====
+VIEW_CACHE: "OrderedDict[str, Tuple[int, int]]" = OrderedDict()
+_VIEW_CACHE_LOADED = False
+
+def _load_view_cache():
+    global _VIEW_CACHE_LOADED
+    _VIEW_CACHE_LOADED = True
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM view_cache WHERE fetched_at < ?", (_now() - VIEW_CACHE_TTL_SECONDS,))
+    cur.execute("""
+        SELECT cache_key, views, fetched_at
+        FROM view_cache
+        ORDER BY fetched_at DESC
+        LIMIT ?
+    """, (VIEW_CACHE_MAX_ENTRIES,))
+    rows = cur.fetchall()
+    conn.commit()
+    conn.close()
+    for key, views, fetched_at in reversed(rows):
+        VIEW_CACHE[str(key)] = (int(views), int(fetched_at))
+
+def get_cached_views(url: str) -> Optional[int]:
+    if VIEW_CACHE_TTL_SECONDS <= 0:
+        return None
+    if not _VIEW_CACHE_LOADED:
+        _load_view_cache()
+    key = canonical_post_id(url)
+    entry = VIEW_CACHE.get(key)
+    if entry is None:
+        return None
+    views, fetched_at = entry
+    if _now() - fetched_at > VIEW_CACHE_TTL_SECONDS:
+        VIEW_CACHE.pop(key, None)
+        return None
+    VIEW_CACHE.move_to_end(key)
+    return views
+
+def get_cached_views_many(urls: List[str]) -> Dict[str, Optional[int]]:
+    return {u: get_cached_views(u) for u in dict.fromkeys(urls)}
+
+def put_cached_views(views_by_url: Dict[str, Optional[int]]):
+    if VIEW_CACHE_TTL_SECONDS <= 0:
+        return
+    if not _VIEW_CACHE_LOADED:
+        _load_view_cache()
+    now_ts = _now()
+    fresh = []
+    for url, views in views_by_url.items():
+        if not isinstance(views, int) or views < 0:
+            continue
+        key = canonical_post_id(url)
+        VIEW_CACHE[key] = (int(views), now_ts)
+        VIEW_CACHE.move_to_end(key)
+        fresh.append((key, int(views), now_ts))
+    if not fresh:
+        return
+
+    evicted = []
+    while len(VIEW_CACHE) > VIEW_CACHE_MAX_ENTRIES:
+        key, _ = VIEW_CACHE.popitem(last=False)
+        evicted.append((key,))
+
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.executemany("""
+        INSERT INTO view_cache (cache_key, views, fetched_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(cache_key) DO UPDATE SET
+            views=excluded.views,
+            fetched_at=excluded.fetched_at
+    """, fresh)
+    if evicted:
+        cur.executemany("DELETE FROM view_cache WHERE cache_key=?", evicted)
+    cur.execute("DELETE FROM view_cache WHERE fetched_at < ?", (now_ts - VIEW_CACHE_TTL_SECONDS,))
+    conn.commit()
+    conn.close()
+
+# ===== VIEW SNAPSHOTS =====
+_LAST_SNAPSHOT_COMPACT: Optional[float] = None
+
+def get_submission_view_series(submission_id: int, since_ts: Optional[int] = None) -> List[Tuple[int, int]]:
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT ts, views
+        FROM view_snapshots
+        WHERE submission_id=? AND ts >= ?
+        ORDER BY ts ASC
+    """, (int(submission_id), int(since_ts or 0)))
+    rows = cur.fetchall()
+    conn.close()
+    return [(int(ts), int(v)) for ts, v in rows]
+
+def compact_view_snapshots(now_ts: Optional[int] = None) -> int:
+    # mantém tudo nos últimos SNAPSHOT_FULL_RES_DAYS, depois 1 ponto por bucket, e apaga o que passa da retenção
+    now_ts = _now() if now_ts is None else int(now_ts)
+    full_res_cutoff = now_ts - SNAPSHOT_FULL_RES_DAYS * 24 * 3600
+    bucket = max(1, hours_to_seconds(SNAPSHOT_DOWNSAMPLE_HOURS))
+
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM view_snapshots WHERE ts < ?", (now_ts - SNAPSHOT_RETENTION_DAYS * 24 * 3600,))
+    removed = cur.rowcount or 0
+    cur.execute("""
+        DELETE FROM view_snapshots
+        WHERE ts < ?
+          AND EXISTS (
+              SELECT 1 FROM view_snapshots w
+              WHERE w.submission_id = view_snapshots.submission_id
+                AND w.ts > view_snapshots.ts
+                AND w.ts < ?
+                AND w.ts / ? = view_snapshots.ts / ?
+          )
+    """, (full_res_cutoff, full_res_cutoff, bucket, bucket))
+    removed += cur.rowcount or 0
+    cur.execute("DELETE FROM view_snapshots WHERE submission_id NOT IN (SELECT id FROM submissions)")
+    removed += cur.rowcount or 0
+    conn.commit()
+    conn.close()
+    return int(removed)
+
+def maybe_compact_view_snapshots():
+    global _LAST_SNAPSHOT_COMPACT
+    if _LAST_SNAPSHOT_COMPACT is not None and time.monotonic() - _LAST_SNAPSHOT_COMPACT < SNAPSHOT_COMPACT_EVERY_HOURS * 3600:
+        return
+    _LAST_SNAPSHOT_COMPACT = time.monotonic()
+    removed = compact_view_snapshots()
+    print(f"[SNAPSHOTS] compactação concluída: {removed} pontos removidos")
+
 # ===== CAMPAIGN HELPERS =====
-def get_campaign_by_id(conn, campaign_id: int):
+class CampaignIndex:
+    # canal / categoria / mensagem -> campanha, em memória; carregado no arranque e mantido
+    # pelos setters (set_campaign_workspace_ids, set_campaign_post_message_id), que são os únicos a mudar estes ids
+    def __init__(self):
+        self._by_channel: Dict[int, int] = {}
+        self._by_message: Dict[int, int] = {}
+        self._keys: Dict[int, Tuple[List[int], List[int]]] = {}
+        self._lock = threading.Lock()
+
+    def _put(self, campaign_id: int, channel_ids: List[Optional[int]], message_ids: List[Optional[int]]):
+        cid = int(campaign_id)
+        old_channels, old_messages = self._keys.pop(cid, ([], []))
+        for k in old_channels:
+            if self._by_channel.get(k) == cid:
+                del self._by_channel[k]
+        for k in old_messages:
+            if self._by_message.get(k) == cid:
+                del self._by_message[k]
+        channels = [int(x) for x in channel_ids if x]
+        messages = [int(x) for x in message_ids if x]
+        for k in channels:
+            self._by_channel[k] = cid
+        for k in messages:
+            self._by_message[k] = cid
+        self._keys[cid] = (channels, messages)
+
+    def load(self, rows: List[tuple]):
+        # rows: (id, post_message_id, category_id, details, requirements, submit, leaderboard)
+        with self._lock:
+            self._by_channel.clear()
+            self._by_message.clear()
+            self._keys.clear()
+            for cid, post_msg_id, *channel_ids in rows:
+                self._put(int(cid), list(channel_ids), [post_msg_id])
+
+    def set_workspace(self, campaign_id: int, channel_ids: List[Optional[int]]):
+        with self._lock:
+            _old_channels, messages = self._keys.get(int(campaign_id), ([], []))
+            self._put(int(campaign_id), channel_ids, list(messages))
+
+    def set_post_message(self, campaign_id: int, msg_id: int):
+        with self._lock:
+            channels, _old_messages = self._keys.get(int(campaign_id), ([], []))
+            self._put(int(campaign_id), list(channels), [msg_id])
+
+    def campaign_for_message(self, msg_id: int) -> Optional[int]:
+        return self._by_message.get(int(msg_id))
+
+    def campaign_for_channel(self, channel_id: int, category_id: Optional[int] = None) -> Optional[int]:
+        cid = self._by_channel.get(int(channel_id))
+        if cid is None and category_id:
+            cid = self._by_channel.get(int(category_id))
+        return cid
+
+CAMPAIGN_INDEX = CampaignIndex()
+
+class CampaignConfig:
+    # linha de get_campaign_basic já convertida; platforms vem parseado uma vez
+    __slots__ = (
+        "id", "name", "slug", "platforms", "allowed_platforms", "content_types", "audio_url",
+        "rate_kz_per_1k", "budget_total_kz", "spent_kz", "max_payout_user_kz", "max_posts_total",
+        "status", "category_id", "submit_channel_id", "leaderboard_channel_id",
+        "leaderboard_message_id", "campaign_role_id", "ended_notified",
+    )
+
+    def __init__(self, row: tuple):
+        (cid, name, slug, platforms, content_types, audio_url,
+         rate, budget_total, spent, max_user_kz, max_posts_total, status,
+         category_id, submit_channel_id, leaderboard_channel_id, leaderboard_message_id,
+         campaign_role_id, ended_notified) = row
+        self.id = int(cid)
+        self.name = str(name)
+        self.slug = str(slug)
+        self.platforms = str(platforms or "")
+        self.allowed_platforms: Tuple[str, ...] = tuple(parse_campaign_platforms(self.platforms))
+        self.content_types = str(content_types or "")
+        self.audio_url = str(audio_url or "")
+        self.rate_kz_per_1k = int(rate or 0)
+        self.budget_total_kz = int(budget_total or 0)
+        self.spent_kz = int(spent or 0)
+        self.max_payout_user_kz = int(max_user_kz or 0)
+        self.max_posts_total = int(max_posts_total or 0)
+        self.status = str(status or "active")
+        self.category_id = int(category_id) if category_id else None
+        self.submit_channel_id = int(submit_channel_id) if submit_channel_id else None
+        self.leaderboard_channel_id = int(leaderboard_channel_id) if leaderboard_channel_id else None
+        self.leaderboard_message_id = int(leaderboard_message_id) if leaderboard_message_id else None
+        self.campaign_role_id = int(campaign_role_id) if campaign_role_id else None
+        self.ended_notified = int(ended_notified or 0)
+
+# read-through: get_campaign_config enche, cada escrita em campaigns chama invalidate_campaign_config
+CAMPAIGN_CONFIGS: Dict[int, CampaignConfig] = {}
+# sobe a cada invalidação: uma leitura que apanhe uma escrita a meio não entra na cache
+CAMPAIGN_CONFIGS_GEN = 0
+
+def invalidate_campaign_config(campaign_id: Optional[int] = None):
+    global CAMPAIGN_CONFIGS_GEN
+    CAMPAIGN_CONFIGS_GEN += 1
+    if campaign_id is None:
+        CAMPAIGN_CONFIGS.clear()
+    else:
+        CAMPAIGN_CONFIGS.pop(int(campaign_id), None)
+
+def get_campaign_config(campaign_id: int) -> Optional[CampaignConfig]:
+    cfg = CAMPAIGN_CONFIGS.get(int(campaign_id))
+    if cfg is not None:
+        return cfg
+    gen = CAMPAIGN_CONFIGS_GEN
+    row = get_campaign_basic(int(campaign_id))
+    if not row:
+        return None
+    cfg = CampaignConfig(row)
+    if gen == CAMPAIGN_CONFIGS_GEN:
+        CAMPAIGN_CONFIGS[cfg.id] = cfg
+    return cfg
+
+async def campaign_config(campaign_id: int) -> Optional[CampaignConfig]:
+    # hit não passa pela DB; miss vai às threads de leitura
+    cfg = CAMPAIGN_CONFIGS.get(int(campaign_id))
+    if cfg is not None:
+        return cfg
+    return await db_read(get_campaign_config, int(campaign_id))
+
+def load_campaign_index():
+    conn = db_conn()
     cur = conn.cursor()
     cur.execute("""
-    SELECT id, name, slug, platforms, content_types, audio_url,
-           rate_kz_per_1k, budget_total_kz, spent_kz,
-           max_payout_user_kz, max_posts_total, status,
-           campaigns_channel_id, post_message_id,
-           category_id, details_channel_id, requirements_channel_id,
-           submit_channel_id, submit_panel_message_id,
-           leaderboard_channel_id, leaderboard_message_id,
-           campaign_role_id,
-           ended_notified
-    FROM campaigns WHERE id=?
-    """, (campaign_id,))
-    return cur.fetchone()
+        SELECT id, post_message_id, category_id, details_channel_id,
+               requirements_channel_id, submit_channel_id, leaderboard_channel_id
+        FROM campaigns
+    """)
+    rows = cur.fetchall()
+    conn.close()
+    CAMPAIGN_INDEX.load(rows)
+    return len(rows)
+
 
 def set_campaign_post_message_id(slug: str, msg_id: int):
     conn = db_conn()
     cur = conn.cursor()
     cur.execute("UPDATE campaigns SET post_message_id=? WHERE slug=?", (int(msg_id), slug))
+    cur.execute("SELECT id FROM campaigns WHERE slug=?", (slug,))
+    row = cur.fetchone()
     conn.commit()
     conn.close()
+    if row:
+        CAMPAIGN_INDEX.set_post_message(int(row[0]), int(msg_id))
+        invalidate_campaign_config(int(row[0]))
 
 def set_campaign_role_id(campaign_id: int, role_id: int):
     conn = db_conn()
@@ -766,6 +1876,7 @@ def set_campaign_role_id(campaign_id: int, role_id: int):
     cur.execute("UPDATE campaigns SET campaign_role_id=? WHERE id=?", (int(role_id), int(campaign_id)))
     conn.commit()
     conn.close()
+    invalidate_campaign_config(campaign_id)
 
 def set_campaign_workspace_ids(
     campaign_id: int,
@@ -792,6 +1903,8 @@ def set_campaign_workspace_ids(
     """, (category_id, details_id, req_id, submit_id, submit_panel_id, lb_id, lb_msg_id, campaign_id))
     conn.commit()
     conn.close()
+    CAMPAIGN_INDEX.set_workspace(int(campaign_id), [category_id, details_id, req_id, submit_id, lb_id])
+    invalidate_campaign_config(campaign_id)
 
 def add_campaign_member(campaign_id: int, user_id: int) -> bool:
     conn = db_conn()
@@ -839,6 +1952,8 @@ def reset_user_in_campaign(campaign_id: int, user_id: int, refund_budget: bool =
                 (int(campaign_id), int(user_id)))
     user_paid_kz = int((cur.fetchone() or [0])[0] or 0)
 
+    cur.execute("SELECT id FROM submissions WHERE campaign_id=? AND user_id=?", (int(campaign_id), int(user_id)))
+    deleted_ids = [int(r[0]) for r in cur.fetchall()]
     cur.execute("DELETE FROM submissions WHERE campaign_id=? AND user_id=?", (int(campaign_id), int(user_id)))
     cur.execute("DELETE FROM campaign_users WHERE campaign_id=? AND user_id=?", (int(campaign_id), int(user_id)))
     cur.execute("DELETE FROM campaign_members WHERE campaign_id=? AND user_id=?", (int(campaign_id), int(user_id)))
@@ -858,61 +1973,220 @@ def reset_user_in_campaign(campaign_id: int, user_id: int, refund_budget: bool =
 
     conn.commit()
     conn.close()
+    for sid in deleted_ids:
+        SCHEDULER.unschedule(sid)
+    invalidate_campaign_config(campaign_id)
 
 def get_user_submission_counts(campaign_id: int, user_id: int) -> Tuple[int, int, int]:
     conn = db_conn()
     cur = conn.cursor()
     cur.execute("""
-        SELECT
-            SUM(CASE WHEN status='approved' THEN 1 ELSE 0 END) as approved,
-            SUM(CASE WHEN status='pending' THEN 1 ELSE 0 END)  as pending,
-            COUNT(*) as total
-        FROM submissions
-        WHERE campaign_id=? AND user_id=? AND status IN ('pending','approved')
+        SELECT approved_count, pending_count, approved_count + pending_count
+        FROM campaign_user_stats
+        WHERE campaign_id=? AND user_id=?
     """, (int(campaign_id), int(user_id)))
     row = cur.fetchone() or (0, 0, 0)
     conn.close()
     return int(row[0] or 0), int(row[1] or 0), int(row[2] or 0)
 
-async def notify_campaign_finished(campaign_id: int, winner_user_id: Optional[int], reason: str):
-    guild = bot.get_guild(SERVER_ID)
-    if not guild:
-        return
-
+def insert_pending_submission(
+    campaign_id: int, user_id: int, url: str, platform: str, max_posts_total: int, canonical_id: str
+) -> Tuple[str, Optional[int]]:
     conn = db_conn()
     cur = conn.cursor()
-    cur.execute("SELECT name FROM campaigns WHERE id=?", (int(campaign_id),))
-    camp = cur.fetchone()
-    camp_name = str(camp[0]) if camp else f"Campanha {campaign_id}"
-
-    cur.execute("SELECT user_id FROM campaign_members WHERE campaign_id=?", (int(campaign_id),))
-    members = [int(r[0]) for r in cur.fetchall()]
-    conn.close()
+    # o mesmo vídeo por outro link (curto, /reel/ vs /p/, query) conta como duplicado
+    cur.execute("SELECT 1 FROM submissions WHERE campaign_id=? AND canonical_id=? LIMIT 1",
+                (int(campaign_id), canonical_id))
+    if cur.fetchone():
+        conn.close()
+        return "duplicate", None
 
-    if reason == "budget" and winner_user_id:
-        m = await fetch_member_safe(guild, int(winner_user_id))
-        if m:
-            await notify_user(
-                m,
-                f"🏁 **Parabéns!** O teu progresso fez a campanha **{camp_name}** atingir o budget.\n\n{PAYMENTS_NOTICE}",
-                fallback_channel_id=CHAT_CHANNEL_ID
-            )
+    cur.execute("""
+    SELECT COUNT(*)
+    FROM submissions
+    WHERE campaign_id=? AND status IN ('pending','approved')
+    """, (int(campaign_id),))
+    total_active_posts = int((cur.fetchone() or [0])[0])
+    if total_active_posts >= int(max_posts_total):
+        conn.close()
+        return "full", None
 
-    for uid in members:
-        m = await fetch_member_safe(guild, int(uid))
-        if m:
-            await notify_user(
-                m,
-                f"🏁 A campanha **{camp_name}** terminou ({'budget atingido' if reason=='budget' else 'finalizada pelo staff'}).\n\n{PAYMENTS_NOTICE}",
-                fallback_channel_id=CHAT_CHANNEL_ID
-            )
+    try:
+        cur.execute("""
+        INSERT INTO submissions (campaign_id, user_id, post_url, platform, status, created_at, canonical_id)
+        VALUES (?, ?, ?, ?, 'pending', ?, ?)
+        """, (int(campaign_id), int(user_id), url, platform, _now(), canonical_id))
+        submission_id = int(cur.lastrowid)
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.close()
+        return "duplicate", None
+
+    conn.close()
+    return "ok", submission_id
+
+def get_submission_row(submission_id: int):
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, campaign_id, user_id, post_url, status, platform
+        FROM submissions
+        WHERE id=?
+    """, (int(submission_id),))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+def find_user_submission(campaign_id: int, user_id: int, url: str, canonical_id: str):
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("""
+    SELECT id, status
+    FROM submissions
+    WHERE campaign_id=? AND user_id=? AND (canonical_id=? OR post_url=?)
+    ORDER BY (post_url=?) DESC, id DESC
+    LIMIT 1
+    """, (int(campaign_id), int(user_id), canonical_id, url, url))
+    row = cur.fetchone()
+    conn.close()
+    return row
 
-def mark_campaign_ended_notified(campaign_id: int):
+def close_submission(submission_id: int, status: str):
+    # devolve a linha como estava antes; se já tinha este status não mexe em nada
+    row = get_submission_row(int(submission_id))
+    if not row or row[4] == status:
+        return row
     conn = db_conn()
     cur = conn.cursor()
-    cur.execute("UPDATE campaigns SET ended_notified=1 WHERE id=?", (int(campaign_id),))
+    cur.execute("""
+        UPDATE submissions
+        SET status=?,
+            is_tracking=0,
+            next_check_at=NULL
+        WHERE id=?
+    """, (str(status), int(submission_id)))
     conn.commit()
     conn.close()
+    SCHEDULER.unschedule(int(submission_id))
+    return row
+
+def get_submission_review_row(submission_id: int) -> Optional[tuple]:
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT s.id, s.campaign_id, s.user_id, s.post_url, s.status,
+               c.name, c.status, c.max_payout_user_kz, s.platform
+        FROM submissions s
+        JOIN campaigns c ON c.id = s.campaign_id
+        WHERE s.id=?
+    """, (int(submission_id),))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+def peek_submission_review(submission_id: int) -> Tuple[str, Optional[tuple]]:
+    # só leitura: "reject" abre o modal sem passar pelo writer; "not_member" ainda tem de ser gravado
+    row = get_submission_review_row(submission_id)
+    if not row:
+        return "missing", None
+    if not is_campaign_member(int(row[1]), int(row[2])):
+        return "not_member", row
+    return "reject", row
+
+def review_submission(submission_id: int, approve: bool) -> Tuple[str, Optional[tuple]]:
+    # decide e grava a aprovação numa só ida à DB; "reject" deixa a decisão para o modal do motivo
+    row = get_submission_review_row(submission_id)
+    if not row:
+        return "missing", None
+
+    sid, camp_id, user_id = int(row[0]), int(row[1]), int(row[2])
+    camp_status, max_user_kz = str(row[6]), int(row[7])
+
+    outcome = "reject"
+    if not is_campaign_member(camp_id, user_id):
+        outcome = "not_member"
+    elif approve and camp_status != "active":
+        outcome = "ended"
+    elif approve and get_user_paid_in_campaign(camp_id, user_id)[0] >= max_user_kz:
+        outcome = "user_max"
+    elif approve and get_user_submission_counts(camp_id, user_id)[0] >= MAX_APPROVED_PER_USER:
+        outcome = "approved_limit"
+    elif approve:
+        outcome = "approved"
+
+    if outcome in ("not_member", "ended", "user_max", "approved_limit"):
+        close_submission(sid, "rejected")
+    elif outcome == "approved":
+        approved_ts = _now()
+        next_check = approved_ts + hours_to_seconds(NEW_VIDEO_CHECK_HOURS)
+        conn = db_conn()
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE submissions
+            SET status='approved',
+                approved_at=?,
+                is_tracking=1,
+                stale_checks=0,
+                last_checked_at=NULL,
+                next_check_at=?,
+                last_views_snapshot=0
+            WHERE id=?
+        """, (
+            int(approved_ts),
+            int(next_check),
+            int(sid)
+        ))
+        conn.commit()
+        conn.close()
+        SCHEDULER.schedule(int(sid), int(next_check))
+    return outcome, row
+
+def get_user_campaign_stats(campaign_id: int, user_id: int) -> Tuple[int, int, int]:
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT paid_kz, views_paid, views_current
+        FROM campaign_user_stats
+        WHERE campaign_id=? AND user_id=?
+    """, (int(campaign_id), int(user_id)))
+    row = cur.fetchone() or (0, 0, 0)
+    conn.close()
+    return int(row[0] or 0), int(row[1] or 0), int(row[2] or 0)
+
+def list_campaign_member_ids(campaign_id: int) -> List[int]:
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT user_id FROM campaign_members WHERE campaign_id=?", (int(campaign_id),))
+    member_ids = [int(r[0]) for r in cur.fetchall()]
+    conn.close()
+    return member_ids
+
+def get_campaign_name_and_members(campaign_id: int) -> Tuple[str, List[int]]:
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM campaigns WHERE id=?", (int(campaign_id),))
+    camp = cur.fetchone()
+    conn.close()
+    camp_name = str(camp[0]) if camp else f"Campanha {campaign_id}"
+    return camp_name, list_campaign_member_ids(int(campaign_id))
+
+async def notify_campaign_finished(campaign_id: int, winner_user_id: Optional[int], reason: str):
+    # só põe as DMs na fila; a entrega corre em notification_queue_loop
+    camp_name, members = await db_run(get_campaign_name_and_members, int(campaign_id))
+
+    messages: List[Tuple[int, str, Optional[int]]] = []
+    if reason == "budget" and winner_user_id:
+        messages.append((
+            int(winner_user_id),
+            f"🏁 **Parabéns!** O teu progresso fez a campanha **{camp_name}** atingir o budget.\n\n{PAYMENTS_NOTICE}",
+            CHAT_CHANNEL_ID,
+        ))
+
+    ended_txt = f"🏁 A campanha **{camp_name}** terminou ({'budget atingido' if reason=='budget' else 'finalizada pelo staff'}).\n\n{PAYMENTS_NOTICE}"
+    for uid in members:
+        messages.append((int(uid), ended_txt, CHAT_CHANNEL_ID))
+
+    await queue_notifications(messages)
 
 def get_campaign_basic(campaign_id: int):
     conn = db_conn()
@@ -930,33 +2204,17 @@ def get_campaign_basic(campaign_id: int):
     return row
 
 async def remove_campaign_role_from_member(guild: discord.Guild, campaign_id: int, member: discord.Member):
-    row = get_campaign_basic(int(campaign_id))
-    if not row:
+    cfg = await campaign_config(int(campaign_id))
+    if not cfg or not cfg.campaign_role_id:
         return
-    role_id = row[16]
-    if not role_id:
-        return
-    role = guild.get_role(int(role_id))
+    role = guild.get_role(cfg.campaign_role_id)
     if role and role in member.roles:
         try:
             await member.remove_roles(role, reason="Removed from campaign")
         except:
             pass
 
-async def purge_ghosts_for_campaign(guild: discord.Guild, campaign_id: int, refund_budget: bool = True) -> Tuple[int, int]:
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT user_id FROM campaign_members WHERE campaign_id=?", (int(campaign_id),))
-    member_ids = [int(r[0]) for r in cur.fetchall()]
-    conn.close()
-
-    ghost_removed = 0
-    for uid in member_ids:
-        m = await fetch_member_safe(guild, uid)
-        if m is None:
-            reset_user_in_campaign(int(campaign_id), int(uid), refund_budget=refund_budget)
-            ghost_removed += 1
-
+def delete_campaign_orphans(campaign_id: int) -> int:
     conn2 = db_conn()
     c2 = conn2.cursor()
 
@@ -976,8 +2234,83 @@ async def purge_ghosts_for_campaign(guild: discord.Guild, campaign_id: int, refu
 
     conn2.commit()
     conn2.close()
+    return int(orph_sub) + int(orph_users)
+
+async def purge_ghosts_for_campaign(guild: discord.Guild, campaign_id: int, refund_budget: bool = True) -> Tuple[int, int]:
+    member_ids = await db_run(list_campaign_member_ids, int(campaign_id))
+
+    ghost_removed = 0
+    for uid in member_ids:
+        m = await fetch_member_safe(guild, uid)
+        if m is None:
+            await db_run(reset_user_in_campaign, int(campaign_id), int(uid), refund_budget=refund_budget)
+            ghost_removed += 1
+
+    orphans = await db_run(delete_campaign_orphans, int(campaign_id))
+    return ghost_removed, orphans
+
+def upsert_test_campaign(c: dict):
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("""
+    INSERT OR IGNORE INTO campaigns
+    (name, slug, platforms, content_types, audio_url, rate_kz_per_1k,
+     budget_total_kz, max_payout_user_kz, max_posts_total,
+     campaigns_channel_id, created_at, ended_notified)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,0)
+    """, (
+        c["name"], c["slug"], c["platforms"], c["content_types"], c["audio_url"],
+        int(c["rate_kz_per_1k"]), int(c["budget_total_kz"]),
+        int(c["max_payout_user_kz"]), int(c["max_posts_total"]),
+        int(CAMPANHAS_CHANNEL_ID), _now()
+    ))
+    conn.commit()
+
+    cur.execute("SELECT id, post_message_id FROM campaigns WHERE slug=?", (c["slug"],))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+def list_recent_campaigns(limit: int = 25):
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id, name, status, spent_kz, budget_total_kz FROM campaigns ORDER BY id DESC LIMIT ?", (int(limit),))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def end_campaign(campaign_id: int) -> Optional[int]:
+    # devolve o ended_notified anterior (None se a campanha não existe) e já o marca
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT status, ended_notified FROM campaigns WHERE id=?", (int(campaign_id),))
+    row = cur.fetchone()
+    if not row:
+        conn.close()
+        return None
+    ended_notified = int(row[1] or 0)
+
+    cur.execute("UPDATE campaigns SET status='ended', ended_notified=1 WHERE id=?", (int(campaign_id),))
+    conn.commit()
+    conn.close()
+    invalidate_campaign_config(campaign_id)
+    return ended_notified
 
-    return ghost_removed, int(orph_sub) + int(orph_users)
+def list_user_campaign_ids(user_id: int) -> List[int]:
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT DISTINCT campaign_id FROM (
+            SELECT campaign_id FROM campaign_members WHERE user_id=?
+            UNION
+            SELECT campaign_id FROM submissions WHERE user_id=?
+            UNION
+            SELECT campaign_id FROM campaign_users WHERE user_id=?
+        )
+    """, (int(user_id), int(user_id), int(user_id)))
+    cids = [int(r[0]) for r in cur.fetchall()]
+    conn.close()
+    return cids
 
 def reset_campaign_all(campaign_id: int, reset_spent: bool = True):
     conn = db_conn()
@@ -992,12 +2325,17 @@ def reset_campaign_all(campaign_id: int, reset_spent: bool = True):
             WHERE id=?
         """, (int(campaign_id),))
 
+    cur.execute("SELECT id FROM submissions WHERE campaign_id=?", (int(campaign_id),))
+    deleted_ids = [int(r[0]) for r in cur.fetchall()]
     cur.execute("DELETE FROM submissions WHERE campaign_id=?", (int(campaign_id),))
     cur.execute("DELETE FROM campaign_users WHERE campaign_id=?", (int(campaign_id),))
     cur.execute("DELETE FROM campaign_members WHERE campaign_id=?", (int(campaign_id),))
 
     conn.commit()
     conn.close()
+    for sid in deleted_ids:
+        SCHEDULER.unschedule(sid)
+    invalidate_campaign_config(campaign_id)
 
 def find_campaign_id_for_channel(channel: discord.abc.GuildChannel) -> Optional[int]:
     try:
@@ -1011,20 +2349,7 @@ def find_campaign_id_for_channel(channel: discord.abc.GuildChannel) -> Optional[
     except:
         cat_id = None
 
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id FROM campaigns
-        WHERE submit_channel_id=?
-           OR leaderboard_channel_id=?
-           OR details_channel_id=?
-           OR requirements_channel_id=?
-           OR category_id=?
-        LIMIT 1
-    """, (ch_id, ch_id, ch_id, ch_id, cat_id if cat_id else -1))
-    row = cur.fetchone()
-    conn.close()
-    return int(row[0]) if row else None
+    return CAMPAIGN_INDEX.campaign_for_channel(ch_id, cat_id)
 
 # =========================
 # CAMPANHA TESTE
@@ -1290,7 +2615,7 @@ class UsernameModal(discord.ui.Modal):
         social = str(self.social).lower()
         username = str(self.username.value).strip()
 
-        existing = get_linked_account(user_id, social)
+        existing = await db_read(get_linked_account, user_id, social)
         if existing:
             return await safe_reply(
                 interaction,
@@ -1299,7 +2624,7 @@ class UsernameModal(discord.ui.Modal):
                 ephemeral=True
             )
 
-        upsert_verification_request(user_id=user_id, social=social, username=username, code=self.code, status="pending")
+        await db_run(upsert_verification_request, user_id=user_id, social=social, username=username, code=self.code, status="pending")
 
         await safe_reply(
             interaction,
@@ -1328,7 +2653,7 @@ class UsernameModal(discord.ui.Modal):
             f"📌 Status: **PENDENTE**",
             view=verify_approval_view(user_id)
         )
-        set_verification_message(user_id=user_id, channel_id=channel.id, message_id=msg.id)
+        await db_run(set_verification_message, user_id=user_id, channel_id=channel.id, message_id=msg.id)
 
 class IbanModal(discord.ui.Modal):
     def __init__(self):
@@ -1343,7 +2668,7 @@ class IbanModal(discord.ui.Modal):
         member = await fetch_member_safe(guild, interaction.user.id)
         if not member or not is_verified(member):
             return await safe_reply(interaction, "⛔ Tens de estar **Verificado** para guardar IBAN.", ephemeral=True)
-        set_iban(interaction.user.id, str(self.iban.value).strip())
+        await db_run(set_iban, interaction.user.id, str(self.iban.value).strip())
         await safe_reply(interaction, "✅ IBAN guardado com sucesso.", ephemeral=True)
 
 class RejectSubmissionReasonModal(discord.ui.Modal):
@@ -1373,17 +2698,8 @@ class RejectSubmissionReasonModal(discord.ui.Modal):
         if not staff or not is_staff_member(staff):
             return await safe_reply(interaction, "⛔ Sem permissão.", ephemeral=True)
 
-        conn = db_conn()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT id, campaign_id, user_id, post_url, status, platform
-            FROM submissions
-            WHERE id=?
-        """, (int(self.submission_id),))
-        row = cur.fetchone()
-
+        row = await db_run(close_submission, int(self.submission_id), "rejected")
         if not row:
-            conn.close()
             return await safe_reply(interaction, "❌ Submission não encontrada.", ephemeral=True)
 
         sid, camp_id, user_id, post_url, status, platform = row
@@ -1394,22 +2710,11 @@ class RejectSubmissionReasonModal(discord.ui.Modal):
         platform = str(platform)
 
         if status == "rejected":
-            conn.close()
             return await safe_reply(interaction, "⚠️ Esta submission já foi rejeitada.", ephemeral=True)
 
-        cur.execute("""
-            UPDATE submissions
-            SET status='rejected',
-                is_tracking=0,
-                next_check_at=NULL
-            WHERE id=?
-        """, (sid,))
-        conn.commit()
-        conn.close()
-
         target_member = await fetch_member_safe(guild, user_id)
         reason_txt = str(self.reason.value).strip()
-        linked = get_linked_account(user_id, platform)
+        linked = await db_read(get_linked_account, user_id, platform)
         linked_txt = linked[0] if linked else "Não encontrada"
 
         if target_member:
@@ -1453,29 +2758,26 @@ class SubmitLinkModal(discord.ui.Modal):
         if not member or not is_verified(member):
             return await safe_reply(interaction, "⛔ Tens de estar **Verificado** para submeter links.", ephemeral=True)
 
-        if not is_campaign_member(self.campaign_id, interaction.user.id):
+        if not await db_read(is_campaign_member, self.campaign_id, interaction.user.id):
             return await safe_reply(interaction, "⛔ Primeiro tens de **aderir** à campanha no post (botão 🔥).", ephemeral=True)
 
-        conn = db_conn()
-        row = get_campaign_by_id(conn, self.campaign_id)
-        if not row:
-            conn.close()
+        cfg = await campaign_config(self.campaign_id)
+        if not cfg:
             return await safe_reply(interaction, "❌ Campanha não encontrada.", ephemeral=True)
 
-        camp_id         = int(row[0])
-        name            = str(row[1])
-        platforms       = str(row[3])
-        budget_total    = int(row[7])
-        spent_kz        = int(row[8])
-        max_user_kz     = int(row[9])
-        max_posts_total = int(row[10])
-        status          = str(row[11])
-        conn.close()
-
-        paid_kz, maxed_notified = get_user_paid_in_campaign(int(camp_id), int(interaction.user.id))
-        if paid_kz >= max_user_kz:
+        camp_id         = cfg.id
+        name            = cfg.name
+        budget_total    = cfg.budget_total_kz
+        spent_kz        = cfg.spent_kz
+        max_user_kz     = cfg.max_payout_user_kz
+        max_posts_total = cfg.max_posts_total
+        status          = cfg.status
+
+        paid_kz, maxed_notified = await db_read(get_user_paid_in_campaign, int(camp_id), int(interaction.user.id))
+        # sobra menor que um bloco de 1k views nunca chega a ser paga
+        if max_user_kz - paid_kz < max(1, cfg.rate_kz_per_1k):
             if maxed_notified == 0:
-                set_maxed_notified(int(camp_id), int(interaction.user.id))
+                await db_run(set_maxed_notified, int(camp_id), int(interaction.user.id))
             return await safe_reply(
                 interaction,
                 f"⛔ Já atingiste o teu limite nesta campanha (**{max_user_kz:,} Kz**). Não podes submeter mais vídeos.",
@@ -1492,15 +2794,17 @@ class SubmitLinkModal(discord.ui.Modal):
         if not url.startswith("http://") and not url.startswith("https://"):
             return await safe_reply(interaction, "❌ Link inválido. Envia um link completo com **https://**", ephemeral=True)
 
+        if is_short_post_link(url):
+            # resolver o link curto pode ir à rede: não arriscar a janela de 3s do Discord
+            await safe_defer(interaction, "submit")
+        url, canonical_id = await canonicalize_post_url(url)
         platform = detect_platform(url)
-        if platform == "tiktok":
-            url = normalize_tiktok_url(url)
 
-        allowed = parse_campaign_platforms(platforms)
+        allowed = cfg.allowed_platforms
         if platform not in allowed:
             return await safe_reply(interaction, f"❌ Esta campanha só aceita: **{', '.join([p.upper() for p in allowed])}**.", ephemeral=True)
 
-        linked = get_linked_account(int(interaction.user.id), platform)
+        linked = await db_read(get_linked_account, int(interaction.user.id), platform)
         if not linked:
             return await safe_reply(
                 interaction,
@@ -1510,33 +2814,14 @@ class SubmitLinkModal(discord.ui.Modal):
 
         linked_username = str(linked[0])
 
-        conn2 = db_conn()
-        cur2 = conn2.cursor()
-
-        cur2.execute("""
-        SELECT COUNT(*)
-        FROM submissions
-        WHERE campaign_id=? AND status IN ('pending','approved')
-        """, (int(camp_id),))
-        total_active_posts = int((cur2.fetchone() or [0])[0])
-        if total_active_posts >= int(max_posts_total):
-            conn2.close()
+        result, submission_id = await db_run(
+            insert_pending_submission, int(camp_id), int(interaction.user.id), url, platform, int(max_posts_total), canonical_id
+        )
+        if result == "full":
             return await safe_reply(interaction, f"⚠️ Esta campanha já atingiu o máximo de posts (**{max_posts_total}**).", ephemeral=True)
-
-        now = _now()
-        try:
-            cur2.execute("""
-            INSERT INTO submissions (campaign_id, user_id, post_url, platform, status, created_at)
-            VALUES (?, ?, ?, ?, 'pending', ?)
-            """, (int(camp_id), interaction.user.id, url, platform, now))
-            submission_id = int(cur2.lastrowid)
-            conn2.commit()
-        except sqlite3.IntegrityError:
-            conn2.close()
+        if result == "duplicate":
             return await safe_reply(interaction, "⚠️ Este link já foi submetido nesta campanha.", ephemeral=True)
 
-        conn2.close()
-
         appr = guild.get_channel(VERIFICACOES_CHANNEL_ID)
         if appr:
             await appr.send(
@@ -1551,7 +2836,7 @@ class SubmitLinkModal(discord.ui.Modal):
                 view=submission_approval_view(submission_id)
             )
 
-        approved, _, _ = get_user_submission_counts(int(camp_id), int(interaction.user.id))
+        approved, _, _ = await db_read(get_user_submission_counts, int(camp_id), int(interaction.user.id))
         extra = ""
         if approved >= MAX_APPROVED_PER_USER:
             extra = f"\n\n⚠️ Nota: já tens **{MAX_APPROVED_PER_USER} aprovados**. Este link pode não ser aprovado."
@@ -1579,39 +2864,23 @@ class RemoveLinkModal(discord.ui.Modal):
         if not member or not is_verified(member):
             return await safe_reply(interaction, "⛔ Tens de estar **Verificado**.", ephemeral=True)
 
-        if not is_campaign_member(self.campaign_id, interaction.user.id):
+        if not await db_read(is_campaign_member, self.campaign_id, interaction.user.id):
             return await safe_reply(interaction, "⛔ Primeiro tens de **aderir** à campanha.", ephemeral=True)
 
         url = str(self.url.value).strip()
-        if "tiktok.com" in url.lower():
-            url = normalize_tiktok_url(url)
+        if is_short_post_link(url):
+            await safe_defer(interaction, "remove")
+        url, canonical_id = await canonicalize_post_url(url)
 
-        conn = db_conn()
-        cur = conn.cursor()
-        cur.execute("""
-        SELECT id, status
-        FROM submissions
-        WHERE campaign_id=? AND user_id=? AND post_url=?
-        """, (self.campaign_id, interaction.user.id, url))
-        row = cur.fetchone()
+        row = await db_read(find_user_submission, self.campaign_id, interaction.user.id, url, canonical_id)
         if not row:
-            conn.close()
             return await safe_reply(interaction, "❌ Não encontrei esse link nas tuas submissões desta campanha.", ephemeral=True)
 
         sub_id, st = row
         if st == "removed":
-            conn.close()
             return await safe_reply(interaction, "⚠️ Esse vídeo já foi retirado.", ephemeral=True)
 
-        cur.execute("""
-            UPDATE submissions
-            SET status='removed',
-                is_tracking=0,
-                next_check_at=NULL
-            WHERE id=?
-        """, (int(sub_id),))
-        conn.commit()
-        conn.close()
+        await db_run(close_submission, int(sub_id), "removed")
 
         await safe_reply(interaction, "✅ Vídeo retirado. Ele deixa de ser contado/atualizado.", ephemeral=True)
 
@@ -1630,7 +2899,7 @@ async def ensure_campaign_role(guild: discord.Guild, campaign_id: int, slug: str
     if role is None:
         role = await guild.create_role(name=role_name, reason="Viralizzaa campaign access role")
 
-    set_campaign_role_id(campaign_id, role.id)
+    await db_run(set_campaign_role_id, campaign_id, role.id)
     return role
 
 async def ensure_campaign_workspace_private(
@@ -1698,7 +2967,8 @@ async def ensure_campaign_workspace_private(
     submit_panel = await submit_ch.send("📤 **Submete os teus links aqui**\n\nUsa os botões 👇", view=submit_view(camp_id))
     lb_msg = await lb_ch.send("🏆 **Tabela de classificação**\n(aguarda atualizações automáticas)")
 
-    set_campaign_workspace_ids(
+    await db_run(
+        set_campaign_workspace_ids,
         campaign_id=camp_id,
         category_id=category.id,
         details_id=details_ch.id,
@@ -1744,28 +3014,8 @@ async def campanha(ctx):
     if ctx.guild and ctx.guild.id != SERVER_ID:
         return
 
-    conn = db_conn()
-    cur = conn.cursor()
-    now = _now()
     c = TREEZY_TEST_CAMPAIGN
-
-    cur.execute("""
-    INSERT OR IGNORE INTO campaigns
-    (name, slug, platforms, content_types, audio_url, rate_kz_per_1k,
-     budget_total_kz, max_payout_user_kz, max_posts_total,
-     campaigns_channel_id, created_at, ended_notified)
-    VALUES (?,?,?,?,?,?,?,?,?,?,?,0)
-    """, (
-        c["name"], c["slug"], c["platforms"], c["content_types"], c["audio_url"],
-        int(c["rate_kz_per_1k"]), int(c["budget_total_kz"]),
-        int(c["max_payout_user_kz"]), int(c["max_posts_total"]),
-        int(CAMPANHAS_CHANNEL_ID), int(now)
-    ))
-    conn.commit()
-
-    cur.execute("SELECT id, post_message_id FROM campaigns WHERE slug=?", (c["slug"],))
-    row = cur.fetchone()
-    conn.close()
+    row = await db_run(upsert_test_campaign, c)
 
     if not row:
         return await ctx.send("❌ Falha ao criar/encontrar campanha na DB.")
@@ -1787,7 +3037,7 @@ async def campanha(ctx):
 
     if needs_new_post:
         msg = await target.send(campaign_post_text(c), view=JoinCampaignView())
-        set_campaign_post_message_id(c["slug"], msg.id)
+        await db_run(set_campaign_post_message_id, c["slug"], msg.id)
 
     await ctx.send(f"✅ Campanha publicada em #campanhas. ID da campanha: **{camp_id}**")
 
@@ -1799,11 +3049,7 @@ async def relancar(ctx):
 @staff_only()
 @bot.command()
 async def listcampaigns(ctx):
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, status, spent_kz, budget_total_kz FROM campaigns ORDER BY id DESC LIMIT 25")
-    rows = cur.fetchall()
-    conn.close()
+    rows = await db_run(list_recent_campaigns, 25)
 
     if not rows:
         return await ctx.send("Não há campanhas na DB.")
@@ -1826,32 +3072,41 @@ async def campaignid(ctx):
 @staff_only()
 @bot.command()
 async def debugviews(ctx, url: str):
-    if not APIFY_TOKEN:
-        return await ctx.send("⚠️ APIFY_TOKEN não está definido no Render.")
-
     plat = detect_platform(url)
-    if plat == "tiktok":
-        url = normalize_tiktok_url(url)
-
-    actor_tk = normalize_apify_actor_id(APIFY_ACTOR_TIKTOK)
-    actor_ig = normalize_apify_actor_id(APIFY_ACTOR_INSTAGRAM)
-
-    await ctx.send(
-        "⏳ A testar no Apify…\n"
-        f"URL normalizado:\n{url}\n\n"
-        f"Actor TikTok (final): `{actor_tk}`\n"
-        f"Actor Instagram (final): `{actor_ig}`\n"
-        f"Proxy: {APIFY_USE_PROXY} country={APIFY_PROXY_COUNTRY} groups={APIFY_PROXY_GROUPS}"
-    )
+    provider = VIEW_PROVIDERS.get(plat)
+    if provider is None:
+        return await ctx.send(f"⚠️ Plataforma não suportada: `{plat}`.")
+    if not provider.available():
+        return await ctx.send("⚠️ " + ("YOUTUBE_API_KEY" if plat == "youtube" else "APIFY_TOKEN") + " não está definido no Render.")
+    url = provider.normalize_url(url)
+
+    if isinstance(provider, ApifyViewProvider):
+        actor_tk = normalize_apify_actor_id(APIFY_ACTOR_TIKTOK)
+        actor_ig = normalize_apify_actor_id(APIFY_ACTOR_INSTAGRAM)
+
+        shape_tk = await db_run(get_actor_shape, actor_tk)
+        shape_ig = await db_run(get_actor_shape, actor_ig)
+
+        await ctx.send(
+            "⏳ A testar no Apify…\n"
+            f"URL normalizado:\n{url}\n\n"
+            f"Actor TikTok (final): `{actor_tk}`\n"
+            f"Actor Instagram (final): `{actor_ig}`\n"
+            f"Formato aprendido TikTok: `{shape_tk}` | Instagram: `{shape_ig}`\n"
+            f"Proxy: {APIFY_USE_PROXY} country={APIFY_PROXY_COUNTRY} groups={APIFY_PROXY_GROUPS}"
+        )
+    else:
+        await ctx.send(f"⏳ A testar ({provider.platform})…\nURL normalizado:\n{url}")
 
-    v = await apify_get_views_for_url(url)
-    await ctx.send(f"📊 Views devolvidas: **{v}**")
+    from_cache = await db_run(get_cached_views, url) is not None
+    v = await get_views_for_url(url)
+    await ctx.send(f"📊 Views devolvidas: **{v}**" + (" (cache)" if from_cache else ""))
 
 @staff_only()
 @bot.command()
 async def refreshnow(ctx):
-    if not APIFY_TOKEN:
-        return await ctx.send("⚠️ APIFY_TOKEN não está definido no Render.")
+    if not any_view_provider_available():
+        return await ctx.send("⚠️ Nem APIFY_TOKEN nem YOUTUBE_API_KEY estão definidos no Render.")
 
     await ctx.send("⏳ A correr refresh agora…")
     await refresh_views_once()
@@ -1860,21 +3115,11 @@ async def refreshnow(ctx):
 @staff_only()
 @bot.command()
 async def endcampaign(ctx, campaign_id: int):
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT status, ended_notified FROM campaigns WHERE id=?", (int(campaign_id),))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
+    ended_notified = await db_run(end_campaign, int(campaign_id))
+    if ended_notified is None:
         return await ctx.send("❌ Campanha não encontrada.")
-    ended_notified = int(row[1] or 0)
-
-    cur.execute("UPDATE campaigns SET status='ended' WHERE id=?", (int(campaign_id),))
-    conn.commit()
-    conn.close()
 
     if ended_notified == 0:
-        mark_campaign_ended_notified(int(campaign_id))
         await notify_campaign_finished(int(campaign_id), winner_user_id=None, reason="manual")
 
     await update_leaderboard_for_campaign(int(campaign_id))
@@ -1902,12 +3147,11 @@ async def restartcampaign(ctx, campaign_id: int):
     if not guild:
         return await ctx.send("⚠️ Guild não encontrada.")
 
-    row = get_campaign_basic(int(campaign_id))
-    if not row:
+    cfg = await campaign_config(int(campaign_id))
+    if not cfg:
         return await ctx.send("❌ Campanha não encontrada.")
 
-    role_id = row[16]
-    role = guild.get_role(int(role_id)) if role_id else None
+    role = guild.get_role(cfg.campaign_role_id) if cfg.campaign_role_id else None
 
     await ctx.send(f"⚠️ A reiniciar campanha {campaign_id}… (vai apagar tudo)")
 
@@ -1923,7 +3167,7 @@ async def restartcampaign(ctx, campaign_id: int):
         except:
             pass
 
-    reset_campaign_all(int(campaign_id), reset_spent=True)
+    await db_run(reset_campaign_all, int(campaign_id), reset_spent=True)
     await update_leaderboard_for_campaign(int(campaign_id))
 
     await ctx.send(
@@ -1940,26 +3184,14 @@ async def pureghosts(ctx, user_id: int):
     if not guild:
         return await ctx.send("⚠️ Guild não encontrada.")
 
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT DISTINCT campaign_id FROM (
-            SELECT campaign_id FROM campaign_members WHERE user_id=?
-            UNION
-            SELECT campaign_id FROM submissions WHERE user_id=?
-            UNION
-            SELECT campaign_id FROM campaign_users WHERE user_id=?
-        )
-    """, (int(user_id), int(user_id), int(user_id)))
-    cids = [int(r[0]) for r in cur.fetchall()]
-    conn.close()
+    cids = await db_run(list_user_campaign_ids, int(user_id))
 
     if not cids:
         return await ctx.send(f"✅ Nada para limpar. user_id `{user_id}` não aparece em nenhuma campanha.")
 
     touched: Set[int] = set()
     for cid in cids:
-        reset_user_in_campaign(int(cid), int(user_id), refund_budget=True)
+        await db_run(reset_user_in_campaign, int(cid), int(user_id), refund_budget=True)
         mem = await fetch_member_safe(guild, int(user_id))
         if mem:
             await remove_campaign_role_from_member(guild, int(cid), mem)
@@ -1970,31 +3202,67 @@ async def pureghosts(ctx, user_id: int):
 
     await ctx.send(f"🧼 pureghosts concluído: user_id `{user_id}` removido de {len(touched)} campanha(s).")
 
+@staff_only()
+@bot.command()
+async def routestats(ctx):
+    routes = sorted(ROUTER.routes, key=lambda r: r.calls, reverse=True)
+    lines = []
+    for r in routes:
+        if not r.calls:
+            continue
+        avg = r.total_ms / r.calls
+        lines.append(f"{r.pattern} — {r.calls}x | média {avg:.0f} ms | máx {r.max_ms:.0f} ms | defer {r.deferred} | erros {r.errors}")
+    if not lines:
+        return await ctx.send("📭 Ainda não houve interações desde o arranque.")
+    await ctx.send("📈 **Interações por rota (desde o arranque)**\n```\n" + "\n".join(lines)[:1800] + "\n```")
+
 # =========================
 # REATTACH PANELS
 # =========================
-async def reattach_pending_verification_views():
+# (tipo, message_id) já reanexados neste processo — on_ready volta a correr em cada reconnect
+REATTACHED: Set[Tuple[str, int]] = set()
+
+async def reattach_messages(kind: str, items: List[Tuple[Any, int, discord.ui.View]]) -> Tuple[int, int, int]:
+    sem = asyncio.Semaphore(REATTACH_CONCURRENCY)
+    ok = skipped = failed = 0
+
+    async def one(channel, msg_id: int, view: discord.ui.View):
+        nonlocal ok, skipped, failed
+        key = (kind, int(msg_id))
+        if key in REATTACHED:
+            skipped += 1
+            return
+        async with sem:
+            try:
+                # edit direto na mensagem parcial: 1 pedido em vez de fetch + edit
+                await channel.get_partial_message(int(msg_id)).edit(view=view)
+                REATTACHED.add(key)
+                ok += 1
+            except discord.NotFound:
+                REATTACHED.add(key)
+                failed += 1
+            except:
+                failed += 1
+
+    await asyncio.gather(*(one(ch, mid, v) for ch, mid, v in items))
+    return ok, skipped, failed
+
+async def reattach_pending_verification_views() -> Tuple[int, int, int]:
     guild = bot.get_guild(SERVER_ID)
     if not guild:
-        return
+        return 0, 0, 0
     ch = guild.get_channel(VERIFICACOES_CHANNEL_ID)
     if not ch:
-        return
+        return 0, 0, 0
 
-    for (user_id, social, username, code, vch_id, msg_id) in list_pending_verifications():
-        try:
-            if vch_id and msg_id:
-                vch = guild.get_channel(int(vch_id)) or ch
-                msg = await vch.fetch_message(int(msg_id))
-                await msg.edit(view=verify_approval_view(int(user_id)))
-        except:
-            pass
-
-async def reattach_submit_panels():
-    guild = bot.get_guild(SERVER_ID)
-    if not guild:
-        return
+    items: List[Tuple[Any, int, discord.ui.View]] = []
+    for (user_id, social, username, code, vch_id, msg_id) in await db_run(list_pending_verifications):
+        if vch_id and msg_id:
+            vch = guild.get_channel(int(vch_id)) or ch
+            items.append((vch, int(msg_id), verify_approval_view(int(user_id))))
+    return await reattach_messages("verify", items)
 
+def list_submit_panels():
     conn = db_conn()
     cur = conn.cursor()
     cur.execute("""
@@ -2004,25 +3272,38 @@ async def reattach_submit_panels():
     """)
     rows = cur.fetchall()
     conn.close()
+    return rows
 
-    for cid, submit_ch_id, panel_msg_id in rows:
-        try:
-            submit_ch = guild.get_channel(int(submit_ch_id))
-            if not submit_ch:
-                continue
-            msg = await submit_ch.fetch_message(int(panel_msg_id))
-            await msg.edit(view=submit_view(int(cid)))
-        except:
-            pass
+async def reattach_submit_panels() -> Tuple[int, int, int]:
+    guild = bot.get_guild(SERVER_ID)
+    if not guild:
+        return 0, 0, 0
+
+    items: List[Tuple[Any, int, discord.ui.View]] = []
+    for cid, submit_ch_id, panel_msg_id in await db_run(list_submit_panels):
+        submit_ch = guild.get_channel(int(submit_ch_id))
+        if not submit_ch:
+            continue
+        items.append((submit_ch, int(panel_msg_id), submit_view(int(cid))))
+    return await reattach_messages("submit", items)
+
+async def reattach_panels_background():
+    t0 = time.monotonic()
+    try:
+        verify_counts, submit_counts = await asyncio.gather(
+            reattach_pending_verification_views(),
+            reattach_submit_panels(),
+        )
+        print(f"[STARTUP] painéis reanexados em {time.monotonic() - t0:.1f}s | "
+              f"verificações ok/skip/falha={verify_counts[0]}/{verify_counts[1]}/{verify_counts[2]} | "
+              f"submissão ok/skip/falha={submit_counts[0]}/{submit_counts[1]}/{submit_counts[2]}")
+    except Exception as e:
+        print("⚠️ Erro ao reanexar views:", e)
 
 # =========================
 # LEADERBOARD
 # =========================
-async def update_leaderboard_for_campaign(campaign_id: int):
-    guild = bot.get_guild(SERVER_ID)
-    if not guild:
-        return
-
+def get_leaderboard_rows(campaign_id: int):
     conn = db_conn()
     cur = conn.cursor()
     cur.execute("""
@@ -2032,27 +3313,66 @@ async def update_leaderboard_for_campaign(campaign_id: int):
     camp = cur.fetchone()
     if not camp:
         conn.close()
-        return
-
-    lb_ch_id, lb_msg_id, name, spent, budget, status, rate = camp
+        return None, []
 
     cur.execute("""
-    SELECT s.user_id,
-           COALESCE(SUM(s.views_current),0) AS views_current_sum,
-           COALESCE(cu.paid_kz,0) AS paid_kz,
-           COALESCE(cu.total_views_paid,0) AS views_paid
-    FROM submissions s
+    SELECT st.user_id, st.views_current, st.paid_kz, st.views_paid
+    FROM campaign_user_stats st
     JOIN campaign_members cm
-      ON cm.campaign_id = s.campaign_id AND cm.user_id = s.user_id
-    LEFT JOIN campaign_users cu
-      ON cu.campaign_id = s.campaign_id AND cu.user_id = s.user_id
-    WHERE s.campaign_id=? AND s.status='approved'
-    GROUP BY s.user_id
-    ORDER BY paid_kz DESC, views_current_sum DESC
+      ON cm.campaign_id = st.campaign_id AND cm.user_id = st.user_id
+    WHERE st.campaign_id=? AND st.approved_count > 0
+    ORDER BY st.paid_kz DESC, st.views_current DESC
     LIMIT 20
     """, (campaign_id,))
     raw_top = cur.fetchall()
     conn.close()
+    return camp, raw_top
+
+def set_campaign_leaderboard_message_id(campaign_id: int, msg_id: int):
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("UPDATE campaigns SET leaderboard_message_id=? WHERE id=?", (int(msg_id), int(campaign_id)))
+    conn.commit()
+    conn.close()
+    invalidate_campaign_config(campaign_id)
+
+LEADERBOARD_DIRTY: Set[int] = set()
+# campaign_id -> (message_id, hash do texto publicado)
+LEADERBOARD_PUBLISHED: Dict[int, Tuple[int, str]] = {}
+_LEADERBOARD_FLUSH_TASK: Optional[asyncio.Task] = None
+
+async def update_leaderboard_for_campaign(campaign_id: int):
+    # marca a campanha como suja; várias chamadas dentro da janela resultam num só render
+    global _LEADERBOARD_FLUSH_TASK
+    LEADERBOARD_DIRTY.add(int(campaign_id))
+    if LEADERBOARD_DEBOUNCE_SECONDS <= 0:
+        await flush_dirty_leaderboards()
+        return
+    if _LEADERBOARD_FLUSH_TASK is None or _LEADERBOARD_FLUSH_TASK.done():
+        _LEADERBOARD_FLUSH_TASK = asyncio.create_task(_flush_leaderboards_later())
+
+async def _flush_leaderboards_later():
+    await asyncio.sleep(LEADERBOARD_DEBOUNCE_SECONDS)
+    await flush_dirty_leaderboards()
+
+async def flush_dirty_leaderboards():
+    while LEADERBOARD_DIRTY:
+        campaign_id = LEADERBOARD_DIRTY.pop()
+        try:
+            await render_leaderboard_for_campaign(campaign_id)
+        except Exception as e:
+            print(f"⚠️ leaderboard campanha={campaign_id} erro:", e)
+
+async def render_leaderboard_for_campaign(campaign_id: int):
+    guild = bot.get_guild(SERVER_ID)
+    if not guild:
+        return
+
+    camp, raw_top = await db_run(get_leaderboard_rows, int(campaign_id))
+    if not camp:
+        return
+
+    lb_ch_id, lb_msg_id, name, spent, budget, status, rate = camp
 
     if not lb_ch_id:
         return
@@ -2085,33 +3405,423 @@ async def update_leaderboard_for_campaign(campaign_id: int):
                 f"**{i}.** <@{uid}> — **{int(paid_kz):,} Kz** | views atuais: **{int(vcur):,}** | views pagas: **{int(vpaid):,}**"
             )
 
+    content = "\n".join(lines)
+    digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+    if lb_msg_id and LEADERBOARD_PUBLISHED.get(int(campaign_id)) == (int(lb_msg_id), digest):
+        return
+
     try:
         if lb_msg_id:
-            msg = await ch.fetch_message(int(lb_msg_id))
-            await msg.edit(content="\n".join(lines))
+            # edita sem fetch_message: a mensagem parcial chega para o PATCH
+            await ch.get_partial_message(int(lb_msg_id)).edit(content=content)
+            LEADERBOARD_PUBLISHED[int(campaign_id)] = (int(lb_msg_id), digest)
             return
     except:
         pass
 
     try:
-        new_msg = await ch.send("\n".join(lines))
-        connx = db_conn()
-        cx = connx.cursor()
-        cx.execute("UPDATE campaigns SET leaderboard_message_id=? WHERE id=?", (int(new_msg.id), int(campaign_id)))
-        connx.commit()
-        connx.close()
+        new_msg = await ch.send(content)
+        await db_run(set_campaign_leaderboard_message_id, int(campaign_id), int(new_msg.id))
+        LEADERBOARD_PUBLISHED[int(campaign_id)] = (int(new_msg.id), digest)
     except:
         pass
 
+# =========================
+# NOTIFICATION QUEUE
+# =========================
+_NOTIFY_WAKE: Optional[asyncio.Event] = None
+
+def enqueue_notifications(messages: List[Tuple[int, str, Optional[int]]]):
+    now_ts = _now()
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.executemany("""
+        INSERT INTO outbound_messages (user_id, content, fallback_channel_id, attempts, next_attempt_at, created_at)
+        VALUES (?, ?, ?, 0, ?, ?)
+    """, [(int(uid), str(content), fallback, now_ts, now_ts) for uid, content, fallback in messages])
+    conn.commit()
+    conn.close()
+
+def claim_due_notifications(now_ts: int, limit: int, lease_seconds: int = 300) -> List[tuple]:
+    # empurra o next_attempt_at dos que levamos: se o bot morrer a meio, voltam à fila depois do lease
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, user_id, content, fallback_channel_id, attempts
+        FROM outbound_messages
+        WHERE next_attempt_at <= ?
+        ORDER BY next_attempt_at ASC, id ASC
+        LIMIT ?
+    """, (int(now_ts), int(limit)))
+    rows = cur.fetchall()
+    if rows:
+        cur.executemany("UPDATE outbound_messages SET next_attempt_at=? WHERE id=?",
+                        [(int(now_ts) + lease_seconds, int(r[0])) for r in rows])
+    conn.commit()
+    conn.close()
+    return rows
+
+def settle_notifications(done_ids: List[int], retries: List[Tuple[int, int, int]]):
+    conn = db_conn()
+    cur = conn.cursor()
+    if done_ids:
+        cur.executemany("DELETE FROM outbound_messages WHERE id=?", [(int(i),) for i in done_ids])
+    if retries:
+        cur.executemany("UPDATE outbound_messages SET attempts=?, next_attempt_at=? WHERE id=?",
+                        [(int(a), int(ts), int(i)) for i, a, ts in retries])
+    conn.commit()
+    conn.close()
+
+def next_notification_due_at() -> Optional[int]:
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT MIN(next_attempt_at) FROM outbound_messages")
+    row = cur.fetchone()
+    conn.close()
+    return int(row[0]) if row and row[0] is not None else None
+
+async def queue_notifications(messages: List[Tuple[int, str, Optional[int]]]):
+    if not messages:
+        return
+    await db_run(enqueue_notifications, messages)
+    if _NOTIFY_WAKE is not None:
+        _NOTIFY_WAKE.set()
+
+async def send_fallback_mentions(guild: discord.Guild, fallbacks: Dict[Tuple[int, str], List[int]]):
+    # um user com DMs fechadas = uma menção; várias menções para o mesmo texto vão juntas
+    for (channel_id, content), user_ids in fallbacks.items():
+        ch = guild.get_channel(int(channel_id))
+        if not ch:
+            continue
+        mentions: List[str] = []
+        for uid in dict.fromkeys(user_ids):
+            mention = f"<@{int(uid)}>"
+            if mentions and len(" ".join(mentions + [mention])) + len(content) + 1 > 2000:
+                try:
+                    await ch.send(f"{' '.join(mentions)} {content}")
+                except:
+                    pass
+                mentions = []
+            mentions.append(mention)
+        if mentions:
+            try:
+                await ch.send(f"{' '.join(mentions)} {content}")
+            except:
+                pass
+
+async def deliver_notifications(rows: List[tuple]):
+    guild = bot.get_guild(SERVER_ID)
+    if not guild:
+        return
+
+    sem = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+    done_ids: List[int] = []
+    retries: List[Tuple[int, int, int]] = []
+    fallbacks: Dict[Tuple[int, str], List[int]] = {}
+
+    def fall_back(msg_id: int, user_id: int, content: str, fallback_channel_id: Optional[int]):
+        done_ids.append(msg_id)
+        if fallback_channel_id:
+            fallbacks.setdefault((int(fallback_channel_id), content), []).append(user_id)
+
+    async def deliver(row: tuple):
+        msg_id, user_id, content, fallback_channel_id, attempts = row
+        async with sem:
+            try:
+                member = await fetch_member_confirmed(guild, int(user_id))
+                if member is None:
+                    # saiu do servidor: a mensagem já não tem destino
+                    done_ids.append(int(msg_id))
+                    return
+                # o cliente HTTP do discord.py já espera pelos buckets/429 antes de devolver erro
+                await member.send(content)
+                done_ids.append(int(msg_id))
+            except discord.Forbidden:
+                fall_back(int(msg_id), int(user_id), content, fallback_channel_id)
+            except Exception as e:
+                attempts = int(attempts) + 1
+                if attempts >= NOTIFY_MAX_ATTEMPTS:
+                    print(f"⚠️ DM falhou {attempts}x user={user_id}:", e)
+                    fall_back(int(msg_id), int(user_id), content, fallback_channel_id)
+                else:
+                    backoff = NOTIFY_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+                    retries.append((int(msg_id), attempts, _now() + backoff))
+
+    await asyncio.gather(*(deliver(r) for r in rows))
+    await send_fallback_mentions(guild, fallbacks)
+    await db_run(settle_notifications, done_ids, retries)
+    if len(rows) > 1:
+        print(f"[NOTIFY] {len(done_ids) - sum(len(v) for v in fallbacks.values())} DMs | "
+              f"{sum(len(v) for v in fallbacks.values())} fallback | {len(retries)} a repetir")
+
+async def notification_queue_loop():
+    global _NOTIFY_WAKE
+    await bot.wait_until_ready()
+    _NOTIFY_WAKE = asyncio.Event()
+    while not bot.is_closed():
+        try:
+            rows = await db_run(claim_due_notifications, _now(), NOTIFY_BATCH_SIZE)
+            if rows:
+                await deliver_notifications(rows)
+                continue
+
+            nxt = await db_run(next_notification_due_at)
+            sleep_for = 300.0 if nxt is None else max(1.0, float(nxt - _now()))
+            _NOTIFY_WAKE.clear()
+            try:
+                await asyncio.wait_for(_NOTIFY_WAKE.wait(), timeout=min(300.0, sleep_for))
+            except asyncio.TimeoutError:
+                pass
+        except Exception as e:
+            print("⚠️ notification_queue_loop erro:", e)
+            traceback.print_exc()
+            await asyncio.sleep(5)
+
 # =========================
 # APIFY
 # =========================
-async def apify_run(actor: str, payload: dict) -> Optional[dict]:
+_APIFY_SEMAPHORES: Dict[str, asyncio.Semaphore] = {}
+
+def apify_semaphore(key: str, limit: int) -> asyncio.Semaphore:
+    sem = _APIFY_SEMAPHORES.get(key)
+    if sem is None:
+        sem = asyncio.Semaphore(max(1, int(limit)))
+        _APIFY_SEMAPHORES[key] = sem
+    return sem
+
+def apify_actor_semaphore(actor_id: str) -> asyncio.Semaphore:
+    return apify_semaphore(f"actor:{actor_id}", APIFY_ACTOR_CONCURRENCY.get(actor_id, APIFY_MAX_CONCURRENCY))
+
+class ApifyUpstreamError(Exception):
+    # o Apify/actor está com problemas (402/429/5xx, run falhado, rede): conta para o circuit breaker
+    def __init__(self, message: str, status: int = 0, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(0.0, float(str(value).strip()))
+    except:
+        return None
+
+class CircuitBreaker:
+    # closed -> open (taxa de falhas na janela) -> half_open (um só pedido de teste) -> closed / open
+    __slots__ = ("name", "state", "outcomes", "open_until", "open_seconds", "probing")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.outcomes: deque = deque(maxlen=APIFY_BREAKER_WINDOW)
+        self.open_until = 0.0
+        self.open_seconds = float(APIFY_BREAKER_OPEN_SECONDS)
+        self.probing = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.time() < self.open_until:
+                return False
+            self.state = "half_open"
+            self.probing = False
+        if self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def retry_at(self) -> Optional[int]:
+        # None = um pedido agora seria aceite
+        if self.state == "open" and time.time() < self.open_until:
+            return int(self.open_until) + 1
+        if self.state == "half_open" and self.probing:
+            return _now() + int(self.open_seconds)
+        return None
+
+    def record(self, ok: bool, retry_after: Optional[float] = None):
+        if self.state == "half_open":
+            self.probing = False
+            if ok:
+                self.state = "closed"
+                self.outcomes.clear()
+                self.open_seconds = float(APIFY_BREAKER_OPEN_SECONDS)
+                print(f"[APIFY] circuito FECHADO actor={self.name}")
+            else:
+                self.open_seconds = min(float(APIFY_BREAKER_MAX_OPEN_SECONDS), self.open_seconds * 2)
+                self._open(retry_after)
+            return
+
+        self.outcomes.append(bool(ok))
+        failures = sum(1 for o in self.outcomes if not o)
+        if not ok and len(self.outcomes) >= APIFY_BREAKER_MIN_CALLS and failures / len(self.outcomes) >= APIFY_BREAKER_FAILURE_RATE:
+            self._open(retry_after)
+
+    def release_probe(self):
+        self.probing = False
+
+    def _open(self, retry_after: Optional[float]):
+        wait = max(self.open_seconds, float(retry_after or 0))
+        self.state = "open"
+        self.open_until = time.time() + wait
+        print(f"[APIFY] circuito ABERTO actor={self.name} durante {int(wait)}s")
+
+class AdaptiveTokenBucket:
+    # AIMD: 429 corta o ritmo a metade e respeita o Retry-After; cada sucesso devolve 5% do máximo
+    __slots__ = ("rate", "max_rate", "min_rate", "tokens", "updated", "paused_until", "_lock")
+
+    def __init__(self, per_minute: float):
+        self.max_rate = float(per_minute) / 60.0
+        self.min_rate = min(self.max_rate, 1.0 / 60.0)
+        self.rate = self.max_rate
+        self.tokens = max(1.0, self.max_rate * 10)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _capacity(self) -> float:
+        return max(1.0, self.rate * 10)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self._capacity(), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+    def on_throttled(self, retry_after: Optional[float]):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        pause = float(retry_after) if retry_after else 1.0 / self.rate
+        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        print(f"[APIFY] 429: ritmo reduzido para {self.rate * 60:.1f} runs/min, pausa {pause:.0f}s")
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+class ApifyActorGuard:
+    __slots__ = ("breaker", "bucket")
+
+    def __init__(self, actor_id: str):
+        self.breaker = CircuitBreaker(actor_id)
+        self.bucket = AdaptiveTokenBucket(APIFY_RUNS_PER_MINUTE)
+
+APIFY_GUARDS: Dict[str, ApifyActorGuard] = {}
+
+def apify_guard(actor_id: str) -> ApifyActorGuard:
+    guard = APIFY_GUARDS.get(actor_id)
+    if guard is None:
+        guard = ApifyActorGuard(actor_id)
+        APIFY_GUARDS[actor_id] = guard
+    return guard
+
+async def apify_run_items(actor: str, payload: dict, limit: int = 5) -> Optional[List[dict]]:
+    # None = o run correu mas não trouxe items (formato do payload?); ApifyUpstreamError = Apify/actor em baixo
     if not APIFY_TOKEN:
         return None
 
     actor_id = normalize_apify_actor_id(actor)
-    run_url = f"https://api.apify.com/v2/acts/{actor_id}/runs?token={APIFY_TOKEN}"
+    guard = apify_guard(actor_id)
+    if not guard.breaker.allow():
+        raise ApifyUpstreamError("circuito aberto")
+    try:
+        # o token é pedido antes do teto global: uma pausa por 429 neste actor não prende os outros
+        await guard.bucket.acquire()
+        # teto global de runs em simultâneo na conta Apify, partilhado por todas as plataformas
+        async with apify_semaphore("global", APIFY_MAX_CONCURRENCY), apify_actor_semaphore(actor_id):
+            try:
+                items = await _apify_run_items(actor_id, payload, limit)
+            except ApifyUpstreamError as e:
+                print(f"⚠️ APIFY actor={actor_id}: {e}")
+                if e.status == 429:
+                    guard.bucket.on_throttled(e.retry_after)
+                guard.breaker.record(False, e.retry_after)
+                raise
+        guard.bucket.on_success()
+        guard.breaker.record(True)
+        return items
+    finally:
+        # cancelado a meio de um teste half-open: não deixa o circuito preso
+        guard.breaker.release_probe()
+
+APIFY_TERMINAL_STATUSES = ("SUCCEEDED", "FAILED", "ABORTED", "TIMED-OUT")
+
+APIFY_RUN_WAITERS: Dict[str, asyncio.Future] = {}
+APIFY_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+def apify_webhooks_param() -> Optional[str]:
+    if not APIFY_WEBHOOKS_ENABLED:
+        return None
+    request_url = f"{APIFY_WEBHOOK_URL}/apify/webhook?secret={urllib.parse.quote(APIFY_WEBHOOK_SECRET, safe='')}"
+    hooks = [{
+        "eventTypes": ["ACTOR.RUN.SUCCEEDED", "ACTOR.RUN.FAILED", "ACTOR.RUN.ABORTED", "ACTOR.RUN.TIMED_OUT"],
+        "requestUrl": request_url,
+    }]
+    return base64.b64encode(json.dumps(hooks).encode("utf-8")).decode("ascii")
+
+def resolve_apify_waiter(run_id: str, run: dict):
+    fut = APIFY_RUN_WAITERS.get(str(run_id))
+    if fut is not None and not fut.done():
+        fut.set_result(run or {})
+
+async def apify_get_run(session: aiohttp.ClientSession, run_id: str, wait_secs: int = 0) -> Optional[dict]:
+    url = f"{APIFY_BASE_URL}/v2/actor-runs/{run_id}?token={APIFY_TOKEN}"
+    if wait_secs > 0:
+        url += f"&waitForFinish={int(wait_secs)}"
+    async with session.get(url) as rr:
+        rr_txt = await rr.text()
+        if rr.status >= 400:
+            print(f"⚠️ APIFY RUN status={rr.status} body={rr_txt[:1200]}")
+            return None
+        rd = await rr.json()
+        return (rd.get("data") or {})
+
+async def apify_wait_for_run(session: aiohttp.ClientSession, run_id: str) -> Optional[dict]:
+    # run longo: fica à espera do webhook (se configurado) ou faz long-poll com waitForFinish no servidor do Apify
+    global APIFY_LOOP
+    deadline = time.monotonic() + APIFY_RUN_MAX_WAIT_SECS
+    print(f"[APIFY] run {run_id} ainda a correr; a aguardar {'webhook' if APIFY_WEBHOOKS_ENABLED else 'long-poll'}")
+
+    if APIFY_WEBHOOKS_ENABLED:
+        APIFY_LOOP = asyncio.get_running_loop()
+        fut = APIFY_RUN_WAITERS.get(run_id)
+        if fut is None:
+            fut = APIFY_LOOP.create_future()
+            APIFY_RUN_WAITERS[run_id] = fut
+        try:
+            run = await apify_get_run(session, run_id)
+            if run is None or run.get("status") in APIFY_TERMINAL_STATUSES:
+                return run
+            run = await asyncio.wait_for(asyncio.shield(fut), timeout=APIFY_RUN_MAX_WAIT_SECS)
+            if run.get("status") in APIFY_TERMINAL_STATUSES:
+                return run
+        except asyncio.TimeoutError:
+            print(f"⚠️ APIFY: webhook do run {run_id} não chegou a tempo")
+        finally:
+            APIFY_RUN_WAITERS.pop(run_id, None)
+        return await apify_get_run(session, run_id)
+
+    run = None
+    while time.monotonic() < deadline:
+        wait = int(min(APIFY_WAIT_FOR_FINISH_SECS or 60, max(1, deadline - time.monotonic())))
+        run = await apify_get_run(session, run_id, wait_secs=wait)
+        if run is None or run.get("status") in APIFY_TERMINAL_STATUSES:
+            return run
+    return run
+
+async def _apify_run_items(actor_id: str, payload: dict, limit: int) -> Optional[List[dict]]:
+    run_url = f"{APIFY_BASE_URL}/v2/acts/{actor_id}/runs?token={APIFY_TOKEN}"
+    if APIFY_WAIT_FOR_FINISH_SECS > 0:
+        run_url += f"&waitForFinish={APIFY_WAIT_FOR_FINISH_SECS}"
+    hooks = apify_webhooks_param()
+    if hooks:
+        run_url += f"&webhooks={urllib.parse.quote(hooks, safe='')}"
 
     proxy_cfg = build_proxy_configuration()
     if proxy_cfg:
@@ -2123,6 +3833,8 @@ async def apify_run(actor: str, payload: dict) -> Optional[dict]:
 
         async with session.post(run_url, json=payload) as r:
             txt = await r.text()
+            if r.status in (402, 429) or r.status >= 500:
+                raise ApifyUpstreamError(f"POST status={r.status} body={txt[:300]}", r.status, parse_retry_after(r.headers.get("Retry-After")))
             if r.status >= 400:
                 print(f"⚠️ APIFY POST status={r.status} actor={actor_id} body={txt[:1200]}")
                 return None
@@ -2135,29 +3847,21 @@ async def apify_run(actor: str, payload: dict) -> Optional[dict]:
                 print("⚠️ APIFY: run sem id/dataset:", data)
                 return None
 
-        status = None
-        last_run_info = None
-        for _ in range(35):
-            async with session.get(f"https://api.apify.com/v2/actor-runs/{run_id}?token={APIFY_TOKEN}") as rr:
-                rr_txt = await rr.text()
-                if rr.status >= 400:
-                    print(f"⚠️ APIFY RUN status={rr.status} body={rr_txt[:1200]}")
-                    return None
-                rd = await rr.json()
-                last_run_info = (rd.get("data") or {})
-                status = last_run_info.get("status")
-                if status in ("SUCCEEDED", "FAILED", "ABORTED", "TIMED-OUT"):
-                    break
-            await asyncio.sleep(2)
+        last_run_info = run
+        status = run.get("status")
+        if status not in APIFY_TERMINAL_STATUSES:
+            last_run_info = await apify_wait_for_run(session, str(run_id)) or {}
+            status = last_run_info.get("status")
 
         if status != "SUCCEEDED":
-            print("⚠️ APIFY: run status:", status, "error:", (last_run_info or {}).get("errorMessage"))
-            return None
+            raise ApifyUpstreamError(f"run {run_id} status={status} error={(last_run_info or {}).get('errorMessage')}")
 
         async with session.get(
-            f"https://api.apify.com/v2/datasets/{dataset_id}/items?token={APIFY_TOKEN}&clean=true&limit=5"
+            f"{APIFY_BASE_URL}/v2/datasets/{dataset_id}/items?token={APIFY_TOKEN}&clean=true&limit={int(limit)}"
         ) as ri:
             ri_txt = await ri.text()
+            if ri.status == 429 or ri.status >= 500:
+                raise ApifyUpstreamError(f"DATASET status={ri.status} body={ri_txt[:300]}", ri.status, parse_retry_after(ri.headers.get("Retry-After")))
             if ri.status >= 400:
                 print(f"⚠️ APIFY DATASET status={ri.status} body={ri_txt[:1200]}")
                 return None
@@ -2167,7 +3871,11 @@ async def apify_run(actor: str, payload: dict) -> Optional[dict]:
             print("⚠️ APIFY: dataset sem items. payload usado:", payload)
             return None
 
-        return items[0]
+        return [it for it in items if isinstance(it, dict)]
+    except ApifyUpstreamError:
+        raise
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise ApifyUpstreamError(f"rede: {e!r}")
     except Exception as e:
         print("⚠️ APIFY erro:", e)
         traceback.print_exc()
@@ -2215,58 +3923,376 @@ def extract_views_from_item(item: dict) -> Optional[int]:
 
     return None
 
-async def apify_get_views_for_url(url: str) -> Optional[int]:
-    platform = detect_platform(url)
-
+APIFY_ITEM_URL_FIELDS = ["webVideoUrl", "url", "postUrl", "inputUrl", "submittedVideoUrl", "videoUrl"]
+
+def apify_shape_order(shapes: List[str], actor_id: str) -> Tuple[List[str], bool]:
+    known = get_actor_shape(actor_id)
+    if known and known[0] in shapes:
+        shape, failures = known
+        if failures < APIFY_SHAPE_REPROBE_FAILURES:
+            return [shape], False
+        return [shape] + [s for s in shapes if s != shape], True
+    return list(shapes), True
+
+def apify_item_match_keys(item: dict, platform: str) -> Set[str]:
+    keys: Set[str] = set()
+    for f in APIFY_ITEM_URL_FIELDS:
+        v = item.get(f)
+        if isinstance(v, str) and v.strip():
+            keys.add(canonical_post_id(v))
     if platform == "tiktok":
-        clean = normalize_tiktok_url(url)
-        payloads = [
-            {"postURLs": [clean], "resultsPerPage": 1, "scrapeRelatedVideos": False},
-            {"startUrls": [{"url": clean}], "maxItems": 1},
-            {"directUrls": [clean], "resultsPerPage": 1},
-            {"videoUrls": [clean]},
-        ]
-        for p in payloads:
-            item = await apify_run(APIFY_ACTOR_TIKTOK, p)
-            v = extract_views_from_item(item) if item else None
-            if isinstance(v, int) and v >= 0:
-                return v
-        return None
-
+        vid = str(item.get("id") or "")
+        if vid.isdigit():
+            keys.add(f"tiktok:{vid}")
     if platform == "instagram":
-        payloads = [
-            {"directUrls": [url], "resultsType": "posts", "resultsLimit": 1},
-            {"startUrls": [{"url": url}], "resultsLimit": 1},
-        ]
-        for p in payloads:
-            item = await apify_run(APIFY_ACTOR_INSTAGRAM, p)
-            v = extract_views_from_item(item) if item else None
-            if isinstance(v, int) and v >= 0:
-                return v
-        return None
+        code = item.get("shortCode") or item.get("shortcode")
+        if isinstance(code, str) and code:
+            keys.add(f"instagram:{code}")
+    return keys
+
+def match_apify_items(items: Optional[List[dict]], platform: str, urls: List[str]) -> Dict[str, int]:
+    found: Dict[str, int] = {}
+    first_views: Optional[int] = None
+    for item in items or []:
+        v = extract_views_from_item(item)
+        if not isinstance(v, int) or v < 0:
+            continue
+        if first_views is None:
+            first_views = v
+        for k in apify_item_match_keys(item, platform):
+            found.setdefault(k, v)
 
-    return None
+    # com um só URL, o item devolvido é desse URL mesmo que o actor não ecoe o link
+    if len(urls) == 1 and first_views is not None:
+        found.setdefault(canonical_post_id(urls[0]), first_views)
+    return found
 
 # =========================
-# VIEWS REFRESH
+# POST LINKS (links curtos + id canónico)
 # =========================
-async def refresh_views_once() -> None:
-    if not APIFY_TOKEN:
-        print("⚠️ [REFRESH] APIFY_TOKEN vazio.")
-        return
+# short_url -> URL do post; à frente da tabela short_links (um redirect não muda)
+SHORT_LINKS: Dict[str, str] = {}
 
-    now_ts = _now()
+def get_short_link(short_url: str) -> Optional[str]:
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT resolved_url FROM short_links WHERE short_url=?", (short_url,))
+    row = cur.fetchone()
+    conn.close()
+    return str(row[0]) if row else None
 
+def put_short_link(short_url: str, resolved_url: str):
     conn = db_conn()
     cur = conn.cursor()
     cur.execute("""
+        INSERT INTO short_links (short_url, resolved_url, resolved_at) VALUES (?, ?, ?)
+        ON CONFLICT(short_url) DO UPDATE SET resolved_url=excluded.resolved_url, resolved_at=excluded.resolved_at
+    """, (short_url, resolved_url, _now()))
+    conn.commit()
+    conn.close()
+
+async def resolve_short_link(url: str) -> str:
+    if not is_short_post_link(url):
+        return url
+    key = url.strip().split("?")[0].split("#")[0].rstrip("/")
+    hit = SHORT_LINKS.get(key)
+    if hit is None:
+        hit = await db_read(get_short_link, key)
+    if hit:
+        SHORT_LINKS[key] = hit
+        return hit
+
+    # um só HEAD sem seguir redirects: o Location já traz o URL com o id do vídeo
+    try:
+        session = await get_http_session()
+        async with session.head(
+            key, allow_redirects=False, timeout=aiohttp.ClientTimeout(total=SHORT_LINK_TIMEOUT_SECONDS)
+        ) as resp:
+            location = resp.headers.get("Location") or ""
+    except Exception as e:
+        print("⚠️ resolver link curto falhou:", key, repr(e))
+        return url
+
+    resolved = normalize_post_url(urllib.parse.urljoin(key, location)) if location else ""
+    if not resolved or not canonical_post_id(resolved).startswith(("tiktok:", "instagram:", "youtube:")):
+        print(f"⚠️ link curto sem post reconhecível: {key} -> {location or '-'}")
+        return url
+
+    SHORT_LINKS[key] = resolved
+    await db_run(put_short_link, key, resolved)
+    return resolved
+
+async def canonicalize_post_url(url: str) -> Tuple[str, str]:
+    # (URL normalizado, id canónico) — é isto que se grava em post_url / canonical_id
+    clean = normalize_post_url(await resolve_short_link(url))
+    return clean, canonical_post_id(clean)
+
+# =========================
+# VIEW PROVIDERS
+# =========================
+class ViewProvider(ABC):
+    # uma fonte de views por plataforma; o refresh só fala com esta interface via VIEW_PROVIDERS
+    platform = ""
+    batch_size = 1            # URLs por pedido (1 = sem batching)
+    concurrency = 1           # pedidos em simultâneo para esta plataforma
+    cost_per_request = 1.0    # custo relativo de um pedido (CU do Apify, quota do YouTube…), só para logs
+    payload_shapes: List[str] = []
+
+    def available(self) -> bool:
+        return True
+
+    def normalize_url(self, url: str) -> str:
+        return url
+
+    def semaphore(self) -> asyncio.Semaphore:
+        return apify_semaphore(f"platform:{self.platform}", self.concurrency)
+
+    def deferred_until(self) -> Optional[int]:
+        # timestamp até ao qual não vale a pena pedir views (fonte em baixo); None = pode pedir já
+        return None
+
+    @abstractmethod
+    async def fetch_views(self, urls: List[str]) -> Optional[Dict[str, int]]:
+        # devolve {canonical_post_id: views}
+        ...
+
+class ApifyViewProvider(ViewProvider):
+    cost_per_request = 5.0
+
+    def __init__(self, actor: str, concurrency: int):
+        self.actor = actor
+        self.concurrency = max(1, int(concurrency))
+        self.batch_size = max(1, APIFY_BATCH_SIZE)
+
+    def available(self) -> bool:
+        return bool(APIFY_TOKEN)
+
+    def deferred_until(self) -> Optional[int]:
+        return apify_guard(normalize_apify_actor_id(self.actor)).breaker.retry_at()
+
+    @abstractmethod
+    def build_payload(self, shape: str, urls: List[str]) -> dict:
+        ...
+
+    async def fetch_views(self, urls: List[str]) -> Optional[Dict[str, int]]:
+        actor_id = normalize_apify_actor_id(self.actor)
+        shapes, probing = await db_run(apify_shape_order, self.payload_shapes, actor_id)
+
+        for shape in shapes:
+            try:
+                items = await apify_run_items(self.actor, self.build_payload(shape, urls), limit=max(5, len(urls) * 2))
+            except ApifyUpstreamError:
+                # falha do Apify, não do formato: nem testa outros formatos nem conta como falha do formato
+                return None
+            found = match_apify_items(items, self.platform, urls)
+            if found:
+                await db_run(set_actor_shape, actor_id, shape)
+                return found
+            if items:
+                print(f"⚠️ APIFY {self.platform}: {len(items)} items mas nenhum com views/URL reconhecível (shape={shape})")
+
+        if probing:
+            await db_run(reset_actor_shape_failures, actor_id)
+        else:
+            await db_run(record_actor_shape_failure, actor_id)
+        return None
+
+class TikTokViewProvider(ApifyViewProvider):
+    platform = "tiktok"
+    # ordem em que os formatos são testados quando o actor ainda não tem formato aprendido
+    payload_shapes = ["postURLs", "startUrls", "directUrls", "videoUrls"]
+
+    def normalize_url(self, url: str) -> str:
+        return normalize_tiktok_url(url)
+
+    def build_payload(self, shape: str, urls: List[str]) -> dict:
+        urls = list(urls)
+        if shape == "postURLs":
+            return {"postURLs": urls, "resultsPerPage": 1, "scrapeRelatedVideos": False}
+        if shape == "startUrls":
+            return {"startUrls": [{"url": u} for u in urls], "maxItems": len(urls)}
+        if shape == "directUrls":
+            return {"directUrls": urls, "resultsPerPage": 1}
+        return {"videoUrls": urls}
+
+class InstagramViewProvider(ApifyViewProvider):
+    platform = "instagram"
+    payload_shapes = ["directUrls", "startUrls"]
+
+    def normalize_url(self, url: str) -> str:
+        return normalize_instagram_url(url)
+
+    def build_payload(self, shape: str, urls: List[str]) -> dict:
+        urls = list(urls)
+        if shape == "startUrls":
+            return {"startUrls": [{"url": u} for u in urls], "resultsLimit": 1}
+        return {"directUrls": urls, "resultsType": "posts", "resultsLimit": 1}
+
+class YouTubeViewProvider(ViewProvider):
+    # videos.list aceita até 50 ids por pedido e custa 1 unidade de quota
+    platform = "youtube"
+    batch_size = 50
+    cost_per_request = 1.0
+
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, int(concurrency))
+
+    def available(self) -> bool:
+        return bool(YOUTUBE_API_KEY)
+
+    def normalize_url(self, url: str) -> str:
+        return normalize_youtube_url(url)
+
+    async def fetch_views(self, urls: List[str]) -> Optional[Dict[str, int]]:
+        ids = sorted({vid for vid in (extract_youtube_video_id(u) for u in urls) if vid})
+        if not ids:
+            return None
+
+        session = await get_http_session()
+        params = {"part": "statistics", "id": ",".join(ids), "key": YOUTUBE_API_KEY}
+        try:
+            async with session.get(f"{YOUTUBE_API_BASE_URL}/videos", params=params) as resp:
+                if resp.status != 200:
+                    print(f"⚠️ YOUTUBE HTTP {resp.status}:", (await resp.text())[:300])
+                    return None
+                data = await resp.json(content_type=None)
+        except Exception as e:
+            print("⚠️ YOUTUBE erro:", e)
+            return None
+
+        found: Dict[str, int] = {}
+        for item in (data or {}).get("items") or []:
+            vid = item.get("id")
+            views = str((item.get("statistics") or {}).get("viewCount") or "")
+            if vid and views.isdigit():
+                found[f"youtube:{vid}"] = int(views)
+        return found or None
+
+VIEW_PROVIDERS: Dict[str, ViewProvider] = {}
+
+def register_view_provider(provider: ViewProvider):
+    VIEW_PROVIDERS[provider.platform] = provider
+
+register_view_provider(TikTokViewProvider(APIFY_ACTOR_TIKTOK, APIFY_CONCURRENCY_TIKTOK))
+register_view_provider(InstagramViewProvider(APIFY_ACTOR_INSTAGRAM, APIFY_CONCURRENCY_INSTAGRAM))
+register_view_provider(YouTubeViewProvider(YOUTUBE_CONCURRENCY))
+
+def any_view_provider_available() -> bool:
+    return any(p.available() for p in VIEW_PROVIDERS.values())
+
+def deferred_view_urls(urls: List[str]) -> Dict[str, int]:
+    # url -> quando voltar a tentar, para URLs cuja fonte está com o circuito aberto
+    out: Dict[str, int] = {}
+    for u in urls:
+        provider = VIEW_PROVIDERS.get(detect_platform(u))
+        retry_at = provider.deferred_until() if provider else None
+        if retry_at:
+            out[u] = int(retry_at)
+    return out
+
+async def get_views_for_url(url: str) -> Optional[int]:
+    provider = VIEW_PROVIDERS.get(detect_platform(url))
+    if provider is None or not provider.available():
+        return None
+    clean = provider.normalize_url(await resolve_short_link(url))
+    cached = await db_run(get_cached_views, clean)
+    if cached is not None:
+        return cached
+    found = await provider.fetch_views([clean])
+    v = found.get(canonical_post_id(clean)) if found else None
+    await db_run(put_cached_views, {clean: v})
+    return v
+
+async def get_views_for_urls(
+    urls: List[str],
+    deferred: Optional[Dict[str, int]] = None,
+) -> Dict[str, Optional[int]]:
+    # vários URLs do mesmo vídeo (links curtos, /reel/ vs /p/, outra campanha) = um só pedido.
+    # deferred recebe url -> retry para os chunks que a fonte recusou (circuito aberto ou teste half-open a correr)
+    urls = list(dict.fromkeys(urls))
+    resolved = dict(zip(urls, await asyncio.gather(*(resolve_short_link(u) for u in urls))))
+    urls_by_id: Dict[str, List[str]] = {}
+    for u in urls:
+        urls_by_id.setdefault(canonical_post_id(resolved[u]), []).append(u)
+
+    results: Dict[str, Optional[int]] = {}
+    by_platform: Dict[str, List[str]] = {}
+    representative = {cid: resolved[us[0]] for cid, us in urls_by_id.items()}
+    cached = await db_run(get_cached_views_many, list(representative.values()))
+    for cid, rep_url in representative.items():
+        v = cached.get(rep_url)
+        for u in urls_by_id[cid]:
+            results[u] = v
+        if v is None:
+            by_platform.setdefault(detect_platform(rep_url), []).append(rep_url)
+
+    cached_count = sum(1 for v in results.values() if v is not None)
+    if cached_count:
+        print(f"[REFRESH] views em cache: {cached_count}/{len(results)}")
+    if len(representative) < len(urls):
+        print(f"[REFRESH] {len(urls)} urls -> {len(representative)} posts distintos")
+
+    async def fetch_chunk(provider: ViewProvider, chunk: List[str]):
+        clean = [provider.normalize_url(u) for u in chunk]
+        async with provider.semaphore():
+            # o circuito pode ter aberto enquanto este chunk esperava a vez
+            retry_at = provider.deferred_until()
+            if retry_at is None:
+                found = await provider.fetch_views(clean)
+                # a hora de retry é a de agora: no fim do ciclo o teste half-open já pode ter fechado o circuito
+                retry_at = provider.deferred_until() if found is None else None
+        if retry_at is not None:
+            if deferred is not None:
+                for rep_url in chunk:
+                    for u in urls_by_id.get(canonical_post_id(rep_url), []):
+                        deferred[u] = int(retry_at)
+            return
+        if len(chunk) > 1:
+            print(f"[REFRESH] batch {provider.platform}: {len(chunk)} urls -> {len(found or {})} com views")
+        fresh: Dict[str, Optional[int]] = {}
+        for rep_url in chunk:
+            cid = canonical_post_id(rep_url)
+            fresh[rep_url] = (found or {}).get(cid)
+            for u in urls_by_id.get(cid, []):
+                results[u] = fresh[rep_url]
+        await db_run(put_cached_views, fresh)
+
+    jobs = []
+    cost: Dict[str, Tuple[int, float]] = {}
+    for platform, plat_urls in by_platform.items():
+        provider = VIEW_PROVIDERS.get(platform)
+        if provider is None or not provider.available():
+            continue
+        size = max(1, int(provider.batch_size))
+        for i in range(0, len(plat_urls), size):
+            jobs.append(fetch_chunk(provider, plat_urls[i:i + size]))
+        n = (len(plat_urls) + size - 1) // size
+        cost[platform] = (n, n * provider.cost_per_request)
+
+    if cost:
+        print("[REFRESH] pedidos: " + " | ".join(f"{p}={n} (custo {c:g})" for p, (n, c) in sorted(cost.items())))
+
+    for res in await asyncio.gather(*jobs, return_exceptions=True):
+        if isinstance(res, Exception):
+            print("⚠️ fetch de views erro:", repr(res))
+
+    return results
+
+# =========================
+# VIEWS REFRESH
+# =========================
+REFRESH_LOCK = asyncio.Lock()
+
+def list_due_submissions(now_ts: int, submission_ids: Optional[List[int]] = None) -> List[tuple]:
+    query = """
     SELECT
         s.id, s.campaign_id, s.user_id, s.post_url, s.paid_views,
         s.views_current, COALESCE(s.last_views_snapshot, 0),
         COALESCE(s.stale_checks, 0), s.approved_at,
         s.next_check_at, COALESCE(s.is_tracking, 1),
         c.rate_kz_per_1k, c.budget_total_kz, c.spent_kz,
-        c.max_payout_user_kz, c.status, COALESCE(c.ended_notified, 0)
+        c.max_payout_user_kz, c.status, COALESCE(c.ended_notified, 0),
+        s.last_checked_at
     FROM submissions s
     JOIN campaigns c ON c.id = s.campaign_id
     WHERE s.status='approved'
@@ -2274,707 +4300,894 @@ async def refresh_views_once() -> None:
       AND COALESCE(s.is_tracking, 1)=1
       AND s.next_check_at IS NOT NULL
       AND s.next_check_at <= ?
-    ORDER BY s.next_check_at ASC
-    """, (int(now_ts),))
-    rows = cur.fetchall()
+    """
+    conn = db_conn()
+    cur = conn.cursor()
+    rows: List[tuple] = []
+    if submission_ids is None:
+        cur.execute(query + " ORDER BY s.next_check_at ASC", (int(now_ts),))
+        rows = cur.fetchall()
+    else:
+        ids = [int(x) for x in submission_ids]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cur.execute(
+                query + f" AND s.id IN ({','.join('?' * len(chunk))})",
+                (int(now_ts), *chunk)
+            )
+            rows.extend(cur.fetchall())
+        rows.sort(key=lambda r: int(r[9] or 0))
     conn.close()
+    return rows
 
-    print(f"[REFRESH] submissions due agora: {len(rows)}")
-    touched_campaigns = set()
-
-    for (
-        sub_id, camp_id, user_id, url, paid_views,
-        views_current_db, last_views_snapshot,
-        stale_checks, approved_at, next_check_at, is_tracking,
-        rate, budget_total, spent_kz, max_user_kz, camp_status, ended_notified
-    ) in rows:
-
-        print(f"[REFRESH] due sub={sub_id} camp={camp_id} user={user_id} url={url}")
-
-        remaining_budget_now = max(0, int(budget_total) - int(spent_kz))
-        if remaining_budget_now <= 0:
-            connx = db_conn()
-            cx = connx.cursor()
-            cx.execute("UPDATE campaigns SET status='ended' WHERE id=?", (int(camp_id),))
-            connx.commit()
-            connx.close()
-
-            stop_tracking_submission(int(sub_id))
-            touched_campaigns.add(int(camp_id))
-
-            if int(ended_notified) == 0:
-                mark_campaign_ended_notified(int(camp_id))
-                await notify_campaign_finished(int(camp_id), winner_user_id=None, reason="budget")
-            continue
+REFRESH_LOCK = asyncio.Lock()
+
+class CampaignLedger:
+    # estado de budget/pagos de um ciclo de refresh: carregado uma vez, atualizado em memória a cada
+    # pagamento e gravado de uma vez no fim; nenhuma decisão lê um spent_kz desatualizado
+    __slots__ = ("budget", "spent", "ended_notified", "paid", "maxed", "_spent_delta", "_paid_delta", "_maxed_new", "_ended_new")
 
-        paid_kz_user, maxed_notified_u = get_user_paid_in_campaign(int(camp_id), int(user_id))
-        if int(paid_kz_user) >= int(max_user_kz):
-            print(f"[REFRESH] sub={sub_id} parado: user max payout atingido")
-            stop_tracking_submission(int(sub_id))
-            touched_campaigns.add(int(camp_id))
-
-            if maxed_notified_u == 0:
-                guild = bot.get_guild(SERVER_ID)
-                if guild:
-                    mem = await fetch_member_safe(guild, int(user_id))
-                    if mem:
-                        await notify_user(
-                            mem,
-                            f"✅ Atingiste o teu limite nesta campanha (**{int(max_user_kz):,} Kz**). "
-                            "A partir de agora **não podes submeter mais vídeos** para esta campanha.",
-                            fallback_channel_id=CHAT_CHANNEL_ID
-                        )
-                set_maxed_notified(int(camp_id), int(user_id))
+    def __init__(self):
+        self.budget: Dict[int, int] = {}
+        self.spent: Dict[int, int] = {}
+        self.ended_notified: Dict[int, int] = {}
+        self.paid: Dict[Tuple[int, int], int] = {}
+        self.maxed: Dict[Tuple[int, int], int] = {}
+        self._spent_delta: Dict[int, int] = {}
+        self._paid_delta: Dict[Tuple[int, int], List[int]] = {}
+        self._maxed_new: Set[Tuple[int, int]] = set()
+        self._ended_new: Set[int] = set()
+
+    @classmethod
+    def load(cls, conn, campaign_ids: List[int]) -> "CampaignLedger":
+        ledger = cls()
+        ids = sorted(set(int(c) for c in campaign_ids))
+        cur = conn.cursor()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            cur.execute(f"""
+                SELECT id, budget_total_kz, spent_kz, COALESCE(ended_notified,0)
+                FROM campaigns WHERE id IN ({marks})
+            """, chunk)
+            for cid, budget, spent, en in cur.fetchall():
+                ledger.budget[int(cid)] = int(budget or 0)
+                ledger.spent[int(cid)] = int(spent or 0)
+                ledger.ended_notified[int(cid)] = int(en or 0)
+            cur.execute(f"""
+                SELECT campaign_id, user_id, COALESCE(paid_kz,0), COALESCE(maxed_notified,0)
+                FROM campaign_users WHERE campaign_id IN ({marks})
+            """, chunk)
+            for cid, uid, paid, maxed in cur.fetchall():
+                ledger.paid[(int(cid), int(uid))] = int(paid or 0)
+                ledger.maxed[(int(cid), int(uid))] = int(maxed or 0)
+        return ledger
+
+    def remaining_budget(self, campaign_id: int) -> int:
+        return max(0, self.budget.get(campaign_id, 0) - self.spent.get(campaign_id, 0))
+
+    def user_paid(self, campaign_id: int, user_id: int) -> int:
+        return self.paid.get((campaign_id, user_id), 0)
+
+    def pay(self, campaign_id: int, user_id: int, kz: int, views: int):
+        key = (campaign_id, user_id)
+        self.spent[campaign_id] = self.spent.get(campaign_id, 0) + int(kz)
+        self.paid[key] = self.paid.get(key, 0) + int(kz)
+        self._spent_delta[campaign_id] = self._spent_delta.get(campaign_id, 0) + int(kz)
+        delta = self._paid_delta.setdefault(key, [0, 0])
+        delta[0] += int(kz)
+        delta[1] += int(views)
+
+    def mark_maxed(self, campaign_id: int, user_id: int) -> bool:
+        # True só da primeira vez (para avisar o user uma única vez)
+        key = (campaign_id, user_id)
+        if self.maxed.get(key, 0):
+            return False
+        self.maxed[key] = 1
+        self._maxed_new.add(key)
+        return True
+
+    def mark_ended(self, campaign_id: int) -> bool:
+        # marca a campanha como terminada; True se ainda não tinha sido avisada
+        self._ended_new.add(campaign_id)
+        if self.ended_notified.get(campaign_id, 0):
+            return False
+        self.ended_notified[campaign_id] = 1
+        return True
+
+    def flush(self, conn) -> Set[int]:
+        # devolve as campanhas alteradas; a cache de config só se invalida depois do commit
+        cur = conn.cursor()
+        if self._paid_delta:
+            cur.executemany("""
+            INSERT INTO campaign_users (campaign_id, user_id, paid_kz, total_views_paid, maxed_notified)
+            VALUES (?, ?, ?, ?, 0)
+            ON CONFLICT(campaign_id, user_id) DO UPDATE SET
+                paid_kz = paid_kz + excluded.paid_kz,
+                total_views_paid = total_views_paid + excluded.total_views_paid
+            """, [(cid, uid, kz, views) for (cid, uid), (kz, views) in self._paid_delta.items()])
+        if self._spent_delta:
+            cur.executemany("UPDATE campaigns SET spent_kz = spent_kz + ? WHERE id=?",
+                            [(kz, cid) for cid, kz in self._spent_delta.items()])
+        if self._maxed_new:
+            cur.executemany("UPDATE campaign_users SET maxed_notified=1 WHERE campaign_id=? AND user_id=?",
+                            sorted(self._maxed_new))
+        if self._ended_new:
+            cur.executemany("UPDATE campaigns SET status='ended', ended_notified=1 WHERE id=?",
+                            [(cid,) for cid in sorted(self._ended_new)])
+        changed = set(self._spent_delta) | self._ended_new
+        self._spent_delta.clear()
+        self._paid_delta.clear()
+        self._maxed_new.clear()
+        self._ended_new.clear()
+        return changed
+
+def select_urls_to_fetch(rows: List[tuple]) -> List[str]:
+    # só vale a pena pedir views ao Apify para quem ainda pode receber
+    ledger = CampaignLedger.load(db_conn(), [int(r[1]) for r in rows])
+    fetch_urls: List[str] = []
+    for row in rows:
+        camp_id, user_id, url, max_user_kz = int(row[1]), int(row[2]), row[3], row[14]
+        block_kz = max(1, int(row[11] or 0))
+        if ledger.remaining_budget(camp_id) < block_kz:
+            continue
+        if int(max_user_kz) - ledger.user_paid(camp_id, user_id) < block_kz:
             continue
+        fetch_urls.append(str(url))
+    return fetch_urls
+
+def settle_refresh_batch(
+    submission_ids: List[int],
+    views_by_url: Dict[str, Optional[int]],
+    now_ts: int,
+    deferred_until: Optional[Dict[str, int]] = None,
+    due_until: Optional[int] = None,
+) -> Tuple[Set[int], List[tuple]]:
+    # corre na thread da DB: o ciclo inteiro é liquidado numa só transação (um commit/fsync por ciclo).
+    # budget e pagos vivem num CampaignLedger durante a liquidação, por isso spent_kz e paid_kz
+    # nunca ficam desalinhados se o processo morrer a meio.
+    # devolve (campanhas tocadas, avisos a enviar depois do commit)
+    touched: Set[int] = set()
+    notices: List[tuple] = []
+    schedule_after: List[Tuple[int, Optional[int]]] = []
+
+    with db_tx() as conn:
+        cur = conn.cursor()
+
+        # relê as linhas dentro da transação: o fetch ao Apify pode ter demorado minutos
+        rows = list_due_submissions(due_until or now_ts, submission_ids)
+
+        ledger = CampaignLedger.load(conn, [int(r[1]) for r in rows])
+
+        def end_campaign_now(camp_id: int, winner_user_id: Optional[int]):
+            if ledger.mark_ended(camp_id):
+                notices.append(("end", int(camp_id), winner_user_id))
+
+        def mark_user_maxed(camp_id: int, user_id: int, max_user_kz: int):
+            if ledger.mark_maxed(camp_id, user_id):
+                notices.append(("max", int(camp_id), int(user_id), int(max_user_kz)))
+
+        def stop_tracking(sub_id: int):
+            cur.execute("UPDATE submissions SET is_tracking=0, next_check_at=NULL WHERE id=?", (int(sub_id),))
+            schedule_after.append((int(sub_id), None))
+
+        for (
+            sub_id, camp_id, user_id, url, paid_views,
+            views_current_db, last_views_snapshot,
+            stale_checks, approved_at, next_check_at, is_tracking,
+            rate, budget_total, spent_kz_row, max_user_kz, camp_status, ended_notified_row,
+            last_checked_at
+        ) in rows:
+            camp_id, user_id = int(camp_id), int(user_id)
+            remaining_budget = ledger.remaining_budget(camp_id)
+            paid_kz_user = ledger.user_paid(camp_id, user_id)
+            # só se paga em blocos de 1k views: sobra < rate nunca volta a ser paga, conta como teto
+            block_kz = max(1, int(rate or 0))
+
+            print(f"[REFRESH] due sub={sub_id} camp={camp_id} user={user_id} url={url}")
+
+            if remaining_budget < block_kz:
+                stop_tracking(int(sub_id))
+                end_campaign_now(camp_id, None)
+                touched.add(camp_id)
+                continue
+
+            if int(max_user_kz) - int(paid_kz_user) < block_kz:
+                print(f"[REFRESH] sub={sub_id} parado: user max payout atingido")
+                stop_tracking(int(sub_id))
+                mark_user_maxed(camp_id, user_id, int(max_user_kz))
+                touched.add(camp_id)
+                continue
+
+            views = views_by_url.get(str(url))
+            print(f"[REFRESH] views recebidas={views} para url={url}")
+
+            if views is None and (deferred_until or {}).get(str(url)):
+                # fonte em baixo: não conta como check; volta quando o circuito deixar testar
+                retry_at = int(deferred_until[str(url)])
+                cur.execute("UPDATE submissions SET next_check_at=? WHERE id=?", (retry_at, int(sub_id)))
+                schedule_after.append((int(sub_id), retry_at))
+                continue
 
-        views = await apify_get_views_for_url(url)
-        print(f"[REFRESH] views recebidas={views} para url={url}")
+            if views is None:
+                retry_next = now_ts + hours_to_seconds(NEW_VIDEO_CHECK_HOURS)
+                cur.execute("""
+                    UPDATE submissions
+                    SET last_checked_at=?, next_check_at=?
+                    WHERE id=?
+                """, (int(now_ts), int(retry_next), int(sub_id)))
+                schedule_after.append((int(sub_id), int(retry_next)))
+                print(f"⚠️ Views None (Apify) url={url}")
+                continue
 
-        if views is None:
-            retry_next = now_ts + hours_to_seconds(NEW_VIDEO_CHECK_HOURS)
-            conn_retry = db_conn()
-            c_retry = conn_retry.cursor()
-            c_retry.execute("""
+            growth_since_last = int(views) - int(last_views_snapshot or 0)
+            new_stale_checks = int(stale_checks or 0)
+
+            if growth_since_last < STALE_GROWTH_MIN_VIEWS:
+                new_stale_checks += 1
+            else:
+                new_stale_checks = 0
+
+            payable_total = (int(views) // 1000) * 1000
+            to_pay_views = payable_total - int(paid_views)
+            to_pay_kz = 0
+            if to_pay_views >= 1000 and int(rate) > 0:
+                to_pay_kz = (to_pay_views // 1000) * int(rate)
+
+            remaining_user_kz = max(0, int(max_user_kz) - int(paid_kz_user))
+            if to_pay_kz > remaining_user_kz:
+                max_blocks = remaining_user_kz // int(rate)
+                to_pay_views = max_blocks * 1000
+                to_pay_kz = max_blocks * int(rate)
+
+            if to_pay_kz > remaining_budget:
+                max_blocks = remaining_budget // int(rate)
+                to_pay_views = max_blocks * 1000
+                to_pay_kz = max_blocks * int(rate)
+
+            next_check = get_check_policy().next_check_at(CheckContext(
+                now_ts=now_ts,
+                approved_at=int(approved_at or now_ts),
+                stale_checks=int(new_stale_checks),
+                views=int(views),
+                prev_views=int(last_views_snapshot or 0),
+                prev_checked_at=last_checked_at,
+                paid_views=int(paid_views) + (int(to_pay_views) if to_pay_kz > 0 else 0),
+                rate_kz_per_1k=int(rate),
+                remaining_user_kz=max(0, int(max_user_kz) - int(paid_kz_user) - int(to_pay_kz)),
+                remaining_budget_kz=max(0, int(remaining_budget) - int(to_pay_kz)),
+                history=get_submission_view_series(int(sub_id), since_ts=now_ts - hours_to_seconds(VELOCITY_WINDOW_HOURS)),
+            ))
+
+            cur.execute("""
                 UPDATE submissions
-                SET last_checked_at=?, next_check_at=?
+                SET views_current=?,
+                    last_views_snapshot=?,
+                    stale_checks=?,
+                    last_checked_at=?,
+                    next_check_at=?
                 WHERE id=?
-            """, (int(now_ts), int(retry_next), int(sub_id)))
-            conn_retry.commit()
-            conn_retry.close()
-            print(f"⚠️ Views None (Apify) url={url}")
-            continue
+            """, (
+                int(views),
+                int(views),
+                int(new_stale_checks),
+                int(now_ts),
+                int(next_check),
+                int(sub_id)
+            ))
+
+            cur.execute("INSERT OR REPLACE INTO view_snapshots (submission_id, ts, views) VALUES (?, ?, ?)",
+                        (int(sub_id), int(now_ts), int(views)))
+
+            if to_pay_kz > 0:
+                cur.execute("UPDATE submissions SET paid_views = paid_views + ? WHERE id=?",
+                            (int(to_pay_views), int(sub_id)))
+                ledger.pay(camp_id, user_id, int(to_pay_kz), int(to_pay_views))
+
+            touched.add(camp_id)
+            should_stop = False
+
+            if int(max_user_kz) - ledger.user_paid(camp_id, user_id) < block_kz:
+                should_stop = True
+                mark_user_maxed(camp_id, user_id, int(max_user_kz))
+
+            if ledger.remaining_budget(camp_id) < block_kz:
+                should_stop = True
+                end_campaign_now(camp_id, user_id)
+
+            age_now = max(0, now_ts - int(approved_at or now_ts))
+            if age_now >= 30 * 24 * 3600 and int(new_stale_checks) >= 5:
+                should_stop = True
 
-        growth_since_last = int(views) - int(last_views_snapshot or 0)
-        new_stale_checks = int(stale_checks or 0)
+            if should_stop:
+                stop_tracking(int(sub_id))
+            else:
+                schedule_after.append((int(sub_id), int(next_check)))
 
-        if growth_since_last < STALE_GROWTH_MIN_VIEWS:
-            new_stale_checks += 1
+        changed_campaigns = ledger.flush(conn)
+
+    # o heap e a cache de config só mudam depois do commit
+    for cid in changed_campaigns:
+        invalidate_campaign_config(cid)
+    for sid, ts in schedule_after:
+        if ts is None:
+            SCHEDULER.unschedule(sid)
         else:
-            new_stale_checks = 0
+            SCHEDULER.schedule(sid, ts)
+    return touched, notices
 
-        payable_total = (int(views) // 1000) * 1000
-        to_pay_views = payable_total - int(paid_views)
-        to_pay_kz = 0
-        if to_pay_views >= 1000 and int(rate) > 0:
-            to_pay_kz = (to_pay_views // 1000) * int(rate)
 
-        remaining_user_kz = max(0, int(max_user_kz) - int(paid_kz_user))
-        if to_pay_kz > remaining_user_kz:
-            max_blocks = remaining_user_kz // int(rate)
-            to_pay_views = max_blocks * 1000
-            to_pay_kz = max_blocks * int(rate)
+async def refresh_views_once(submission_ids: Optional[List[int]] = None) -> None:
+    # fetch em paralelo; a liquidação (pagamentos/budget/DB) corre em série e nunca em dois ciclos ao mesmo tempo
+    async with REFRESH_LOCK:
+        await _refresh_views_once(submission_ids)
 
-        remaining_budget = max(0, int(budget_total) - int(spent_kz))
-        if to_pay_kz > remaining_budget:
-            max_blocks = remaining_budget // int(rate)
-            to_pay_views = max_blocks * 1000
-            to_pay_kz = max_blocks * int(rate)
+async def _refresh_views_once(submission_ids: Optional[List[int]] = None) -> None:
+    if not any_view_provider_available():
+        print("⚠️ [REFRESH] nenhuma fonte de views configurada (APIFY_TOKEN / YOUTUBE_API_KEY).")
+        return
 
-        next_check = compute_next_check_at(int(approved_at or now_ts), int(new_stale_checks))
-        should_stop = False
+    now_ts = _now()
+    # o scheduler tira do heap tudo o que vence dentro da janela de batching: esses ids entram já neste ciclo
+    due_until = now_ts + SCHEDULER_BATCH_WINDOW_SECONDS if submission_ids is not None else now_ts
+    rows = await db_run(list_due_submissions, due_until, submission_ids)
 
-        conn2 = db_conn()
-        cur2 = conn2.cursor()
+    print(f"[REFRESH] submissions due agora: {len(rows)}")
 
-        cur2.execute("""
-            UPDATE submissions
-            SET views_current=?,
-                last_views_snapshot=?,
-                stale_checks=?,
-                last_checked_at=?,
-                next_check_at=?
-            WHERE id=?
-        """, (
-            int(views),
-            int(views),
-            int(new_stale_checks),
-            int(now_ts),
-            int(next_check),
-            int(sub_id)
-        ))
+    fetch_urls = await db_run(select_urls_to_fetch, rows)
+    deferred: Dict[str, int] = {}
+    views_by_url = await get_views_for_urls(fetch_urls, deferred) if fetch_urls else {}
+    # fontes sem circuito próprio (ou chunks que nem chegaram a correr) ainda podem estar em baixo agora
+    deferred.update(deferred_view_urls([u for u in fetch_urls if views_by_url.get(u) is None and u not in deferred]))
+    if deferred:
+        print(f"[REFRESH] {len(deferred)} urls adiadas (circuito aberto) até {time.strftime('%H:%M:%S', time.localtime(min(deferred.values())))}")
 
-        if to_pay_kz > 0:
-            cur2.execute("""
-            INSERT INTO campaign_users (campaign_id, user_id, paid_kz, total_views_paid, maxed_notified)
-            VALUES (?, ?, ?, ?, 0)
-            ON CONFLICT(campaign_id, user_id) DO UPDATE SET
-                paid_kz = paid_kz + excluded.paid_kz,
-                total_views_paid = total_views_paid + excluded.total_views_paid
-            """, (int(camp_id), int(user_id), int(to_pay_kz), int(to_pay_views)))
-
-            cur2.execute("UPDATE submissions SET paid_views = paid_views + ? WHERE id=?",
-                         (int(to_pay_views), int(sub_id)))
-
-            cur2.execute("UPDATE campaigns SET spent_kz = spent_kz + ? WHERE id=?",
-                         (int(to_pay_kz), int(camp_id)))
-
-        conn2.commit()
-        conn2.close()
-        touched_campaigns.add(int(camp_id))
-
-        new_paid_total = int(paid_kz_user) + int(to_pay_kz)
-        new_spent_total = int(spent_kz) + int(to_pay_kz)
-
-        if new_paid_total >= int(max_user_kz):
-            should_stop = True
-            if maxed_notified_u == 0:
-                guild = bot.get_guild(SERVER_ID)
-                if guild:
-                    mem = await fetch_member_safe(guild, int(user_id))
-                    if mem:
-                        await notify_user(
-                            mem,
-                            f"✅ Atingiste o teu limite nesta campanha (**{int(max_user_kz):,} Kz**). "
-                            "A partir de agora **não podes submeter mais vídeos** para esta campanha.",
-                            fallback_channel_id=CHAT_CHANNEL_ID
-                        )
-                set_maxed_notified(int(camp_id), int(user_id))
-
-        if new_spent_total >= int(budget_total):
-            should_stop = True
-            connz = db_conn()
-            cz = connz.cursor()
-            cz.execute("SELECT COALESCE(ended_notified,0) FROM campaigns WHERE id=?", (int(camp_id),))
-            en = int((cz.fetchone() or [0])[0] or 0)
-            cz.execute("UPDATE campaigns SET status='ended' WHERE id=?", (int(camp_id),))
-            connz.commit()
-            connz.close()
-
-            if en == 0:
-                mark_campaign_ended_notified(int(camp_id))
-                await notify_campaign_finished(int(camp_id), winner_user_id=int(user_id), reason="budget")
-
-        age_now = max(0, now_ts - int(approved_at or now_ts))
-        if age_now >= 30 * 24 * 3600 and int(new_stale_checks) >= 5:
-            should_stop = True
-
-        if should_stop:
-            stop_tracking_submission(int(sub_id))
+    touched_campaigns, notices = await db_run(
+        settle_refresh_batch, [int(r[0]) for r in rows], views_by_url, now_ts, deferred, due_until
+    )
+
+    maxed_messages: List[Tuple[int, str, Optional[int]]] = []
+    for notice in notices:
+        if notice[0] == "max":
+            _kind, camp_id, user_id, max_user_kz = notice
+            maxed_messages.append((
+                int(user_id),
+                f"✅ Atingiste o teu limite nesta campanha (**{int(max_user_kz):,} Kz**). "
+                "A partir de agora **não podes submeter mais vídeos** para esta campanha.",
+                CHAT_CHANNEL_ID,
+            ))
+        elif notice[0] == "end":
+            _kind, camp_id, winner_user_id = notice
+            await notify_campaign_finished(int(camp_id), winner_user_id=winner_user_id, reason="budget")
+    if maxed_messages:
+        await queue_notifications(maxed_messages)
 
     for cid in touched_campaigns:
         await update_leaderboard_for_campaign(int(cid))
 
-@tasks.loop(minutes=VIEWS_REFRESH_MINUTES)
-async def refresh_views_loop():
-    try:
-        await refresh_views_once()
-    except Exception as e:
-        print("⚠️ refresh_views_loop erro:", e)
-        traceback.print_exc()
+    await db_run(maybe_compact_view_snapshots)
 
-@refresh_views_loop.before_loop
-async def before_refresh_views():
+async def refresh_scheduler_loop():
     await bot.wait_until_ready()
+    resync_every = SCHEDULER_RESYNC_MINUTES * 60
+    last_sync = None
+    while not bot.is_closed():
+        try:
+            if last_sync is None or time.monotonic() - last_sync >= resync_every:
+                SCHEDULER.load(await db_run(list_tracked_submission_schedule))
+                last_sync = time.monotonic()
+                print(f"[SCHEDULER] fila recarregada: {len(SCHEDULER)} submissions em tracking")
+
+            due = await SCHEDULER.wait_for_due(max_wait=resync_every - (time.monotonic() - last_sync))
+            if due:
+                print(f"[SCHEDULER] {len(due)} submissions vencidas")
+                await refresh_views_once(submission_ids=due)
+        except Exception as e:
+            print("⚠️ refresh_scheduler_loop erro:", e)
+            traceback.print_exc()
+            await asyncio.sleep(5)
 
 # =========================
-# INTERACTIONS
+# INTERACTION ROUTER
 # =========================
-@bot.event
-async def on_interaction(interaction: discord.Interaction):
-    try:
-        if interaction.type == discord.InteractionType.component:
-            data = interaction.data or {}
-            custom_id = (data.get("custom_id") or "").strip()
-            if not custom_id:
-                return
+_ROUTE_CONVERTERS = {"str": str, "int": int}
+_ROUTE_SEGMENT_RE = re.compile(r"\{[^}]*\}|[^:]+")
+
+# defer: "always" = lento por natureza (cria canais, várias idas à DB + DM), faz defer logo;
+#        "budget" = só faz defer se passar INTERACTION_DEFER_BUDGET_SECONDS;
+#        "never"  = abre modal, que tem de ser a primeira resposta
+_DEFER_MODES = ("always", "budget", "never")
+
+class _Route:
+    __slots__ = ("pattern", "handler", "fixed", "defer", "calls", "errors", "deferred", "total_ms", "max_ms")
+
+    def __init__(self, pattern: str, handler, fixed: Dict[str, Any], defer: str):
+        self.pattern = pattern
+        self.handler = handler
+        self.fixed = fixed
+        self.defer = defer
+        self.calls = 0
+        self.errors = 0
+        self.deferred = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+class _RouteNode:
+    __slots__ = ("children", "param", "route")
 
-            guild = interaction.guild or bot.get_guild(SERVER_ID)
-            if not guild:
-                return
-
-            if custom_id == "vz:connect":
-                code = generate_verification_code()
-                await safe_reply(
-                    interaction,
-                    "Escolhe a rede social para ligar.\n\n"
-                    f"🔑 O teu código será: `{code}`",
-                    ephemeral=True,
-                    view=ChooseSocialView(code)
-                )
-                return
+    def __init__(self):
+        self.children: Dict[str, "_RouteNode"] = {}
+        # (nome, conversor, nó) — no máximo um parâmetro por nível
+        self.param: Optional[Tuple[str, Any, "_RouteNode"]] = None
+        self.route: Optional[_Route] = None
 
-            if custom_id.startswith("vz:connect:"):
-                parts = custom_id.split(":")
-                if len(parts) >= 4:
-                    social = parts[2]
-                    code = parts[3]
-                    await safe_send_modal(interaction, UsernameModal(social=social, code=code), fallback_text="⚠️ Tenta novamente ligar a conta.")
-                else:
-                    await safe_reply(interaction, "⚠️ Botão inválido.", ephemeral=True)
-                return
+class InteractionRouter:
+    # trie por segmentos do custom_id ("vz:sub:approve:{submission_id:int}");
+    # literais têm prioridade sobre parâmetros e o custo é o nº de segmentos, não o nº de botões
+    __slots__ = ("_root", "routes")
 
-            if custom_id == "vz:view_account":
-                vr = get_verification_request(int(interaction.user.id))
-                iban = get_iban(int(interaction.user.id))
-                linked = list_linked_accounts(int(interaction.user.id))
-
-                status = "NÃO LIGADO"
-                social = "-"
-                username = "-"
-                if vr:
-                    _, social, username, _code, st, _, _ = vr
-                    status = str(st).upper()
-
-                iban_txt = "NÃO DEFINIDO"
-                if iban and iban[0]:
-                    raw = str(iban[0])
-                    iban_txt = raw[:6] + "…" + raw[-4:] if len(raw) > 12 else raw
-
-                if linked:
-                    linked_lines = []
-                    for s, u, _ts in linked:
-                        linked_lines.append(f"• **{social_pretty_name(str(s))}**: {u}")
-                    linked_txt = "\n".join(linked_lines)
-                    linked_view: Optional[discord.ui.View] = LinkedAccountsManageView(linked)
+    def __init__(self):
+        self._root = _RouteNode()
+        self.routes: List[_Route] = []
+
+    def route(self, pattern: str, defer: str = "budget", **fixed):
+        if defer not in _DEFER_MODES:
+            raise ValueError(f"defer inválido: {defer}")
+
+        def decorator(handler):
+            node = self._root
+            for seg in _ROUTE_SEGMENT_RE.findall(pattern):
+                if seg.startswith("{") and seg.endswith("}"):
+                    name, _, kind = seg[1:-1].partition(":")
+                    conv = _ROUTE_CONVERTERS[kind or "str"]
+                    if node.param is None:
+                        node.param = (name, conv, _RouteNode())
+                    elif node.param[0] != name or node.param[1] is not conv:
+                        raise ValueError(f"rota ambígua: {pattern}")
+                    node = node.param[2]
                 else:
-                    linked_txt = "Nenhuma conta associada."
-                    linked_view = None
-
-                await safe_reply(
-                    interaction,
-                    "👤 **A tua conta**\n"
-                    f"📌 Estado do último pedido: **{status}**\n"
-                    f"📱 Última rede do pedido: **{social_pretty_name(str(social)) if social != '-' else '-'}**\n"
-                    f"🏷️ Último username do pedido: **{username}**\n"
-                    f"🏦 IBAN: **{iban_txt}**\n\n"
-                    f"🔗 **Contas associadas**\n{linked_txt}",
-                    ephemeral=True,
-                    view=linked_view
-                )
-                return
-
-            if custom_id.startswith("vz:unlink:"):
-                member = await fetch_member_safe(guild, interaction.user.id)
-                if not member or not is_verified(member):
-                    return await safe_reply(interaction, "⛔ Tens de estar **Verificado** para gerir contas.", ephemeral=True)
+                    node = node.children.setdefault(seg, _RouteNode())
+            if node.route is not None:
+                raise ValueError(f"rota duplicada: {pattern}")
+            node.route = _Route(pattern, handler, fixed, defer)
+            self.routes.append(node.route)
+            return handler
+        return decorator
+
+    def resolve(self, custom_id: str) -> Optional[Tuple[_Route, Dict[str, Any]]]:
+        node = self._root
+        params: Dict[str, Any] = {}
+        for seg in custom_id.split(":"):
+            child = node.children.get(seg)
+            if child is not None:
+                node = child
+                continue
+            if node.param is None or not seg:
+                return None
+            name, conv, child = node.param
+            try:
+                params[name] = conv(seg)
+            except ValueError:
+                return None
+            node = child
+        if node.route is None:
+            return None
+        return node.route, params
+
+    async def dispatch(self, interaction: discord.Interaction, guild: discord.Guild, custom_id: str) -> bool:
+        found = self.resolve(custom_id)
+        if not found:
+            return False
+        route, params = found
+        t0 = time.perf_counter()
+        try:
+            if route.defer == "always":
+                await self._defer(route, interaction)
+                await route.handler(interaction, guild, **params, **route.fixed)
+            elif route.defer == "budget":
+                task = asyncio.ensure_future(route.handler(interaction, guild, **params, **route.fixed))
+                done, _ = await asyncio.wait({task}, timeout=INTERACTION_DEFER_BUDGET_SECONDS)
+                if not done:
+                    await self._defer(route, interaction)
+                await task
+            else:
+                await route.handler(interaction, guild, **params, **route.fixed)
+        except Exception:
+            route.errors += 1
+            raise
+        finally:
+            ms = (time.perf_counter() - t0) * 1000.0
+            route.calls += 1
+            route.total_ms += ms
+            if ms > route.max_ms:
+                route.max_ms = ms
+        return True
 
-                social = custom_id.split(":")[-1].lower()
-                row = get_linked_account(int(interaction.user.id), social)
-                if not row:
-                    return await safe_reply(interaction, f"⚠️ Não tens nenhuma conta de **{social_pretty_name(social)}** associada.", ephemeral=True)
+    @staticmethod
+    async def _defer(route: _Route, interaction: discord.Interaction):
+        if await safe_defer(interaction, route.pattern):
+            route.deferred += 1
 
-                delete_linked_account(int(interaction.user.id), social)
-                return await safe_reply(interaction, f"✅ Conta de **{social_pretty_name(social)}** removida com sucesso.", ephemeral=True)
+ROUTER = InteractionRouter()
 
-            if custom_id == "vz:iban:add":
-                member = await fetch_member_safe(guild, interaction.user.id)
-                if not member or not is_verified(member):
-                    return await safe_reply(interaction, "⛔ Tens de estar **Verificado** para guardar IBAN.", ephemeral=True)
-                await safe_send_modal(interaction, IbanModal(), fallback_text="⚠️ Tenta novamente abrir o painel de IBAN.")
-                return
+# =========================
+# INTERACTIONS
+# =========================
+@ROUTER.route("vz:connect")
+async def route_connect(interaction: discord.Interaction, guild: discord.Guild):
+    code = generate_verification_code()
+    await safe_reply(
+        interaction,
+        "Escolhe a rede social para ligar.\n\n"
+        f"🔑 O teu código será: `{code}`",
+        ephemeral=True,
+        view=ChooseSocialView(code)
+    )
 
-            if custom_id == "vz:iban:view":
-                member = await fetch_member_safe(guild, interaction.user.id)
-                if not member or not is_verified(member):
-                    return await safe_reply(interaction, "⛔ Tens de estar **Verificado** para ver IBAN.", ephemeral=True)
-                row = get_iban(int(interaction.user.id))
-                if not row:
-                    return await safe_reply(interaction, "⚠️ Ainda não tens IBAN guardado.", ephemeral=True)
-                raw = str(row[0])
-                masked = raw[:6] + "…" + raw[-4:] if len(raw) > 12 else raw
-                await safe_reply(interaction, f"🏦 O teu IBAN: **{masked}**", ephemeral=True)
-                return
+@ROUTER.route("vz:connect:{social}:{code}", defer="never")
+async def route_connect_social(interaction: discord.Interaction, guild: discord.Guild, social: str, code: str):
+    await safe_send_modal(interaction, UsernameModal(social=social, code=code), fallback_text="⚠️ Tenta novamente ligar a conta.")
+
+@ROUTER.route("vz:view_account")
+async def route_view_account(interaction: discord.Interaction, guild: discord.Guild):
+    vr = await db_read(get_verification_request, int(interaction.user.id))
+    iban = await db_read(get_iban, int(interaction.user.id))
+    linked = await db_read(list_linked_accounts, int(interaction.user.id))
+
+    status = "NÃO LIGADO"
+    social = "-"
+    username = "-"
+    if vr:
+        _, social, username, _code, st, _, _ = vr
+        status = str(st).upper()
+
+    iban_txt = "NÃO DEFINIDO"
+    if iban and iban[0]:
+        raw = str(iban[0])
+        iban_txt = raw[:6] + "…" + raw[-4:] if len(raw) > 12 else raw
+
+    if linked:
+        linked_lines = []
+        for s, u, _ts in linked:
+            linked_lines.append(f"• **{social_pretty_name(str(s))}**: {u}")
+        linked_txt = "\n".join(linked_lines)
+        linked_view: Optional[discord.ui.View] = LinkedAccountsManageView(linked)
+    else:
+        linked_txt = "Nenhuma conta associada."
+        linked_view = None
+
+    await safe_reply(
+        interaction,
+        "👤 **A tua conta**\n"
+        f"📌 Estado do último pedido: **{status}**\n"
+        f"📱 Última rede do pedido: **{social_pretty_name(str(social)) if social != '-' else '-'}**\n"
+        f"🏷️ Último username do pedido: **{username}**\n"
+        f"🏦 IBAN: **{iban_txt}**\n\n"
+        f"🔗 **Contas associadas**\n{linked_txt}",
+        ephemeral=True,
+        view=linked_view
+    )
 
-            if custom_id == "vz:iban:delete":
-                member = await fetch_member_safe(guild, interaction.user.id)
-                if not member or not is_verified(member):
-                    return await safe_reply(interaction, "⛔ Tens de estar **Verificado** para gerir IBAN.", ephemeral=True)
+@ROUTER.route("vz:unlink:{social}")
+async def route_unlink(interaction: discord.Interaction, guild: discord.Guild, social: str):
+    member = await fetch_member_safe(guild, interaction.user.id)
+    if not member or not is_verified(member):
+        return await safe_reply(interaction, "⛔ Tens de estar **Verificado** para gerir contas.", ephemeral=True)
 
-                row = get_iban(int(interaction.user.id))
-                if not row:
-                    return await safe_reply(interaction, "⚠️ Ainda não tens IBAN guardado.", ephemeral=True)
+    row = await db_read(get_linked_account, int(interaction.user.id), social)
+    if not row:
+        return await safe_reply(interaction, f"⚠️ Não tens nenhuma conta de **{social_pretty_name(social)}** associada.", ephemeral=True)
+
+    await db_run(delete_linked_account, int(interaction.user.id), social)
+    return await safe_reply(interaction, f"✅ Conta de **{social_pretty_name(social)}** removida com sucesso.", ephemeral=True)
+
+@ROUTER.route("vz:iban:add", defer="never")
+async def route_iban_add(interaction: discord.Interaction, guild: discord.Guild):
+    member = await fetch_member_safe(guild, interaction.user.id)
+    if not member or not is_verified(member):
+        return await safe_reply(interaction, "⛔ Tens de estar **Verificado** para guardar IBAN.", ephemeral=True)
+    await safe_send_modal(interaction, IbanModal(), fallback_text="⚠️ Tenta novamente abrir o painel de IBAN.")
+
+@ROUTER.route("vz:iban:view")
+async def route_iban_view(interaction: discord.Interaction, guild: discord.Guild):
+    member = await fetch_member_safe(guild, interaction.user.id)
+    if not member or not is_verified(member):
+        return await safe_reply(interaction, "⛔ Tens de estar **Verificado** para ver IBAN.", ephemeral=True)
+    row = await db_read(get_iban, int(interaction.user.id))
+    if not row:
+        return await safe_reply(interaction, "⚠️ Ainda não tens IBAN guardado.", ephemeral=True)
+    raw = str(row[0])
+    masked = raw[:6] + "…" + raw[-4:] if len(raw) > 12 else raw
+    await safe_reply(interaction, f"🏦 O teu IBAN: **{masked}**", ephemeral=True)
+
+@ROUTER.route("vz:iban:delete")
+async def route_iban_delete(interaction: discord.Interaction, guild: discord.Guild):
+    member = await fetch_member_safe(guild, interaction.user.id)
+    if not member or not is_verified(member):
+        return await safe_reply(interaction, "⛔ Tens de estar **Verificado** para gerir IBAN.", ephemeral=True)
+
+    row = await db_read(get_iban, int(interaction.user.id))
+    if not row:
+        return await safe_reply(interaction, "⚠️ Ainda não tens IBAN guardado.", ephemeral=True)
 
-                delete_iban(int(interaction.user.id))
-                return await safe_reply(interaction, "✅ IBAN apagado com sucesso.", ephemeral=True)
+    await db_run(delete_iban, int(interaction.user.id))
+    return await safe_reply(interaction, "✅ IBAN apagado com sucesso.", ephemeral=True)
 
-            if custom_id == "vz:support:campaign":
-                await safe_send_modal(interaction, SupportCampaignModal(), fallback_text="⚠️ Tenta novamente abrir **Problema com campanha**.")
-                return
-            if custom_id == "vz:support:question":
-                await safe_send_modal(interaction, SupportQuestionModal(), fallback_text="⚠️ Tenta novamente abrir **Dúvidas**.")
-                return
+@ROUTER.route("vz:support:campaign", defer="never")
+async def route_support_campaign(interaction: discord.Interaction, guild: discord.Guild):
+    await safe_send_modal(interaction, SupportCampaignModal(), fallback_text="⚠️ Tenta novamente abrir **Problema com campanha**.")
 
-            if custom_id == "vz:ticket:close":
-                member = await fetch_member_safe(guild, interaction.user.id)
-                if not member or not is_staff_member(member):
-                    return await safe_reply(interaction, "⛔ Só o staff pode fechar tickets.", ephemeral=True)
+@ROUTER.route("vz:support:question", defer="never")
+async def route_support_question(interaction: discord.Interaction, guild: discord.Guild):
+    await safe_send_modal(interaction, SupportQuestionModal(), fallback_text="⚠️ Tenta novamente abrir **Dúvidas**.")
 
-                try:
-                    ch = interaction.channel
-                    if isinstance(ch, discord.Thread):
-                        await ch.send("✅ Ticket fechado pelo staff. Obrigado!")
-                        await ch.edit(archived=True, locked=True)
-                        return await safe_reply(interaction, "✅ Ticket fechado.", ephemeral=True)
-                    return await safe_reply(interaction, "⚠️ Este botão só funciona dentro do ticket (thread).", ephemeral=True)
-                except Exception as e:
-                    print("⚠️ fechar ticket erro:", e)
-                    return await safe_reply(interaction, "⚠️ Não consegui fechar o ticket agora.", ephemeral=True)
-
-            if custom_id.startswith("vz:verify:approve:") or custom_id.startswith("vz:verify:reject:"):
-                member = await fetch_member_safe(guild, interaction.user.id)
-                if not member or not is_staff_member(member):
-                    return await safe_reply(interaction, "⛔ Sem permissão.", ephemeral=True)
-
-                is_approve = custom_id.startswith("vz:verify:approve:")
-                user_id = int(custom_id.split(":")[-1])
-
-                target_member = await fetch_member_safe(guild, user_id)
-                if not target_member:
-                    return await safe_reply(interaction, "⚠️ Utilizador não encontrado.", ephemeral=True)
-
-                vr = get_verification_request(user_id)
-                social = None
-                username = None
-                if vr:
-                    _, social, username, _code, _st, _, _ = vr
-
-                if is_approve:
-                    role = guild.get_role(VERIFICADO_ROLE_ID)
-                    if role:
-                        try:
-                            await target_member.add_roles(role, reason="Viralizzaa verification approved")
-                        except:
-                            pass
-
-                    set_verification_status(user_id, "approved")
-
-                    if social and username:
-                        existing = get_linked_account(user_id, str(social).lower())
-                        if not existing:
-                            add_linked_account(user_id, str(social).lower(), str(username).strip())
-
-                    await notify_user(
-                        target_member,
-                        "✅ A tua verificação foi **aprovada**!\n\n"
-                        "🏦 Agora adiciona o teu **IBAN Angolano** (para receber pagamentos).",
-                        fallback_channel_id=CHAT_CHANNEL_ID,
-                        view=IbanButtons()
-                    )
-                    await safe_reply(interaction, "✅ Verificação aprovada.", ephemeral=True)
-                else:
-                    set_verification_status(user_id, "rejected")
-                    await notify_user(target_member, "❌ A tua verificação foi **rejeitada**.", fallback_channel_id=CHAT_CHANNEL_ID)
-                    await safe_reply(interaction, "✅ Verificação rejeitada.", ephemeral=True)
+@ROUTER.route("vz:ticket:close")
+async def route_ticket_close(interaction: discord.Interaction, guild: discord.Guild):
+    member = await fetch_member_safe(guild, interaction.user.id)
+    if not member or not is_staff_member(member):
+        return await safe_reply(interaction, "⛔ Só o staff pode fechar tickets.", ephemeral=True)
 
-                try:
-                    await interaction.message.edit(view=None)
-                except:
-                    pass
-                return
-
-            if custom_id == "vz:camp:join":
-                m = await fetch_member_safe(guild, interaction.user.id)
-                if not m or not is_verified(m):
-                    return await safe_reply(interaction, "⛔ Tens de estar **Verificado** para aderir a campanhas.", ephemeral=True)
+    try:
+        ch = interaction.channel
+        if isinstance(ch, discord.Thread):
+            await ch.send("✅ Ticket fechado pelo staff. Obrigado!")
+            await ch.edit(archived=True, locked=True)
+            return await safe_reply(interaction, "✅ Ticket fechado.", ephemeral=True)
+        return await safe_reply(interaction, "⚠️ Este botão só funciona dentro do ticket (thread).", ephemeral=True)
+    except Exception as e:
+        print("⚠️ fechar ticket erro:", e)
+        return await safe_reply(interaction, "⚠️ Não consegui fechar o ticket agora.", ephemeral=True)
+
+@ROUTER.route("vz:verify:approve:{user_id:int}", defer="always", is_approve=True)
+@ROUTER.route("vz:verify:reject:{user_id:int}", defer="always", is_approve=False)
+async def route_verify_decision(interaction: discord.Interaction, guild: discord.Guild, user_id: int, is_approve: bool):
+    member = await fetch_member_safe(guild, interaction.user.id)
+    if not member or not is_staff_member(member):
+        return await safe_reply(interaction, "⛔ Sem permissão.", ephemeral=True)
+
+    target_member = await fetch_member_safe(guild, user_id)
+    if not target_member:
+        return await safe_reply(interaction, "⚠️ Utilizador não encontrado.", ephemeral=True)
+
+    vr = await db_read(get_verification_request, user_id)
+    social = None
+    username = None
+    if vr:
+        _, social, username, _code, _st, _, _ = vr
+
+    if is_approve:
+        role = guild.get_role(VERIFICADO_ROLE_ID)
+        if role:
+            try:
+                await target_member.add_roles(role, reason="Viralizzaa verification approved")
+            except:
+                pass
 
-                msg_id = getattr(interaction.message, "id", None)
-                if not msg_id:
-                    return await safe_reply(interaction, "⚠️ Não consegui identificar a campanha.", ephemeral=True)
+        await db_run(set_verification_status, user_id, "approved")
 
-                conn = db_conn()
-                cur = conn.cursor()
-                cur.execute("""
-                    SELECT id, name, slug, platforms, content_types, audio_url,
-                           rate_kz_per_1k, budget_total_kz, max_payout_user_kz, max_posts_total,
-                           status, category_id, campaign_role_id
-                    FROM campaigns
-                    WHERE post_message_id=?
-                    LIMIT 1
-                """, (int(msg_id),))
-                camp = cur.fetchone()
-                conn.close()
-                if not camp:
-                    return await safe_reply(interaction, "❌ Campanha não encontrada para este post.", ephemeral=True)
-
-                (camp_id, name, slug, platforms, content_types, audio_url,
-                 rate, budget_total, max_user_kz, max_posts_total,
-                 status, category_id, campaign_role_id) = camp
-
-                if str(status) != "active":
-                    return await safe_reply(interaction, "⚠️ Esta campanha já terminou.", ephemeral=True)
-
-                campaign_role = await ensure_campaign_role(guild, int(camp_id), str(slug), campaign_role_id)
-                await ensure_campaign_workspace_private(
-                    guild=guild,
-                    camp_id=int(camp_id),
-                    name=str(name),
-                    slug=str(slug),
-                    platforms=str(platforms),
-                    content_types=str(content_types),
-                    audio_url=str(audio_url or ""),
-                    rate=int(rate),
-                    budget_total=int(budget_total),
-                    max_user_kz=int(max_user_kz),
-                    max_posts_total=int(max_posts_total),
-                    category_id=category_id,
-                    campaign_role=campaign_role
-                )
+        if social and username:
+            existing = await db_read(get_linked_account, user_id, str(social).lower())
+            if not existing:
+                await db_run(add_linked_account, user_id, str(social).lower(), str(username).strip())
 
-                add_campaign_member(int(camp_id), int(interaction.user.id))
+        await notify_user(
+            target_member,
+            "✅ A tua verificação foi **aprovada**!\n\n"
+            "🏦 Agora adiciona o teu **IBAN Angolano** (para receber pagamentos).",
+            fallback_channel_id=CHAT_CHANNEL_ID,
+            view=IbanButtons()
+        )
+        await safe_reply(interaction, "✅ Verificação aprovada.", ephemeral=True)
+    else:
+        await db_run(set_verification_status, user_id, "rejected")
+        await notify_user(target_member, "❌ A tua verificação foi **rejeitada**.", fallback_channel_id=CHAT_CHANNEL_ID)
+        await safe_reply(interaction, "✅ Verificação rejeitada.", ephemeral=True)
 
-                try:
-                    await m.add_roles(campaign_role, reason="Joined campaign")
-                except:
-                    pass
+    try:
+        await interaction.message.edit(view=None)
+    except:
+        pass
 
-                await safe_reply(
-                    interaction,
-                    f"✅ Aderiste à campanha **{name}**!\n\n"
-                    f"Vai ao canal de submissão da campanha para enviar links.",
-                    ephemeral=True
-                )
-                return
+@ROUTER.route("vz:camp:join", defer="always")
+async def route_camp_join(interaction: discord.Interaction, guild: discord.Guild):
+    m = await fetch_member_safe(guild, interaction.user.id)
+    if not m or not is_verified(m):
+        return await safe_reply(interaction, "⛔ Tens de estar **Verificado** para aderir a campanhas.", ephemeral=True)
 
-            if custom_id.startswith("vz:camp:leave:"):
-                camp_id = int(custom_id.split(":")[-1])
+    msg_id = getattr(interaction.message, "id", None)
+    if not msg_id:
+        return await safe_reply(interaction, "⚠️ Não consegui identificar a campanha.", ephemeral=True)
 
-                if not is_campaign_member(int(camp_id), int(interaction.user.id)):
-                    return await safe_reply(interaction, "⚠️ Tu não estás nesta campanha.", ephemeral=True)
+    camp_id = CAMPAIGN_INDEX.campaign_for_message(int(msg_id))
+    camp = await campaign_config(camp_id) if camp_id else None
+    if not camp:
+        return await safe_reply(interaction, "❌ Campanha não encontrada para este post.", ephemeral=True)
+
+    if camp.status != "active":
+        return await safe_reply(interaction, "⚠️ Esta campanha já terminou.", ephemeral=True)
+
+    campaign_role = await ensure_campaign_role(guild, camp.id, camp.slug, camp.campaign_role_id)
+    await ensure_campaign_workspace_private(
+        guild=guild,
+        camp_id=camp.id,
+        name=camp.name,
+        slug=camp.slug,
+        platforms=camp.platforms,
+        content_types=camp.content_types,
+        audio_url=camp.audio_url,
+        rate=camp.rate_kz_per_1k,
+        budget_total=camp.budget_total_kz,
+        max_user_kz=camp.max_payout_user_kz,
+        max_posts_total=camp.max_posts_total,
+        category_id=camp.category_id,
+        campaign_role=campaign_role
+    )
 
-                reset_user_in_campaign(int(camp_id), int(interaction.user.id), refund_budget=True)
+    await db_run(add_campaign_member, camp.id, int(interaction.user.id))
 
-                mem = await fetch_member_safe(guild, interaction.user.id)
-                if mem:
-                    await remove_campaign_role_from_member(guild, int(camp_id), mem)
+    try:
+        await m.add_roles(campaign_role, reason="Joined campaign")
+    except:
+        pass
 
-                await update_leaderboard_for_campaign(int(camp_id))
-                await safe_reply(interaction, "✅ Saíste da campanha e foi feito reset (vídeos/estatísticas removidos).", ephemeral=True)
-                return
+    await safe_reply(
+        interaction,
+        f"✅ Aderiste à campanha **{camp.name}**!\n\n"
+        f"Vai ao canal de submissão da campanha para enviar links.",
+        ephemeral=True
+    )
 
-            if custom_id.startswith("vz:submit:open:"):
-                camp_id = int(custom_id.split(":")[-1])
-                await safe_send_modal(interaction, SubmitLinkModal(camp_id), fallback_text="⚠️ Tenta novamente clicar em **Submeter link**.")
-                return
+@ROUTER.route("vz:camp:leave:{camp_id:int}")
+async def route_camp_leave(interaction: discord.Interaction, guild: discord.Guild, camp_id: int):
+    if not await db_read(is_campaign_member, int(camp_id), int(interaction.user.id)):
+        return await safe_reply(interaction, "⚠️ Tu não estás nesta campanha.", ephemeral=True)
+
+    await db_run(reset_user_in_campaign, int(camp_id), int(interaction.user.id), refund_budget=True)
+
+    mem = await fetch_member_safe(guild, interaction.user.id)
+    if mem:
+        await remove_campaign_role_from_member(guild, int(camp_id), mem)
+
+    await update_leaderboard_for_campaign(int(camp_id))
+    await safe_reply(interaction, "✅ Saíste da campanha e foi feito reset (vídeos/estatísticas removidos).", ephemeral=True)
+
+@ROUTER.route("vz:submit:open:{camp_id:int}", defer="never")
+async def route_submit_open(interaction: discord.Interaction, guild: discord.Guild, camp_id: int):
+    await safe_send_modal(interaction, SubmitLinkModal(camp_id), fallback_text="⚠️ Tenta novamente clicar em **Submeter link**.")
+
+@ROUTER.route("vz:submit:remove:{camp_id:int}", defer="never")
+async def route_submit_remove(interaction: discord.Interaction, guild: discord.Guild, camp_id: int):
+    await safe_send_modal(interaction, RemoveLinkModal(camp_id), fallback_text="⚠️ Tenta novamente clicar em **Retirar vídeo**.")
+
+@ROUTER.route("vz:submit:stats:{camp_id:int}")
+async def route_submit_stats(interaction: discord.Interaction, guild: discord.Guild, camp_id: int):
+    if not await db_read(is_campaign_member, int(camp_id), int(interaction.user.id)):
+        return await safe_reply(interaction, "⛔ Primeiro tens de **aderir** à campanha.", ephemeral=True)
+
+    approved, pending, total = await db_read(get_user_submission_counts, int(camp_id), int(interaction.user.id))
+    paid_kz, views_paid, views_current_sum = await db_read(get_user_campaign_stats, int(camp_id), int(interaction.user.id))
+
+    await safe_reply(
+        interaction,
+        "📊 **As tuas estatísticas nesta campanha**\n"
+        f"✅ Aprovados: **{approved}/{MAX_APPROVED_PER_USER}**\n"
+        f"⏳ Pendentes: **{pending}**\n"
+        f"📥 Total submetidos (ativos): **{total}**\n\n"
+        f"💰 Pago (estimado): **{paid_kz:,} Kz**\n"
+        f"👁️ Views pagas: **{views_paid:,}**\n"
+        f"👀 Views atuais (aprovados): **{views_current_sum:,}**",
+        ephemeral=True
+    )
 
-            if custom_id.startswith("vz:submit:remove:"):
-                camp_id = int(custom_id.split(":")[-1])
-                await safe_send_modal(interaction, RemoveLinkModal(camp_id), fallback_text="⚠️ Tenta novamente clicar em **Retirar vídeo**.")
-                return
+@ROUTER.route("vz:sub:approve:{submission_id:int}", defer="always", is_approve=True)
+@ROUTER.route("vz:sub:reject:{submission_id:int}", defer="never", is_approve=False)
+async def route_submission_decision(interaction: discord.Interaction, guild: discord.Guild, submission_id: int, is_approve: bool):
+    staff = await fetch_member_safe(guild, interaction.user.id)
+    if not staff or not is_staff_member(staff):
+        return await safe_reply(interaction, "⛔ Sem permissão.", ephemeral=True)
 
-            if custom_id.startswith("vz:submit:stats:"):
-                camp_id = int(custom_id.split(":")[-1])
+    if is_approve:
+        outcome, row = await db_run(review_submission, submission_id, True)
+    else:
+        # rejeitar só abre o modal: lê fora da fila do writer para caber na janela de 3s
+        outcome, row = await db_read(peek_submission_review, submission_id)
+        if outcome == "not_member":
+            outcome, row = await db_run(review_submission, submission_id, False)
+    if not row:
+        return await safe_reply(interaction, "❌ Submission não encontrada.", ephemeral=True)
 
-                if not is_campaign_member(int(camp_id), int(interaction.user.id)):
-                    return await safe_reply(interaction, "⛔ Primeiro tens de **aderir** à campanha.", ephemeral=True)
+    sid, camp_id, user_id, post_url, _st, camp_name, camp_status, max_user_kz, platform = row
+    camp_id = int(camp_id); user_id = int(user_id)
+    post_url = str(post_url)
+    max_user_kz = int(max_user_kz)
+    platform = str(platform)
 
-                approved, pending, total = get_user_submission_counts(int(camp_id), int(interaction.user.id))
+    if outcome == "reject":
+        await safe_send_modal(
+            interaction,
+            RejectSubmissionReasonModal(
+                submission_id=int(sid),
+                campaign_id=int(camp_id),
+                user_id=int(user_id),
+                post_url=str(post_url),
+                camp_name=str(camp_name),
+            ),
+            fallback_text="⚠️ Não consegui abrir a caixa do motivo da rejeição."
+        )
+        return
 
-                conn = db_conn()
-                cur = conn.cursor()
-                cur.execute("SELECT COALESCE(paid_kz,0), COALESCE(total_views_paid,0) FROM campaign_users WHERE campaign_id=? AND user_id=?",
-                            (int(camp_id), int(interaction.user.id)))
-                row = cur.fetchone() or (0, 0)
-                paid_kz, views_paid = int(row[0] or 0), int(row[1] or 0)
+    target_member = await fetch_member_safe(guild, user_id)
+
+    auto_rejections = {
+        "not_member": (
+            "❌ O teu link não foi aprovado porque já não estás na campanha.\n",
+            "✅ Rejeitado (user já saiu da campanha).",
+        ),
+        "ended": (
+            "❌ O teu link não foi aprovado porque a campanha já terminou.\n",
+            "✅ Não aprovado (campanha terminada).",
+        ),
+        "user_max": (
+            f"⛔ O teu link não foi aprovado porque já atingiste o teu limite (**{max_user_kz:,} Kz**) nesta campanha.\n",
+            "✅ Rejeitado (limite individual atingido).",
+        ),
+        "approved_limit": (
+            f"⛔ O teu link não foi aprovado porque já tens **{MAX_APPROVED_PER_USER} vídeos aprovados** nesta campanha.\n",
+            "✅ Rejeitado (limite de aprovados atingido).",
+        ),
+    }
+    if outcome in auto_rejections:
+        user_txt, staff_txt = auto_rejections[outcome]
+        if target_member:
+            await notify_user(
+                target_member,
+                user_txt + f"🔗 {post_url}",
+                fallback_channel_id=CHAT_CHANNEL_ID
+            )
+        try:
+            await interaction.message.edit(view=None)
+        except:
+            pass
+        await safe_reply(interaction, staff_txt, ephemeral=True)
+        await update_leaderboard_for_campaign(int(camp_id))
+        return
 
-                cur.execute("""
-                    SELECT COALESCE(SUM(views_current),0)
-                    FROM submissions
-                    WHERE campaign_id=? AND user_id=? AND status='approved'
-                """, (int(camp_id), int(interaction.user.id)))
-                views_current_sum = int((cur.fetchone() or [0])[0] or 0)
-                conn.close()
-
-                await safe_reply(
-                    interaction,
-                    "📊 **As tuas estatísticas nesta campanha**\n"
-                    f"✅ Aprovados: **{approved}/{MAX_APPROVED_PER_USER}**\n"
-                    f"⏳ Pendentes: **{pending}**\n"
-                    f"📥 Total submetidos (ativos): **{total}**\n\n"
-                    f"💰 Pago (estimado): **{paid_kz:,} Kz**\n"
-                    f"👁️ Views pagas: **{views_paid:,}**\n"
-                    f"👀 Views atuais (aprovados): **{views_current_sum:,}**",
-                    ephemeral=True
-                )
-                return
+    linked = await db_read(get_linked_account, user_id, platform)
+    linked_txt = linked[0] if linked else "Não encontrada"
 
-            if custom_id.startswith("vz:sub:approve:") or custom_id.startswith("vz:sub:reject:"):
-                staff = await fetch_member_safe(guild, interaction.user.id)
-                if not staff or not is_staff_member(staff):
-                    return await safe_reply(interaction, "⛔ Sem permissão.", ephemeral=True)
+    if target_member:
+        await notify_user(
+            target_member,
+            "✅ O teu vídeo foi **aprovado**!\n"
+            f"📱 Conta {social_pretty_name(platform)}: **{linked_txt}**\n"
+            f"🔗 {post_url}",
+            fallback_channel_id=CHAT_CHANNEL_ID
+        )
 
-                is_approve = custom_id.startswith("vz:sub:approve:")
-                submission_id = int(custom_id.split(":")[-1])
+    await safe_reply(interaction, f"✅ Aprovado. (Campanha: {camp_name})", ephemeral=True)
 
-                conn = db_conn()
-                cur = conn.cursor()
-                cur.execute("""
-                    SELECT s.id, s.campaign_id, s.user_id, s.post_url, s.status,
-                           c.name, c.status, c.max_payout_user_kz, s.platform
-                    FROM submissions s
-                    JOIN campaigns c ON c.id = s.campaign_id
-                    WHERE s.id=?
-                """, (int(submission_id),))
-                row = cur.fetchone()
-                if not row:
-                    conn.close()
-                    return await safe_reply(interaction, "❌ Submission não encontrada.", ephemeral=True)
-
-                sid, camp_id, user_id, post_url, _st, camp_name, camp_status, max_user_kz, platform = row
-                camp_id = int(camp_id); user_id = int(user_id)
-                post_url = str(post_url)
-                max_user_kz = int(max_user_kz)
-                platform = str(platform)
-
-                target_member = await fetch_member_safe(guild, user_id)
-
-                if not is_campaign_member(camp_id, user_id):
-                    cur.execute("""
-                        UPDATE submissions
-                        SET status='rejected',
-                            is_tracking=0,
-                            next_check_at=NULL
-                        WHERE id=?
-                    """, (int(sid),))
-                    conn.commit()
-                    conn.close()
-                    if target_member:
-                        await notify_user(
-                            target_member,
-                            "❌ O teu link não foi aprovado porque já não estás na campanha.\n"
-                            f"🔗 {post_url}",
-                            fallback_channel_id=CHAT_CHANNEL_ID
-                        )
-                    try:
-                        await interaction.message.edit(view=None)
-                    except:
-                        pass
-                    await safe_reply(interaction, "✅ Rejeitado (user já saiu da campanha).", ephemeral=True)
-                    await update_leaderboard_for_campaign(int(camp_id))
-                    return
+    try:
+        await interaction.message.edit(view=None)
+    except:
+        pass
 
-                if str(camp_status) != "active" and is_approve:
-                    cur.execute("""
-                        UPDATE submissions
-                        SET status='rejected',
-                            is_tracking=0,
-                            next_check_at=NULL
-                        WHERE id=?
-                    """, (int(sid),))
-                    conn.commit()
-                    conn.close()
-                    if target_member:
-                        await notify_user(
-                            target_member,
-                            "❌ O teu link não foi aprovado porque a campanha já terminou.\n"
-                            f"🔗 {post_url}",
-                            fallback_channel_id=CHAT_CHANNEL_ID
-                        )
-                    try:
-                        await interaction.message.edit(view=None)
-                    except:
-                        pass
-                    await safe_reply(interaction, "✅ Não aprovado (campanha terminada).", ephemeral=True)
-                    await update_leaderboard_for_campaign(int(camp_id))
-                    return
+    await update_leaderboard_for_campaign(int(camp_id))
 
-                paid_kz, _mn = get_user_paid_in_campaign(int(camp_id), int(user_id))
-                if paid_kz >= max_user_kz and is_approve:
-                    cur.execute("""
-                        UPDATE submissions
-                        SET status='rejected',
-                            is_tracking=0,
-                            next_check_at=NULL
-                        WHERE id=?
-                    """, (int(sid),))
-                    conn.commit()
-                    conn.close()
-                    if target_member:
-                        await notify_user(
-                            target_member,
-                            f"⛔ O teu link não foi aprovado porque já atingiste o teu limite (**{max_user_kz:,} Kz**) nesta campanha.\n"
-                            f"🔗 {post_url}",
-                            fallback_channel_id=CHAT_CHANNEL_ID
-                        )
-                    try:
-                        await interaction.message.edit(view=None)
-                    except:
-                        pass
-                    await safe_reply(interaction, "✅ Rejeitado (limite individual atingido).", ephemeral=True)
-                    await update_leaderboard_for_campaign(int(camp_id))
-                    return
+@bot.event
+async def on_interaction(interaction: discord.Interaction):
+    try:
+        if interaction.type == discord.InteractionType.component:
+            data = interaction.data or {}
+            custom_id = (data.get("custom_id") or "").strip()
+            if not custom_id:
+                return
 
-                if is_approve:
-                    approved_count, _, _ = get_user_submission_counts(camp_id, user_id)
-                    if approved_count >= MAX_APPROVED_PER_USER:
-                        cur.execute("""
-                            UPDATE submissions
-                            SET status='rejected',
-                                is_tracking=0,
-                                next_check_at=NULL
-                            WHERE id=?
-                        """, (int(sid),))
-                        conn.commit()
-                        conn.close()
-                        if target_member:
-                            await notify_user(
-                                target_member,
-                                f"⛔ O teu link não foi aprovado porque já tens **{MAX_APPROVED_PER_USER} vídeos aprovados** nesta campanha.\n"
-                                f"🔗 {post_url}",
-                                fallback_channel_id=CHAT_CHANNEL_ID
-                            )
-                        try:
-                            await interaction.message.edit(view=None)
-                        except:
-                            pass
-                        await safe_reply(interaction, "✅ Rejeitado (limite de aprovados atingido).", ephemeral=True)
-                        await update_leaderboard_for_campaign(int(camp_id))
-                        return
-
-                    approved_ts = _now()
-                    cur.execute("""
-                        UPDATE submissions
-                        SET status='approved',
-                            approved_at=?,
-                            is_tracking=1,
-                            stale_checks=0,
-                            last_checked_at=NULL,
-                            next_check_at=?,
-                            last_views_snapshot=0
-                        WHERE id=?
-                    """, (
-                        int(approved_ts),
-                        int(approved_ts + hours_to_seconds(NEW_VIDEO_CHECK_HOURS)),
-                        int(sid)
-                    ))
-                    conn.commit()
-                    conn.close()
-
-                    linked = get_linked_account(user_id, platform)
-                    linked_txt = linked[0] if linked else "Não encontrada"
-
-                    if target_member:
-                        await notify_user(
-                            target_member,
-                            "✅ O teu vídeo foi **aprovado**!\n"
-                            f"📱 Conta {social_pretty_name(platform)}: **{linked_txt}**\n"
-                            f"🔗 {post_url}",
-                            fallback_channel_id=CHAT_CHANNEL_ID
-                        )
-
-                    await safe_reply(interaction, f"✅ Aprovado. (Campanha: {camp_name})", ephemeral=True)
-
-                    try:
-                        await interaction.message.edit(view=None)
-                    except:
-                        pass
-
-                    await update_leaderboard_for_campaign(int(camp_id))
-                    return
+            guild = interaction.guild or bot.get_guild(SERVER_ID)
+            if not guild:
+                return
 
-                else:
-                    conn.close()
-                    await safe_send_modal(
-                        interaction,
-                        RejectSubmissionReasonModal(
-                            submission_id=int(sid),
-                            campaign_id=int(camp_id),
-                            user_id=int(user_id),
-                            post_url=str(post_url),
-                            camp_name=str(camp_name),
-                        ),
-                        fallback_text="⚠️ Não consegui abrir a caixa do motivo da rejeição."
-                    )
-                    return
+            if await ROUTER.dispatch(interaction, guild, custom_id):
+                return
 
         try:
             await bot.process_application_commands(interaction)  # type: ignore
@@ -2994,7 +5207,8 @@ async def on_interaction(interaction: discord.Interaction):
 # =========================
 @bot.event
 async def on_ready():
-    init_db()
+    await db_run(init_db)
+    await db_run(load_campaign_index)
 
     if not getattr(bot, "_views_added", False):
         bot.add_view(MainView())
@@ -3004,16 +5218,37 @@ async def on_ready():
         bot.add_view(CloseTicketView())
         bot._views_added = True
 
-    try:
-        await reattach_pending_verification_views()
-        await reattach_submit_panels()
-    except Exception as e:
-        print("⚠️ Erro ao reanexar views:", e)
+    # em background: o bot fica interativo enquanto os painéis são reanexados
+    if getattr(bot, "_reattach_task", None) is None or bot._reattach_task.done():
+        bot._reattach_task = asyncio.create_task(reattach_panels_background())
+
+    if getattr(bot, "_scheduler_task", None) is None or bot._scheduler_task.done():
+        bot._scheduler_task = asyncio.create_task(refresh_scheduler_loop())
 
-    if not refresh_views_loop.is_running():
-        refresh_views_loop.start()
+    if getattr(bot, "_notify_task", None) is None or bot._notify_task.done():
+        bot._notify_task = asyncio.create_task(notification_queue_loop())
 
-    print(f"✅ Bot ligado como {bot.user}!")
+    guild = bot.get_guild(SERVER_ID)
+    if guild and not guild.chunked:
+        try:
+            await guild.chunk()
+            print(f"[MEMBERS] cache carregada: {guild.member_count} membros")
+        except Exception as e:
+            print("⚠️ guild.chunk falhou:", e)
+
+    if not getattr(bot, "_ready_once", False):
+        bot._ready_once = True
+        print(f"✅ Bot ligado como {bot.user}! (arranque em {time.monotonic() - BOOT_STARTED_AT:.1f}s)")
+    else:
+        print(f"✅ Bot religado como {bot.user}!")
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    MEMBER_ABSENT.pop(int(member.id), None)
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    mark_member_absent(int(member.id))
 
 # =========================
 # WEB
@@ -3024,6 +5259,18 @@ app = Flask(__name__)
 def home():
     return "Viralizza Bot is running!"
 
+@app.post("/apify/webhook")
+def apify_webhook():
+    if not APIFY_WEBHOOKS_ENABLED or not secrets.compare_digest(request.args.get("secret") or "", APIFY_WEBHOOK_SECRET):
+        return "forbidden", 403
+    data = request.get_json(silent=True) or {}
+    run = data.get("resource") or {}
+    run_id = run.get("id") or (data.get("eventData") or {}).get("actorRunId")
+    loop = APIFY_LOOP
+    if run_id and loop is not None and not loop.is_closed():
+        loop.call_soon_threadsafe(resolve_apify_waiter, str(run_id), run)
+    return "ok", 200
+
 def run_web():
     port = int(os.getenv("PORT", "8080"))
     app.run(host="0.0.0.0", port=port)
@@ -3036,6 +5283,10 @@ def keep_alive():
 # SHUTDOWN
 # =========================
 async def _graceful_shutdown():
+    try:
+        await flush_dirty_leaderboards()
+    except Exception:
+        pass
     try:
         await close_http_session()
     except Exception:
@@ -3044,6 +5295,10 @@ async def _graceful_shutdown():
         await bot.close()
     except Exception:
         pass
+    # shutdown(wait=True) bloqueia até o writer esvaziar: fora do event loop
+    await asyncio.to_thread(DB_READ_EXECUTOR.shutdown, True)
+    await asyncio.to_thread(DB_EXECUTOR.shutdown, True)
+    close_db_connections()
 
 def _handle_sigterm(*_):
     try:
@@ -3058,5 +5313,6 @@ signal.signal(signal.SIGINT, _handle_sigterm)
 # =========================
 # RUN
 # =========================
-keep_alive()
-bot.run(BOT_TOKEN)
+if __name__ == "__main__":
+    keep_alive()
+    bot.run(BOT_TOKEN)
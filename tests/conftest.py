@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# bot.py lê a config do ambiente no import: token falso e uma DB temporária só para os testes
+os.environ.setdefault("TOKEN", "test-token-0000")
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="viralizza-tests-"), "test.sqlite3"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
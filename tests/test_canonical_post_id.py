@@ -0,0 +1,24 @@
+import pytest
+
+import bot
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://www.tiktok.com/@someone/video/7301234567890123456?is_from_webapp=1", "tiktok:7301234567890123456"),
+    ("https://www.instagram.com/reel/CxYz_AbC123/?igsh=abc", "instagram:CxYz_AbC123"),
+    ("https://instagram.com/p/CxYz_AbC123", "instagram:CxYz_AbC123"),
+    ("https://youtu.be/dQw4w9WgXcQ?t=10", "youtube:dQw4w9WgXcQ"),
+    ("https://www.youtube.com/shorts/dQw4w9WgXcQ", "youtube:dQw4w9WgXcQ"),
+])
+def test_known_platforms_use_post_id(url, expected):
+    assert bot.canonical_post_id(url) == expected
+
+
+def test_fallback_keeps_path_case():
+    # vm.tiktok.com/ZMabc e vm.tiktok.com/ZMABC são links diferentes
+    assert bot.canonical_post_id("HTTPS://VM.TikTok.com/ZMabcDEF/") == "vm.tiktok.com/ZMabcDEF"
+    assert bot.canonical_post_id("https://vm.tiktok.com/ZMABCDEF") != bot.canonical_post_id("https://vm.tiktok.com/ZMabcdef")
+
+
+def test_fallback_drops_www_query_and_fragment():
+    assert bot.canonical_post_id("http://WWW.Example.com/Some/Path?x=1#frag") == "example.com/Some/Path"
@@ -0,0 +1,60 @@
+import pytest
+
+import bot
+
+HOUR = 3600
+APPROVED_AT = 1_700_000_000
+
+
+def viral_then_flat_history():
+    # série gravada de hora a hora durante 10 dias: 10k views/h no 1º dia, depois quase parado
+    points = []
+    views = 0
+    for h in range(0, 24 * 10 + 1):
+        points.append((APPROVED_AT + h * HOUR, views))
+        views += 10_000 if h < 24 else 10
+    return points
+
+
+def count_between(checks, start_h, end_h):
+    return sum(1 for ts, _ in checks if APPROVED_AT + start_h * HOUR <= ts < APPROVED_AT + end_h * HOUR)
+
+
+def test_base_policy_is_abstract():
+    with pytest.raises(TypeError):
+        bot.CheckPolicy()
+
+
+def test_age_policy_replays_fixed_buckets():
+    checks = bot.simulate_check_policy(bot.AgeBucketPolicy(), viral_then_flat_history(), APPROVED_AT)
+    first = APPROVED_AT + bot.hours_to_seconds(bot.NEW_VIDEO_CHECK_HOURS)
+    assert checks[0][0] == first
+    assert [ts for ts, _ in checks] == sorted(ts for ts, _ in checks)
+    assert count_between(checks, 0, 24) == 24 // bot.NEW_VIDEO_CHECK_HOURS - 1
+
+
+def test_velocity_policy_follows_the_video():
+    history = viral_then_flat_history()
+    age = bot.simulate_check_policy(bot.AgeBucketPolicy(), history, APPROVED_AT)
+    velocity = bot.simulate_check_policy(bot.VelocityPolicy(), history, APPROVED_AT)
+
+    # mais checks enquanto o vídeo cresce depressa, menos quando estagna
+    assert count_between(velocity, 0, 24) > count_between(age, 0, 24)
+    assert count_between(velocity, 48, 24 * 10) < count_between(age, 48, 24 * 10)
+    assert all(b - a >= bot.VELOCITY_MIN_CHECK_MINUTES * 60 for (a, _), (b, _) in zip(velocity, velocity[1:]))
+
+
+@pytest.mark.parametrize("policy", [bot.AgeBucketPolicy(), bot.VelocityPolicy()])
+def test_less_than_one_payout_block_left_stops_checks(policy):
+    # 62 blocos de 800 Kz = 49 600 Kz de 50 000: os 400 Kz que sobram nunca podem ser pagos
+    history = [(APPROVED_AT + h * HOUR, 62_500) for h in range(0, 24 * 20)]
+    checks = bot.simulate_check_policy(policy, history, APPROVED_AT, rate_kz_per_1k=800, max_user_kz=50_000)
+    assert len(checks) == 1
+
+
+def test_views_to_next_limit_ignores_sub_block_remainders():
+    ctx = bot.CheckContext(
+        now_ts=APPROVED_AT + 10 * HOUR, approved_at=APPROVED_AT, stale_checks=0, views=62_500,
+        paid_views=62_000, rate_kz_per_1k=800, remaining_user_kz=400, remaining_budget_kz=8_000,
+    )
+    assert ctx.views_to_next_limit() == 10_000 - 500
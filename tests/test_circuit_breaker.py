@@ -0,0 +1,56 @@
+import asyncio
+
+import bot
+
+
+def make_breaker() -> bot.CircuitBreaker:
+    br = bot.CircuitBreaker("test")
+    # aberto e já expirado: o próximo allow() passa a half_open e leva o pedido de teste
+    br.state = "open"
+    br.open_until = 0
+    return br
+
+
+def test_half_open_gives_retry_time_while_probe_runs():
+    br = make_breaker()
+    assert br.retry_at() is None
+    assert br.allow()
+    assert br.state == "half_open"
+    assert not br.allow()
+    assert br.retry_at() is not None
+    br.record(True)
+    br.release_probe()
+    assert br.state == "closed"
+    assert br.retry_at() is None
+
+
+def test_urls_skipped_during_probe_stay_deferred_after_it_closes(monkeypatch):
+    bot.init_db()
+    br = make_breaker()
+
+    class ProbeProvider(bot.ViewProvider):
+        platform = "tiktok"
+        concurrency = 3
+
+        def deferred_until(self):
+            return br.retry_at()
+
+        async def fetch_views(self, urls):
+            if not br.allow():
+                return None
+            await asyncio.sleep(0.05)
+            br.record(True)
+            br.release_probe()
+            return {bot.canonical_post_id(u): 100 for u in urls}
+
+    monkeypatch.setitem(bot.VIEW_PROVIDERS, "tiktok", ProbeProvider())
+    urls = [f"https://www.tiktok.com/@a/video/7300000000000000{i:03d}" for i in range(3)]
+    deferred = {}
+    results = asyncio.run(bot.get_views_for_urls(urls, deferred))
+
+    assert br.state == "closed"
+    assert sum(1 for v in results.values() if v == 100) == 1
+    skipped = [u for u, v in results.items() if v is None]
+    assert len(skipped) == 2
+    assert set(deferred) == set(skipped)
+    assert all(ts > bot._now() for ts in deferred.values())
@@ -0,0 +1,68 @@
+import bot
+
+DAY = 24 * 3600
+NOW = 1_700_006_400 + 12 * 3600  # meio de um bucket diário
+
+
+def seed(points):
+    bot.init_db()
+    conn = bot.db_conn()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM view_snapshots")
+    cur.execute("DELETE FROM submissions")
+    cur.execute(
+        "INSERT INTO submissions (id, campaign_id, user_id, post_url, platform, created_at) VALUES (1, 1, 1, 'u', 'tiktok', ?)",
+        (NOW - 400 * DAY,),
+    )
+    cur.executemany("INSERT INTO view_snapshots (submission_id, ts, views) VALUES (?, ?, ?)", points)
+    conn.commit()
+    conn.close()
+
+
+def stored():
+    conn = bot.db_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT submission_id, ts FROM view_snapshots ORDER BY submission_id, ts")
+    rows = cur.fetchall()
+    conn.close()
+    return [(int(sid), NOW - int(ts)) for sid, ts in rows]
+
+
+def test_compaction_retention_and_downsampling_boundaries():
+    full_res_cutoff = NOW - bot.SNAPSHOT_FULL_RES_DAYS * DAY
+    retention_cutoff = NOW - bot.SNAPSHOT_RETENTION_DAYS * DAY
+    bucket = bot.hours_to_seconds(bot.SNAPSHOT_DOWNSAMPLE_HOURS)
+    old_bucket = (NOW - 30 * DAY) // bucket * bucket
+
+    seed([
+        (1, retention_cutoff - 1, 10),        # passou da retenção
+        (1, retention_cutoff, 11),            # no limite da retenção: fica
+        (1, old_bucket + 60, 20),             # mesmo bucket antigo: só o último fica
+        (1, old_bucket + 3600, 21),
+        (1, old_bucket + bucket - 1, 22),
+        (1, full_res_cutoff - 1, 30),         # último ponto antes do corte: nada mais novo antes do corte
+        (1, full_res_cutoff, 31),             # resolução total a partir daqui
+        (1, NOW - 3600, 40),
+        (1, NOW - 60, 41),
+        (999, NOW - 60, 1),                   # submission apagada
+    ])
+
+    removed = bot.compact_view_snapshots(now_ts=NOW)
+
+    assert stored() == [
+        (1, NOW - retention_cutoff),
+        (1, NOW - (old_bucket + bucket - 1)),
+        (1, NOW - (full_res_cutoff - 1)),
+        (1, NOW - full_res_cutoff),
+        (1, 3600),
+        (1, 60),
+    ]
+    assert removed == 4
+
+
+def test_compaction_is_idempotent():
+    seed([(1, NOW - 30 * DAY + h * 3600, h) for h in range(48)])
+    bot.compact_view_snapshots(now_ts=NOW)
+    first = stored()
+    assert bot.compact_view_snapshots(now_ts=NOW) == 0
+    assert stored() == first